@@ -26,9 +26,10 @@ import time
 import digitalio
 from micropython import const
 from simpleio import map_range
+from .at_reply import bytes_field, has_prefix, int_field
 
 try:
-    from typing import Optional, Tuple, Union
+    from typing import Callable, Optional, Tuple, Union
     from circuitpython_typing import ReadableBuffer
     from busio import UART
     from digitalio import DigitalInOut
@@ -40,16 +41,56 @@ try:
 except ImportError:
     pass
 
+try:
+    from heatseek.wake_profile import span
+except ImportError:
+
+    class span:  # pylint: disable=invalid-name
+        """No-op stand-in when the wake profiler is not installed."""
+
+        def __init__(self, name: str) -> None:
+            pass
+
+        def __enter__(self) -> "span":
+            return self
+
+        def __exit__(self, *args) -> None:
+            pass
+
+
 __version__ = "0.0.0+auto.0"
 __repo__ = "https://github.com/adafruit/Adafruit_CircuitPython_FONA.git"
 
 FONA_DEFAULT_TIMEOUT_MS = 500  # TODO: Check this against arduino...
 
+# Bytes received from the modem are collected here before being split into lines
+FONA_RX_BUFFER_SIZE = const(512)
+# Longest reply handed out by _read_line, longer ones are cut
+FONA_MAX_LINE = const(254)
+# How long a registration status reported by URC is trusted before the
+# modem is asked again
+FONA_URC_TRUST_MS = const(10000)
+
+# Bring-up: how long a module that was just powered on gets to answer AT
+# before it is reset, and how long the reset and the wait after it get
+# together
+FONA_BOOT_TIMEOUT_MS = const(15000)
+FONA_RESET_TIMEOUT_MS = const(25000)
+# Longest the reset line is held low, let go early once the module answers
+FONA_RESET_HOLD_MS = const(10000)
+# Wait for each AT probe's reply, and the range the pause between probes
+# backs off over
+FONA_PROBE_REPLY_MS = const(100)
+FONA_PROBE_MIN_MS = const(50)
+FONA_PROBE_MAX_MS = const(1000)
+
 # Commands
 CMD_AT = b"AT"
 # Replies
 REPLY_OK = b"OK"
 REPLY_AT = b"AT"
+REPLY_ERROR = b"ERROR"
+REPLY_CME_ERROR = b"+CME ERROR"
 
 # Maximum number of fona800 and fona808 sockets
 FONA_MAX_SOCKETS = const(6)
@@ -63,11 +104,67 @@ FONA_3G_A = const(0x4)
 FONA_3G_E = const(0x5)
 SARA_R410M = const(0x7)
 
+# Settings that FONA.state carries across a deep sleep. Append only, they are
+# saved as a bit mask by position
+MODEM_SETTINGS = (
+    b"ATE0",
+    b"AT+CREG=1",
+    b"AT+CMGF=1",
+    b"AT+CSDH=1",
+    b"AT+CNMI=2,1",
+    b"AT+CNMI=2,0",
+    b"AT+CIPHEAD=0",
+    b"AT+CIPSRIP=0",
+    b"AT+CIPRXGET=1",
+)
+
 # FONA preferred SMS storage
 FONA_SMS_STORAGE_SIM = b'"SM"'  # Storage on the SIM
 FONA_SMS_STORAGE_INTERNAL = b'"ME"'  # Internal storage on the FONA
 
 
+def _setting_name(command: bytes) -> bytes:
+    """The part of a setting command that doesn't change with its value,
+    ``AT+CNMI`` for ``AT+CNMI=2,1`` and ``ATE`` for ``ATE0``."""
+    end = command.find(b"=")
+    if end == -1:
+        end = len(command)
+        while end and 48 <= command[end - 1] <= 57:
+            end -= 1
+    return command[:end]
+
+
+def _ticks_ms() -> int:
+    """Milliseconds from the monotonic clock, exact however long the board
+    has been up."""
+    return time.monotonic_ns() // 1000000
+
+
+def modem_responds(uart: UART, timeout: int = 500) -> bool:
+    """Sends ``AT`` and returns True if the module answers ``OK`` within
+    ``timeout`` milliseconds. Use it to tell whether the module stayed on and
+    needs no power pulse before creating a `FONA`.
+
+    :param ~busio.UART uart: FONA UART connection.
+    :param int timeout: Time to wait for the reply, in milliseconds.
+    """
+    uart.reset_input_buffer()
+    uart.write(b"AT\r\n")
+    deadline = _ticks_ms() + timeout
+    seen = b""
+    while _ticks_ms() < deadline:
+        waiting = uart.in_waiting
+        if waiting:
+            seen += uart.read(waiting)
+            if REPLY_OK in seen:
+                return True
+            # keep enough for an OK split across reads
+            seen = seen[-1:]
+        else:
+            time.sleep(0.005)
+    return False
+
+
 # pylint: disable=too-many-instance-attributes, too-many-public-methods
 class FONA:
     """CircuitPython FONA module interface.
@@ -76,6 +173,7 @@ class FONA:
     :param ~digitalio.DigitalInOut rdt: FONA RST pin.
     :param ~digitalio.DigitalInOut ri: Optional FONA Ring Interrupt (RI) pin.
     :param bool debug: Enable debugging output.
+    :param tuple state: `state` saved before a deep sleep, None if unknown.
     """
 
     TCP_MODE = const(0)  # TCP socket
@@ -88,9 +186,50 @@ class FONA:
         rst: DigitalInOut,
         ri: Optional[DigitalInOut] = None,
         debug: bool = False,
+        state: Optional[Tuple[int, int]] = None,
     ) -> None:
         self._buf = b""  # shared buffer
+        # receive buffer, allocated once. Bytes from _rx_start to _rx_end have
+        # been read from the UART but not handed out yet
+        self._rx = bytearray(FONA_RX_BUFFER_SIZE)
+        self._rx_view = memoryview(self._rx)
+        self._rx_start = 0
+        self._rx_end = 0
+        # unsolicited result codes: [(prefix, handler)] and what they reported
+        self._urc_handlers = []
+        self._sms_slots = []
+        self._rx_empty = set()
+        self._closed_sockets = set()
+        self._registration = None
+        self._registration_until = 0
+        self.set_urc_handler(b"+CMTI: ", self._on_new_sms)
+        self.set_urc_handler(b"+CIPRXGET: 1", self._on_socket_data)
+        self.set_urc_handler(b"+UUSORD: ", self._on_socket_data)
+        self.set_urc_handler(b"+CREG: ", self._on_registration)
+        self.set_urc_handler(b"+CEREG: ", self._on_registration)
+        self.set_urc_handler(b"+IPCLOSE: ", self._on_socket_closed)
+        self.set_urc_handler(b"+UUSOCL: ", self._on_socket_closed)
+        # boot announcements, the module is ready for AT commands
+        self._booted = False
+        self.set_urc_handler(b"RDY", self._on_boot)
+        self.set_urc_handler(b"+CPIN: READY", self._on_boot)
+        self.set_urc_handler(b"Call Ready", self._on_boot)
+        self.set_urc_handler(b"SMS Ready", self._on_boot)
+        # how long bring-up took until the module answered AT, and whether it
+        # had to be reset on the way
+        self.ready_ms = 0
+        self.was_reset = False
         self._fona_type = 0
+        # settings in effect on the module, forgotten when it is reset, and its
+        # static identity
+        self._applied = set()
+        self._imei = None
+        self._iccid = None
+        if state is not None:
+            self._fona_type, settings = state
+            self._applied = {
+                setting for bit, setting in enumerate(MODEM_SETTINGS) if settings & 1 << bit
+            }
         #self._debug = debug
         self._debug = True
 
@@ -105,18 +244,22 @@ class FONA:
     # pylint: disable=too-many-branches, too-many-statements
     def _init_fona(self) -> bool:
         """Initializes FONA module."""
-        self.reset()
-
-        timeout = 25000
-        while timeout > 0:
-            if self._send_check_reply(CMD_AT, reply=REPLY_OK):
-                break
-            if self._send_check_reply(CMD_AT, reply=REPLY_AT):
-                break
-            time.sleep(0.5)
-            timeout -= 500
+        start = _ticks_ms()
+        with span("modem_ready"):
+            # a module that is on, or boots by itself, needs no reset
+            ready = self._wait_ready(FONA_BOOT_TIMEOUT_MS)
+        if not ready:
+            deadline = _ticks_ms() + FONA_RESET_TIMEOUT_MS
+            ready = self.reset()
+            self.was_reset = True
+            if not ready:
+                with span("modem_ready"):
+                    ready = self._wait_ready(max(deadline - _ticks_ms(), 0))
+        self.ready_ms = _ticks_ms() - start
+        if self._debug:
+            print("* FONA ready after {} ms".format(self.ready_ms))
 
-        if timeout <= 0:  # no response to AT, last ditch attempt
+        if not ready:  # no response to AT, last ditch attempt
             self._send_check_reply(CMD_AT, reply=REPLY_OK)
             time.sleep(0.1)
             self._send_check_reply(CMD_AT, reply=REPLY_OK)
@@ -124,20 +267,26 @@ class FONA:
             self._send_check_reply(CMD_AT, reply=REPLY_OK)
             time.sleep(0.1)
 
-        # turn off echo
-        self._send_check_reply(b"ATE0", reply=REPLY_OK)
-        time.sleep(0.1)
+        # turn off echo, the first reply can still be the echo of the command
+        if not self._apply_setting(b"ATE0"):
+            time.sleep(0.1)
+            self._read_line()
+            if not self._apply_setting(b"ATE0"):
+                return False
 
-        self._read_line()
-        if not self._send_check_reply(b"ATE0", reply=REPLY_OK):
-            return False
+        # report registration changes as URCs, so network_status needn't ask
+        self._apply_setting(b"AT+CREG=1")
 
         # turn on hangupitude
         # self._send_check_reply(b"AT+CVHU=0", reply=REPLY_OK)
         # time.sleep(0.1)
 
+        if self._fona_type:
+            # identified before a deep sleep
+            return True
+
         self._buf = b""
-        self._uart.reset_input_buffer()
+        self._reset_input()
 
         self._uart_write(b"ATI\r\n")
         self._read_line(multiline=True)
@@ -162,6 +311,36 @@ class FONA:
                 self._fona_type = FONA_800_H
         return True
 
+    def _wait_ready(self, timeout: int) -> bool:
+        """Probes with ``AT`` until the module answers or ``timeout``
+        milliseconds pass. The pause between probes doubles from
+        `FONA_PROBE_MIN_MS` up to `FONA_PROBE_MAX_MS`, and a boot URC such as
+        ``RDY`` cuts it short.
+
+        :param int timeout: Time to keep probing, in milliseconds.
+        """
+        deadline = _ticks_ms() + timeout
+        pause = FONA_PROBE_MIN_MS
+        while True:
+            self._booted = False
+            self._reset_input()
+            self._uart_write(CMD_AT + b"\r\n")
+            self._read_line(FONA_PROBE_REPLY_MS)
+            if self._buf == REPLY_OK:
+                return True
+            if self._buf == REPLY_AT:
+                # echo is back on, the module lost its settings
+                self._applied = set()
+                return True
+            now = _ticks_ms()
+            if now >= deadline:
+                return False
+            until = min(now + pause, deadline)
+            while not self._booted and _ticks_ms() < until:
+                self._poll_urcs()
+                time.sleep(0.01)
+            pause = min(pause * 2, FONA_PROBE_MAX_MS)
+
     def factory_reset(self) -> bool:
         """Resets modem to factory configuration."""
         self._uart_write(b"ATZ\r\n")
@@ -170,8 +349,14 @@ class FONA:
             return False
         return True
 
-    def reset(self) -> None:
-        """Performs a hardware reset on the modem."""
+    def reset(self, hold: int = FONA_RESET_HOLD_MS) -> bool:
+        """Performs a hardware reset on the modem. The reset line is held low
+        for up to ``hold`` milliseconds while probing with ``AT`` as in
+        `_wait_ready`, and let go as soon as the module answers. Returns True
+        if it did.
+
+        :param int hold: Longest time to hold the reset line, in milliseconds.
+        """
         if self._debug:
             print("* Reset FONA")
         # self._rst.switch_to_output()
@@ -182,10 +367,27 @@ class FONA:
         # self._rst.value = True
         
        
-        self._rst.switch_to_output()
-        self._rst.value = False
-        time.sleep(10)
-        self._rst.switch_to_input()
+        with span("modem_reset"):
+            self._rst.switch_to_output()
+            self._rst.value = False
+            ready = self._wait_ready(hold)
+            self._rst.switch_to_input()
+        self._applied = set()
+        self._reset_urcs()
+        return ready
+
+    @property
+    def state(self) -> Tuple[int, int]:
+        """Module type and a bit mask of the `MODEM_SETTINGS` in effect. Pass it
+        back as ``state`` on the next wake to skip identifying and configuring
+        a module that stayed powered. Settings are dropped again if the module
+        turns out to have been reset.
+        """
+        settings = 0
+        for bit, setting in enumerate(MODEM_SETTINGS):
+            if setting in self._applied:
+                settings |= 1 << bit
+        return self._fona_type, settings
 
     @property
     # pylint: disable=too-many-return-statements
@@ -198,14 +400,18 @@ class FONA:
     @property
     def iemi(self) -> str:
         """FONA Module's IEMI (International Mobile Equipment Identity) number."""
+        if self._imei is not None:
+            return self._imei
         if self._debug:
             print("FONA IEMI")
-        self._uart.reset_input_buffer()
+        self._reset_input()
 
         self._uart_write(b"AT+GSN\r\n")
         self._read_line(multiline=True)
-        iemi = self._buf[0:15]
-        return iemi.decode("utf-8")
+        iemi = self._buf[0:15].decode("utf-8")
+        if len(iemi) == 15 and iemi.isdigit():
+            self._imei = iemi
+        return iemi
 
     @property
     def local_ip(self) -> Optional[str]:
@@ -221,21 +427,21 @@ class FONA:
     @property
     def iccid(self) -> str:
         """SIM Card's unique ICCID (Integrated Circuit Card Identifier)."""
+        if self._iccid is not None:
+            return self._iccid
         if self._debug:
             print("ICCID")
         self._uart_write(b"AT+CCID\r\n")
         self._read_line(timeout=2000)  # 6.2.23, 2sec max. response time
         iccid = self._buf.decode()
+        if iccid and "ERROR" not in iccid:
+            self._iccid = iccid
         return iccid
 
     @property
     def gprs(self) -> bool:
         """GPRS (General Packet Radio Services) power status."""
-        if not self._send_parse_reply(b"AT+CGATT?", b"+CGATT: ", ":"):
-            return False
-        if not self._buf:
-            return False
-        return True
+        return bool(self._send_parse_int(b"AT+CGATT?", b"+CGATT: "))
 
     # pylint: disable=too-many-return-statements
     def set_gprs(
@@ -332,14 +538,19 @@ class FONA:
     @property
     def network_status(self) -> int:
         """The status of the cellular network."""
+        self._poll_urcs()
+        if self._registration is not None and _ticks_ms() < self._registration_until:
+            return self._registration
         self._read_line()
         if self._debug:
             print("Network status")
-        if not self._send_parse_reply(b"AT+CREG?", b"+CREG: ", idx=1):
+        status = self._send_parse_int(b"AT+CREG?", b"+CREG: ", idx=1)
+        if status is None:
             return False
-        status = self._buf
-        if not 0 <= self._buf <= 5:
+        if not 0 <= status <= 5:
             status = -1
+        if b"AT+CREG=1" in self._applied:
+            self._set_registration(status)
         return status
 
     @property
@@ -349,10 +560,10 @@ class FONA:
         """
         if self._debug:
             print("RSSI")
-        if not self._send_parse_reply(b"AT+CSQ", b"+CSQ: "):
+        reply_num = self._send_parse_int(b"AT+CSQ", b"+CSQ: ")
+        if reply_num is None:
             return False
 
-        reply_num = self._buf
         rssi = 0
         if reply_num == 0:
             rssi = -115
@@ -397,14 +608,13 @@ class FONA:
 
         # check if already enabled or disabled
         if self._fona_type == FONA_808_V2:
-            if not self._send_parse_reply(b"AT+CGPSPWR?", b"+CGPSPWR: ", ":"):
+            if self._send_parse_int(b"AT+CGPSPWR?", b"+CGPSPWR: ") is None:
                 return False
         self._read_line()
-        if not self._send_parse_reply(b"AT+CGNSPWR?", b"+CGNSPWR: ", ":"):
+        state = self._send_parse_int(b"AT+CGNSPWR?", b"+CGNSPWR: ")
+        if state is None:
             return False
 
-        state = self._buf
-
         if gps_on and not state:
             self._read_line()
             if self._fona_type == FONA_808_V2:  # try GNS
@@ -440,17 +650,18 @@ class FONA:
     @property
     def enable_sms_notification(self) -> bool:
         """Checks if SMS notifications are enabled."""
-        if not self._send_parse_reply(b"AT+CNMI?\r\n", b"+CNMI:", idx=1):
+        mode = self._send_parse_int(b"AT+CNMI?\r\n", b"+CNMI:", idx=1)
+        if mode is None:
             return False
-        return self._buf
+        return mode
 
     @enable_sms_notification.setter
     def enable_sms_notification(self, enable: bool = True) -> bool:
         if enable:
-            if not self._send_check_reply(b"AT+CNMI=2,1\r\n", reply=REPLY_OK):
+            if not self._apply_setting(b"AT+CNMI=2,1"):
                 return False
         else:
-            if not self._send_check_reply(b"AT+CNMI=2,0\r\n", reply=REPLY_OK):
+            if not self._apply_setting(b"AT+CNMI=2,0"):
                 return False
         return True
 
@@ -461,16 +672,15 @@ class FONA:
         :note: This method needs to be polled consistently due to the lack
                of hw-based interrupts in CircuitPython.
         """
-        if self._ri is not None:  # poll the RI pin
-            if self._ri.value:
+        if not self._sms_slots:
+            if self._ri is not None:  # poll the RI pin
+                if self._ri.value:
+                    return False, False
+            self._poll_urcs()  # otherwise, poll the UART
+            if not self._sms_slots:
                 return False, False
-        if not self._uart.in_waiting:  # otherwise, poll the UART
-            return False, False
 
-        self._read_line()  # parse the rcv'd URC
-        if not self._parse_reply(b"+CMTI: ", idx=1):
-            return False, False
-        slot = self._buf
+        slot = self._sms_slots.pop(0)
         sender, message = self.read_sms(slot)
 
         if not self.delete_sms(slot):  # delete sms from module memory
@@ -478,6 +688,12 @@ class FONA:
 
         return sender, message.strip()
 
+    def sms_text_mode(self) -> bool:
+        """Selects SMS text mode (4.2.2), skipped while the module is known to
+        be in it.
+        """
+        return self._apply_setting(b"AT+CMGF=1")
+
     def send_sms(self, phone_number: int, message: str) -> bool:
         """Sends a message SMS to a phone number.
 
@@ -487,10 +703,18 @@ class FONA:
         if not hasattr(phone_number, "to_bytes"):
             raise TypeError("Phone number must be integer")
 
+        with span("sms_send"):
+            return self._send_sms(phone_number, message)
+
+    def _send_sms(self, phone_number: int, message: str) -> bool:
+        """Runs the ``AT+CMGS`` exchange for `send_sms`."""
         # select SMS message format, text mode (4.2.2)
-        if not self._send_check_reply(b"AT+CMGF=1", reply=REPLY_OK):
+        if not self.sms_text_mode():
             return False
 
+        # with text mode already set nothing above cleared the input, and a
+        # leftover OK would be read in place of the prompt
+        self._reset_input()
         self._uart_write(b'AT+CMGS="+' + str(phone_number).encode() + b'"' + b"\r")
         self._read_line()
 
@@ -508,7 +732,7 @@ class FONA:
 
         # read +CMGS, wait ~10sec.
         self._read_line(10000)
-        if not "+CMGS" in self._buf:
+        if not b"+CMGS" in self._buf:
             return False
 
         if not self._expect_reply(REPLY_OK):
@@ -544,25 +768,25 @@ class FONA:
 
         :param bool sim_storage: SMS storage on the SIM, otherwise internal storage on FONA chip.
         """
-        if not self._send_check_reply(b"AT+CMGF=1", reply=REPLY_OK):
+        if not self.sms_text_mode():
             raise RuntimeError("Operating mode not supported by FONA module.")
 
         if sim_storage:  # ask how many SMS are stored
-            if self._send_parse_reply(b"AT+CPMS?", FONA_SMS_STORAGE_SIM + b",", idx=1):
-                return self._buf
+            count = self._send_parse_int(b"AT+CPMS?", FONA_SMS_STORAGE_SIM + b",")
         else:
-            if self._send_parse_reply(
-                b"AT+CPMS?", FONA_SMS_STORAGE_INTERNAL + b",", idx=1
-            ):
-                return self._buf
+            count = self._send_parse_int(b"AT+CPMS?", FONA_SMS_STORAGE_INTERNAL + b",")
+        if count is not None:
+            return count
 
         self._read_line()  # eat OK
-        if self._send_parse_reply(b"AT+CPMS?", b'"SM",', idx=1):
-            return self._buf
+        count = self._send_parse_int(b"AT+CPMS?", b'"SM",')
+        if count is not None:
+            return count
 
         self._read_line()  # eat OK
-        if self._send_parse_reply(b"AT+CPMS?", b'"SM_P",', idx=1):
-            return self._buf
+        count = self._send_parse_int(b"AT+CPMS?", b'"SM_P",')
+        if count is not None:
+            return count
         return 0
 
     def delete_sms(self, sms_slot: int) -> bool:
@@ -570,7 +794,7 @@ class FONA:
 
         :param int sms_slot: SMS SIM or FONA memory slot number.
         """
-        if not self._send_check_reply(b"AT+CMGF=1", reply=REPLY_OK):
+        if not self.sms_text_mode():
             return False
 
         if not self._send_check_reply(
@@ -583,7 +807,7 @@ class FONA:
     def delete_all_sms(self) -> bool:
         """Deletes all SMS messages on the FONA SIM."""
         self._read_line()
-        if not self._send_check_reply(b"AT+CMGF=1", reply=REPLY_OK):
+        if not self.sms_text_mode():
             return False
 
         if self._fona_type in (FONA_3G_A, FONA_3G_E):
@@ -604,30 +828,28 @@ class FONA:
 
         :param int sms_slot: SMS SIM or FONA memory slot number.
         """
-        if not self._send_check_reply(b"AT+CMGF=1", reply=REPLY_OK):
+        if not self.sms_text_mode():
             return False
-        if not self._send_check_reply(b"AT+CSDH=1", reply=REPLY_OK):
+        if not self._apply_setting(b"AT+CSDH=1"):
             return False
 
         self._uart_write(b"AT+CMGR=" + str(sms_slot).encode() + b"\r\n")
         self._read_line(1000)
-        resp = self._buf
 
         # get sender
-        if not self._parse_reply(b"+CMGR:", idx=1):
+        sender = self._parse_field(b"+CMGR:", idx=1)
+        if sender is None:
             return False
-        sender = self._buf.strip('"')
+        sender = sender.decode()
 
-        # get sms length
-        self._buf = resp
-        if not self._parse_reply(b"+CMGR:", idx=11):
+        # get sms length, the last of the 11 fields AT+CSDH=1 asks for
+        sms_len = self._parse_int(b"+CMGR:", idx=10)
+        if sms_len is None:
             return False
-        sms_len = self._buf
 
-        self._buf = bytearray(sms_len)
-        self._uart.readinto(self._buf)
+        self._buf = self._read_raw(sms_len, 1000)
         message = bytes(self._buf).decode()
-        self._uart.reset_input_buffer()
+        self._reset_input()
         self._read_line()  # eat 'OK'
 
         return sender, message
@@ -651,9 +873,11 @@ class FONA:
             return False
 
         self._read_line()
-        while not self._parse_reply(b"+CDNSGIP:", idx=2):
+        address = self._parse_field(b"+CDNSGIP:", idx=2)
+        while address is None:
             self._read_line()
-        return self._buf
+            address = self._parse_field(b"+CDNSGIP:", idx=2)
+        return address.decode()
 
     def get_socket(self) -> int:
         """Obtains a socket, if available."""
@@ -667,8 +891,7 @@ class FONA:
         allocated_socket = 0
         for sock in range(0, FONA_MAX_SOCKETS):  # check if INITIAL state
             self._read_line(100)
-            self._parse_reply(b"C:", idx=5)
-            if self._buf.strip('"') == "INITIAL" or self._buf.strip('"') == "CLOSED":
+            if self._parse_field(b"C:", idx=5) in (b"INITIAL", b"CLOSED"):
                 allocated_socket = sock
                 break
         # read out the rest of the responses
@@ -690,8 +913,10 @@ class FONA:
         self._uart_write(b"AT+CIPSTATUS=" + str(sock_num).encode() + b"\r\n")
         self._read_line(100)
 
-        self._parse_reply(b"+CIPSTATUS:", idx=3)
-        return self._buf
+        address = self._parse_field(b"+CIPSTATUS:", idx=3)
+        if address is None:
+            return ""
+        return address.decode()
 
     def socket_status(self, sock_num: int) -> bool:
         """Returns the socket connection status, False if not connected.
@@ -702,6 +927,8 @@ class FONA:
             sock_num < FONA_MAX_SOCKETS
         ), "Provided socket exceeds the maximum number of \
                                              sockets for the FONA module."
+        if self._socket_closed(sock_num):
+            return False
         if not self._send_check_reply(b"AT+CIPSTATUS", reply=REPLY_OK, timeout=100):
             return False
         self._read_line()
@@ -710,15 +937,13 @@ class FONA:
             self._read_line()
             if state == sock_num:
                 break
-        self._parse_reply(b"C:", idx=5)
-
-        state = self._buf
+        state = self._parse_field(b"C:", idx=5)
 
         # eat the rest of the sockets
         for _ in range(sock_num, FONA_MAX_SOCKETS):
             self._read_line()
 
-        if not "CONNECTED" in state:
+        if state is None or b"CONNECTED" not in state:
             return False
 
         return True
@@ -732,14 +957,21 @@ class FONA:
             sock_num < FONA_MAX_SOCKETS
         ), "Provided socket exceeds the maximum number of \
                                              sockets for the FONA module."
-        if not self._send_parse_reply(
+        self._poll_urcs()
+        if sock_num in self._rx_empty:
+            # nothing has arrived since the modem last said it had no data
+            return 0
+        data = self._send_parse_int(
             b"AT+CIPRXGET=4," + str(sock_num).encode(),
             b"+CIPRXGET: 4," + str(sock_num).encode() + b",",
-        ):
+        )
+        if data is None:
             return False
-        data = self._buf
         if self._debug:
-            print("\t {} bytes available.".format(self._buf))
+            print("\t {} bytes available.".format(data))
+        if not data:
+            # +CIPRXGET: 1 announces the next data
+            self._rx_empty.add(sock_num)
 
         self._read_line()
         self._read_line()
@@ -764,11 +996,12 @@ class FONA:
                 )
             )
 
-        self._uart.reset_input_buffer()
+        self._reset_input()
         assert (
             sock_num < FONA_MAX_SOCKETS
         ), "Provided socket exceeds the maximum number of \
                                              sockets for the FONA module."
+        self._socket_opened(sock_num)
 
         # Query local IP Address
 
@@ -829,10 +1062,10 @@ class FONA:
         self._uart_write(str(length).encode() + b"\r\n")
         self._read_line()
 
-        if not self._parse_reply(b"+CIPRXGET:"):
+        if self._buf.find(b"+CIPRXGET:") == -1:
             return False
 
-        return self._uart.read(length)
+        return self._read_raw(length, 1000)
 
     def socket_write(self, sock_num: int, buffer: bytes, timeout: int = 3000) -> bool:
         """Writes bytes to the socket.
@@ -847,7 +1080,7 @@ class FONA:
         ), "Provided socket exceeds the maximum number of \
                                              sockets for the FONA module."
 
-        self._uart.reset_input_buffer()
+        self._reset_input()
         self._uart_write(b"AT+CIPSEND=" + str(sock_num).encode())
         self._uart_write(b"," + str(len(buffer)).encode() + b"\r\n")
         self._read_line()
@@ -892,6 +1125,21 @@ class FONA:
             return False
         return True
 
+    def _send_parse_int(
+        self, send_data: bytes, reply_data: bytes, idx: int = 0, divider: bytes = b","
+    ) -> Optional[int]:
+        """Sends a command and returns field ``idx`` of its reply as an int,
+        None if the reply doesn't have one.
+
+        :param bytes send_data: Command to send to the module.
+        :param bytes reply_data: Reply prefix in front of the first field.
+        :param int idx: Field number, counting from 0.
+        :param bytes divider: Separator.
+        """
+        self._read_line()
+        self._get_reply(send_data)
+        return self._parse_int(reply_data, idx, divider)
+
     def _get_reply(
         self,
         data: Optional[bytes] = None,
@@ -906,7 +1154,7 @@ class FONA:
         :param bytes suffix: Data to write following ``prefix`` if ``data is not provided
         :param int timeout: Time to wait for UART response.
         """
-        self._uart.reset_input_buffer()
+        self._reset_input()
 
         if data is not None:
             self._uart_write(data + b"\r\n")
@@ -916,28 +1164,41 @@ class FONA:
         return self._read_line(timeout)
 
     def _parse_reply(self, reply: bytes, divider: str = ",", idx: int = 0) -> bool:
-        """Attempts to find reply in UART buffer, reads up to divider.
+        """Attempts to find reply in UART buffer, reads up to divider. Leaves
+        the field in the buffer, as an int if it is one and a str otherwise.
 
         :param bytes reply: Expected response from FONA module.
         :param str divider: Divider character.
         """
-        parsed_reply = self._buf.find(reply)
-        if parsed_reply == -1:
-            return False
-        parsed_reply = self._buf[parsed_reply:]
+        divider = divider.encode()
+        value = int_field(self._buf, reply, idx, divider)
+        if value is None:
+            value = bytes_field(self._buf, reply, idx, divider)
+            if value is None:
+                return False
+            value = value.decode()
+        self._buf = value
+        return True
 
-        parsed_reply = self._buf[len(reply) :]
-        parsed_reply = parsed_reply.decode("utf-8")
+    def _parse_int(self, reply: bytes, idx: int = 0, divider: bytes = b",") -> Optional[int]:
+        """Returns field ``idx`` after ``reply`` in the buffer as an int, None
+        if it is missing or not a number.
 
-        parsed_reply = parsed_reply.split(divider)
-        parsed_reply = parsed_reply[idx]
+        :param bytes reply: Reply prefix in front of the first field.
+        :param int idx: Field number, counting from 0.
+        :param bytes divider: Separator.
+        """
+        return int_field(self._buf, reply, idx, divider)
 
-        try:
-            self._buf = int(parsed_reply)
-        except ValueError:
-            self._buf = parsed_reply
+    def _parse_field(self, reply: bytes, idx: int = 0, divider: bytes = b",") -> Optional[bytes]:
+        """Returns field ``idx`` after ``reply`` in the buffer, without quotes,
+        None if it is missing.
 
-        return True
+        :param bytes reply: Reply prefix in front of the first field.
+        :param int idx: Field number, counting from 0.
+        :param bytes divider: Separator.
+        """
+        return bytes_field(self._buf, reply, idx, divider)
 
     def _read_line(
         self, timeout: int = FONA_DEFAULT_TIMEOUT_MS, multiline: bool = False
@@ -945,37 +1206,243 @@ class FONA:
         """Reads one or multiple lines into the buffer. Optionally prints the buffer
         after reading.
 
-        :param int timeout: Time to wait for UART serial to reply, in seconds.
+        A multiline read joins the lines with ``\\n`` and stops early at a final
+        ``OK`` or ``ERROR``.
+
+        :param int timeout: Time to wait for UART serial to reply, in milliseconds.
         :param bool multiline: Read multiple lines.
         """
-        self._buf = b""
-        reply_idx = 0
-        while timeout:
-            if reply_idx >= 254:
-                break
+        deadline = _ticks_ms() + timeout
+        line = self._next_line(deadline)
+        if line is None:
+            self._buf = b""
+        elif not multiline:
+            self._buf = bytes(line)
+        else:
+            lines = []
+            length = 0
+            while line is not None:
+                line = bytes(line)
+                lines.append(line)
+                length += len(line) + 1
+                if length >= FONA_MAX_LINE or line in (REPLY_OK, REPLY_ERROR):
+                    break
+                if line.startswith(REPLY_CME_ERROR):
+                    break
+                line = self._next_line(deadline)
+            self._buf = b"\n".join(lines)
+
+        if self._debug:
+            print("\tUARTREAD ::", self._buf.decode())
+
+        return len(self._buf), self._buf
+
+    def _next_line(self, deadline: int, partial: bool = True) -> Optional[memoryview]:
+        """Returns the next non-empty line without its line ending, as a view
+        into the receive buffer that is only valid until the next read.
+        Unsolicited result codes are handed to their handlers on the way and
+        never returned.
 
-            while self._uart.in_waiting:
-                char = self._uart.read(1)
-                if char == b"\r":
+        A ``>`` prompt counts as a line of its own since the modem sends no
+        line ending after it. Whatever has arrived when ``deadline`` passes is
+        returned as it is, None if nothing has.
+
+        :param int deadline: `_ticks_ms` value to give up at.
+        :param bool partial: False to leave an unfinished line in the buffer at
+            the deadline and return None.
+        """
+        rx = self._rx
+        scan = self._rx_start
+        while True:
+            # skip the line endings in front of the line
+            start = self._rx_start
+            while start < self._rx_end and rx[start] in (10, 13):
+                start += 1
+            self._rx_start = start
+            scan = max(scan, start)
+            end = self._rx_end
+            if start < end and rx[start] == 62 and start + 1 < end:
+                # '> ' prompt
+                stop = start + 2 if rx[start + 1] == 32 else start + 1
+                self._rx_start = stop
+                return self._rx_view[start:stop]
+            limit = min(end, start + FONA_MAX_LINE)
+            while scan < limit and rx[scan] != 10:
+                scan += 1
+            if scan < limit:
+                # a whole line
+                self._rx_start = scan + 1
+                stop = scan
+                while rx[stop - 1] == 13:
+                    stop -= 1
+                if self._dispatch_urc(start, stop):
+                    scan = self._rx_start
                     continue
-                if char == b"\n":
-                    if reply_idx == 0:  # ignore first '\n'
-                        continue
-                    if not multiline:  # second '\n' is EOL
-                        timeout = 0
-                        break
-                self._buf += char
-                reply_idx += 1
-
-            if timeout == 0:
-                break
-            timeout -= 1
+                return self._rx_view[start:stop]
+            if scan - start >= FONA_MAX_LINE:
+                # too long, the rest comes as the next line
+                self._rx_start = scan
+                return self._rx_view[start:scan]
+            if self._fill():
+                scan = self._rx_start + (scan - start)
+                continue
+            if _ticks_ms() >= deadline:
+                if start == end or not partial:
+                    return None
+                self._rx_start = end
+                return self._rx_view[start:end]
             time.sleep(0.001)
 
-        if self._debug:
-            print("\tUARTREAD ::", self._buf.decode())
+    def _fill(self) -> int:
+        """Moves whatever the UART has waiting into the receive buffer in one
+        read and returns the number of bytes added."""
+        waiting = self._uart.in_waiting
+        if not waiting:
+            return 0
+        if self._rx_start and waiting > FONA_RX_BUFFER_SIZE - self._rx_end:
+            # make room by moving the unread bytes to the front
+            pending = self._rx_end - self._rx_start
+            self._rx_view[0:pending] = self._rx_view[self._rx_start : self._rx_end]
+            self._rx_start = 0
+            self._rx_end = pending
+        count = min(waiting, FONA_RX_BUFFER_SIZE - self._rx_end)
+        if not count:
+            return 0
+        count = self._uart.readinto(self._rx_view[self._rx_end : self._rx_end + count]) or 0
+        self._rx_end += count
+        return count
+
+    def _read_raw(self, length: int, timeout: int = FONA_DEFAULT_TIMEOUT_MS) -> bytearray:
+        """Reads ``length`` bytes that are not split into lines, such as socket
+        data or an SMS body, starting with any already in the receive buffer.
+        Returns fewer if the timeout passes first.
+
+        :param int length: Bytes wanted.
+        :param int timeout: Time to wait for them, in milliseconds.
+        """
+        data = bytearray(length)
+        view = memoryview(data)
+        got = min(length, self._rx_end - self._rx_start)
+        if got:
+            view[0:got] = self._rx_view[self._rx_start : self._rx_start + got]
+            self._rx_start += got
+        deadline = _ticks_ms() + timeout
+        while got < length:
+            waiting = self._uart.in_waiting
+            if waiting:
+                count = min(waiting, length - got)
+                got += self._uart.readinto(view[got : got + count]) or 0
+            elif _ticks_ms() >= deadline:
+                return data[:got]
+            else:
+                time.sleep(0.001)
+        return data
+
+    def _reset_input(self) -> None:
+        """Drops everything received so far, buffered or still in the UART,
+        after handing any unsolicited result codes in it to their handlers."""
+        self._poll_urcs()
+        self._rx_start = 0
+        self._rx_end = 0
+        self._uart.reset_input_buffer()
+
+    ### Unsolicited result codes ###
+
+    def set_urc_handler(self, prefix: bytes, handler: Callable[[memoryview], bool]) -> None:
+        """Routes lines starting with ``prefix`` to ``handler`` instead of to
+        the command in flight. The handler gets the whole line and returns
+        False if it turns out to be a reply to a command after all, e.g.
+        ``+CREG: 0,1`` in answer to ``AT+CREG?``.
+
+        :param bytes prefix: Start of the unsolicited line.
+        :param handler: Called with the line as a memoryview into the receive
+            buffer, only valid during the call. `adafruit_fona.at_reply` reads
+            fields from it without a copy.
+        """
+        for entry in self._urc_handlers:
+            if entry[0] == prefix:
+                entry[1] = handler
+                return
+        self._urc_handlers.append([prefix, handler])
+
+    def _poll_urcs(self) -> None:
+        """Handles the unsolicited result codes that have arrived, without
+        waiting for more. Leftover replies to earlier commands are dropped."""
+        while self._next_line(0, partial=False) is not None:
+            pass
+
+    def _dispatch_urc(self, start: int, stop: int) -> bool:
+        line = self._rx_view[start:stop]
+        for prefix, handler in self._urc_handlers:
+            if has_prefix(line, prefix):
+                if self._debug:
+                    print("\tURC ::", bytes(line).decode())
+                if handler(line):
+                    return True
+        return False
+
+    def _reset_urcs(self) -> None:
+        """Forgets everything URCs reported, the modem has been reset."""
+        self._sms_slots = []
+        self._rx_empty = set()
+        self._closed_sockets = set()
+        self._registration = None
+
+    def _set_registration(self, status: int) -> None:
+        self._registration = status
+        self._registration_until = _ticks_ms() + FONA_URC_TRUST_MS
+
+    def _socket_opened(self, sock_num: int) -> None:
+        self._rx_empty.discard(sock_num)
+        self._closed_sockets.discard(sock_num)
+
+    def _socket_closed(self, sock_num: int) -> bool:
+        """True if the modem has reported the socket closed."""
+        self._poll_urcs()
+        return sock_num in self._closed_sockets
+
+    def _on_new_sms(self, line: memoryview) -> bool:
+        # +CMTI: "SM",<slot>
+        slot = int_field(line, b"+CMTI: ", 1)
+        if slot is not None:
+            self._sms_slots.append(slot)
+        return True
+
+    def _on_socket_data(self, line: memoryview) -> bool:
+        # +CIPRXGET: 1[,<socket>] or +UUSORD: <socket>,<length>
+        if has_prefix(line, b"+UUSORD: "):
+            sock_num = int_field(line, b"+UUSORD: ")
+        elif len(line) == 12 or line[12] == 44:
+            sock_num = int_field(line, b"+CIPRXGET: 1,")
+            if sock_num is None:
+                sock_num = 0
+        else:
+            return False
+        self._rx_empty.discard(sock_num)
+        return True
+
+    def _on_registration(self, line: memoryview) -> bool:
+        # the URC is +CREG: <stat>[,<lac>,<ci>], the reply to AT+CREG? has
+        # <n>,<stat> and so a number in the second field
+        prefix = b"+CREG: " if has_prefix(line, b"+CREG: ") else b"+CEREG: "
+        if int_field(line, prefix, 1) is not None:
+            return False
+        status = int_field(line, prefix)
+        if status is not None and prefix == b"+CREG: ":
+            self._set_registration(status if 0 <= status <= 5 else -1)
+        return True
+
+    def _on_boot(self, line: memoryview) -> bool:
+        self._booted = True
+        return True
 
-        return reply_idx, self._buf
+    def _on_socket_closed(self, line: memoryview) -> bool:
+        # +IPCLOSE: <socket>,<reason> or +UUSOCL: <socket>
+        prefix = b"+IPCLOSE: " if has_prefix(line, b"+IPCLOSE: ") else b"+UUSOCL: "
+        sock_num = int_field(line, prefix)
+        if sock_num is not None:
+            self._closed_sockets.add(sock_num)
+        return True
 
     def _send_check_reply(
         self,
@@ -1006,6 +1473,24 @@ class FONA:
 
         return True
 
+    def _apply_setting(self, command: bytes, timeout: int = FONA_DEFAULT_TIMEOUT_MS) -> bool:
+        """Sends a configuration command unless it is already in effect. A new
+        value for a setting replaces the one remembered before.
+
+        :param bytes command: Command, e.g. ``b"AT+CMGF=1"``.
+        :param int timeout: Time to wait for the ``OK``, in milliseconds.
+        """
+        if command in self._applied:
+            return True
+        if not self._send_check_reply(command, reply=REPLY_OK, timeout=timeout):
+            return False
+        name = _setting_name(command)
+        self._applied = {
+            setting for setting in self._applied if _setting_name(setting) != name
+        }
+        self._applied.add(command)
+        return True
+
     def _send_check_reply_quoted(
         self,
         prefix: bytes,
@@ -1038,7 +1523,7 @@ class FONA:
         :param bytes prefix: Command ", suffix, ".
         :param int timeout: Time to expect reply back from FONA, in milliseconds.
         """
-        self._uart.reset_input_buffer()
+        self._reset_input()
 
         self._uart_write(prefix + b'"' + suffix + b'"\r\n')
 
@@ -48,6 +48,7 @@ class FONA3G(FONA):
     :param ~digitalio.DigitalInOut rst: FONA RST pin.
     :param ~digitalio.DigitalInOut ri: Optional FONA Ring Interrupt (RI) pin.
     :param bool debug: Enable debugging output.
+    :param tuple state: ``state`` saved before a deep sleep, None if unknown.
     """
 
     def __init__(
@@ -56,9 +57,10 @@ class FONA3G(FONA):
         rst: DigitalInOut,
         ri: Optional[DigitalInOut] = None,
         debug: bool = False,
+        state: Optional[Tuple[int, int]] = None,
     ) -> None:
         uart.baudrate = 4800
-        super().__init__(uart, rst, ri, debug)
+        super().__init__(uart, rst, ri, debug, state)
 
     def set_baudrate(self, baudrate: int) -> bool:
         """Sets the FONA's UART baudrate."""
@@ -78,11 +80,10 @@ class FONA3G(FONA):
     @gps.setter
     def gps(self, gps_on: bool = False) -> bool:
         # check if GPS is already enabled
-        if not self._send_parse_reply(b"AT+CGPS?", b"+CGPS: "):
+        state = self._send_parse_int(b"AT+CGPS?", b"+CGPS: ")
+        if state is None:
             return False
 
-        state = self._buf
-
         if gps_on and not state:
             self._read_line()
             if not self._send_check_reply(b"AT+CGPS=1", reply=REPLY_OK):
@@ -96,17 +97,21 @@ class FONA3G(FONA):
     @property
     def ue_system_info(self) -> bool:
         """UE System status."""
-        self._send_parse_reply(b"AT+CPSI?\r\n", b"+CPSI: ")
-        if not self._buf == "GSM" or self._buf == "WCDMA":  # 5.15
+        self._read_line()
+        self._get_reply(b"AT+CPSI?\r\n")
+        if self._parse_field(b"+CPSI: ") not in (b"GSM", b"WCDMA"):  # 5.15
             return False
         return True
 
     @property
     def local_ip(self) -> Optional[str]:
         """Module's local IP address, None if not set."""
-        if not self._send_parse_reply(b"AT+IPADDR", b"+IPADDR:"):
+        self._read_line()
+        self._get_reply(b"AT+IPADDR")
+        address = self._parse_field(b"+IPADDR:")
+        if address is None:
             return None
-        return self._buf
+        return address.decode()
 
     # pylint: disable=too-many-return-statements
     def set_gprs(
@@ -167,7 +172,7 @@ class FONA3G(FONA):
     def tx_timeout(self) -> bool:
         """CIPSEND timeout, in milliseconds."""
         self._read_line()
-        if not self._send_parse_reply(b"AT+CIPTIMEOUT?", b"+CIPTIMEOUT:", idx=2):
+        if self._send_parse_int(b"AT+CIPTIMEOUT?", b"+CIPTIMEOUT:", idx=2) is None:
             return False
         return True
 
@@ -194,9 +199,10 @@ class FONA3G(FONA):
         self._uart_write(b'AT+CDNSGIP="' + hostname + b'"\r\n')
         self._read_line(10000)  # Read the +CDNSGIP, takes a while
 
-        if not self._parse_reply(b"+CDNSGIP: ", idx=2):
+        address = self._parse_field(b"+CDNSGIP: ", idx=2)
+        if address is None:
             return False
-        return self._buf
+        return address.decode()
 
     def get_socket(self) -> int:
         """Returns an unused socket."""
@@ -209,9 +215,11 @@ class FONA3G(FONA):
         socket = 0
         for socket in range(0, FONA_MAX_SOCKETS):
             self._read_line(120000)
-            try:  # SIMCOM5320 lacks a socket connection status, this is a workaround
-                self._parse_reply(b"+CIPOPEN: ", idx=1)
-            except IndexError:
+            # SIMCOM5320 lacks a socket connection status, a free socket is
+            # listed without a connection type
+            if self._buf.find(b"+CIPOPEN: ") != -1 and (
+                self._parse_field(b"+CIPOPEN: ", idx=1) is None
+            ):
                 break
 
         for _ in range(socket, FONA_MAX_SOCKETS):
@@ -239,16 +247,15 @@ class FONA3G(FONA):
                 )
             )
 
-        self._uart.reset_input_buffer()
+        self._reset_input()
         assert (
             sock_num < FONA_MAX_SOCKETS
         ), "Provided socket exceeds the maximum number of \
                                              sockets for the FONA module."
-        self._send_check_reply(b"AT+CIPHEAD=0", reply=REPLY_OK)  # do not show ip header
-        self._send_check_reply(
-            b"AT+CIPSRIP=0", reply=REPLY_OK
-        )  # do not show remote ip/port
-        self._send_check_reply(b"AT+CIPRXGET=1", reply=REPLY_OK)  # manually get data
+        self._socket_opened(sock_num)
+        self._apply_setting(b"AT+CIPHEAD=0")  # do not show ip header
+        self._apply_setting(b"AT+CIPSRIP=0")  # do not show remote ip/port
+        self._apply_setting(b"AT+CIPRXGET=1")  # manually get data
 
         self._uart_write(b"AT+CIPOPEN=" + str(sock_num).encode())
         if conn_mode == 0:
@@ -273,10 +280,11 @@ class FONA3G(FONA):
                                              sockets for the FONA module."
 
         self._uart_write(b"AT+CIPOPEN?\r\n")
+        ip_addr = None
         for _ in range(0, sock_num + 1):
             self._read_line()
-            self._parse_reply(b"+CIPOPEN:", idx=2)
-        ip_addr = self._buf
+            ip_addr = self._parse_field(b"+CIPOPEN:", idx=2)
+        ip_addr = "" if ip_addr is None else ip_addr.decode()
 
         for _ in range(sock_num, FONA_MAX_SOCKETS):
             self._read_line()  # eat the rest of '+CIPOPEN' responses
@@ -295,7 +303,7 @@ class FONA3G(FONA):
         ), "Provided socket exceeds the maximum number of \
                                              sockets for the FONA module."
 
-        self._uart.reset_input_buffer()
+        self._reset_input()
 
         self._uart_write(
             b"AT+CIPSEND="
@@ -313,9 +321,8 @@ class FONA3G(FONA):
         self._read_line()  # eat 'OK'
 
         self._read_line(3000)  # expect +CIPSEND: rx,tx
-        if not self._parse_reply(b"+CIPSEND:", idx=1):
-            return False
-        if not self._buf == len(buffer):  # assert data sent == buffer size
+        # assert data sent == buffer size
+        if self._parse_int(b"+CIPSEND:", idx=1) != len(buffer):
             return False
 
         self._read_line(timeout)
@@ -328,8 +335,6 @@ class FONA3G(FONA):
 
         :param int sock_num: Desired socket number.
         """
-        if not self._send_parse_reply(b"AT+CIPCLOSE?", b"+CIPCLOSE:", idx=sock_num):
-            return False
-        if not self._buf == 1:
+        if self._socket_closed(sock_num):
             return False
-        return True
+        return self._send_parse_int(b"AT+CIPCLOSE?", b"+CIPCLOSE:", idx=sock_num) == 1
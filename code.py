@@ -1,3 +1,6 @@
+## imported first so the "awake" span covers as much of the wake as possible
+import heatseek.wake_profile as wake_profile
+from heatseek.wake_profile import span
 import board
 import digitalio
 import time
@@ -6,21 +9,36 @@ import busio
 
 import alarm
 import ipaddress
-import ssl
 import wifi
 import socketpool
-import adafruit_requests
 import rtc
 import os
 import neopixel 
+import microcontroller
 from adafruit_lc709203f import LC709203F
-import adafruit_requests as requests
-from adafruit_fona.adafruit_fona import FONA
+from adafruit_fona.adafruit_fona import FONA, modem_responds
 from adafruit_fona.fona_3g import FONA3G
 import adafruit_fona.adafruit_fona_network as network
 import adafruit_fona.adafruit_fona_socket as cellular_socket
+from heatseek.reading_store import ReadingStore, migrate_legacy_queue
+from heatseek.archive import Archive
+from heatseek.journal import Journal
+from heatseek.error_log import ErrorLog, ERR_OTHER, ERR_STARTUP, ERR_SENSOR, ERR_WIFI, ERR_NETWORK, ERR_TIME, ERR_UPLOAD, ERR_DRAIN, ERR_SMS, ERR_OVERRUN, ERR_STORAGE
+from heatseek.batch_upload import build_batch, parse_ack
+from heatseek.upload_client import UploadClient, UploadError
+from heatseek.drain_budget import DrainBudget
+import heatseek.sms_codec as sms_codec
+from heatseek.sms_drain import SmsDrain
+from heatseek.rtc_drift import RtcDrift
+from heatseek.time_sync import TimeSync
+from heatseek.wifi_manager import WifiManager
+import heatseek.sensor_reading as sensor_reading
+from heatseek.status_led import StatusLed, FLASH, WARNING, FADE_DOWN, FADE_UP
+from heatseek.wake_supervisor import WakeSupervisor
+from heatseek.sleep_state import SleepState, QUEUE_UNKNOWN, NETWORK_TENANT, NETWORK_HEATSEEK, NETWORK_CELLULAR
 
 pixels = neopixel.NeoPixel(board.NEOPIXEL, 1)
+status_led = StatusLed(pixels)
 
 ##################
 ## Set pins to safe values in case the sms board is attached
@@ -36,7 +54,6 @@ LTE_SHIELD_POWER_PULSE_PERIOD = 3.2
 LTE_RESET_PULSE_PERIOD = 10.0
 ## SMS relay number - should be a twilio number and entered as an integer with country code
 SMS_RELAY_NUMBER = 16469709199
-SMS_QUEUE_LENGTH = 2
 
 ###########
 # Get wifi details and more from a secrets.py file
@@ -47,39 +64,155 @@ except ImportError:
     raise
 
 ## URL
-HEATSEEK_URL = "http://relay.heatseek.org/temperatures"
+HEATSEEK_HOST = "relay.heatseek.org"
+HEATSEEK_PATH = "/temperatures"
 CODE_VERSION = "F-CP-1.1.3"
 VOLT_DIFF_FOR_CHARGE = 0.06
 QUIET_MODE_SLEEP_LENGTH = 600
+## Queued readings live in a single fixed-size ring file. Once it is 7/8
+## full the oldest readings are merged into min/mean/max aggregates
+QUEUE_PATH = "/queue.bin"
+QUEUE_CAPACITY = int(secrets.get("queue_capacity", 2048))
+## Every reading is also kept in a compact rotating archive, the oldest
+## segment is deleted once the archive reaches its size cap
+ARCHIVE_PATH = "/archive"
+ARCHIVE_SEGMENT_BYTES = int(secrets.get("archive_segment_bytes", 16384))
+ARCHIVE_MAX_BYTES = int(secrets.get("archive_max_bytes", 262144))
+## All of a wake's file changes are collected here and written in one go
+## right before deep sleep
+JOURNAL_PATH = "/journal.bin"
+## Recent errors plus a running count per error code
+ERROR_LOG_PATH = "/errors.bin"
+ERROR_LOG_CAPACITY = 64
+## Attach the error counts to the next upload after a new error is logged,
+## "false" leaves them off
+UPLOAD_ERROR_SUMMARY = secrets.get("upload_error_summary", "true") == "true"
+## Queued readings sent per request when draining, 1 turns batching off
+UPLOAD_BATCH_SIZE = int(secrets.get("upload_batch_size", 20))
+## A relay that answers a batch with an error is sent one reading per
+## request for the rest of the wake. Once those posts go through, batches are
+## only offered again after this many seconds
+BATCH_REPROBE_SECONDS = 86400
+## Cap on how long and how much one wake spends draining the queue, the
+## rest waits for the next wake
+DRAIN_MAX_SECONDS = int(secrets.get("drain_max_seconds", 60))
+DRAIN_MAX_READINGS = int(secrets.get("drain_max_readings", 500))
+## Readings to queue before sending a JSON SMS, and the readings it carries.
+## Compact messages wait until the queue fills one, see sms_readings_per_message
+SMS_QUEUE_LENGTH = int(secrets.get("sms_queue_length", 2))
+## Pack queued readings with the compact SMS codec. Off by default, "true"
+## needs a relay that decodes heatseek/sms_codec.py messages
+SMS_COMPACT = secrets.get("sms_compact", "false") == "true"
+## Most readings looked at per compact SMS, the codec stops when it's full
+SMS_PEEK_LENGTH = 64
+## Longest the error warning may hold up deep sleep, in seconds
+LED_WARNING_SECONDS = 2
+## Fetch the time again once the RTC drift model predicts it's this many seconds off
+TIME_MAX_ERROR = int(secrets.get("time_max_error", 30))
+## Hard deadlines, in seconds, for each time source
+NTP_TIMEOUT = 2
+HTTP_TIME_TIMEOUT = 5
+## WiFi connect timeouts, in seconds, for the cached last-good network and
+## for a full scan
+WIFI_FAST_TIMEOUT = 3
+WIFI_TIMEOUT = 10
+## Store-and-forward WiFi: keep the radio off and only queue the reading until
+## this many readings are waiting, 1 brings the radio up on every wake
+WIFI_BATCH_READINGS = int(secrets.get("wifi_batch_readings", 1))
+## ...or until this many minutes have passed since the last upload, 0 for no limit
+WIFI_BATCH_MINUTES = int(secrets.get("wifi_batch_minutes", 0))
+## Readings colder than this (F) are uploaded right away, "" turns this off
+URGENT_TEMP_BELOW = secrets.get("urgent_temp_below", "")
+## Sensor measurements per reading, filtered down to one value
+SENSOR_SAMPLES = int(secrets.get("sensor_samples", 3))
+## Longest a wake may stay up before the reading is saved and it goes back to
+## sleep. A call that hangs inside the firmware is ended by a watchdog reset
+## shortly after
+WAKE_MAX_SECONDS = int(secrets.get("wake_max_seconds", 240))
+## Budgets for the phases that talk to hardware or the network, in seconds
+WAKE_PHASE_SECONDS = {
+    "sms_init": 60,
+    "net_attach": 90,
+    "wifi_connect": 30,
+    "time_sync": 15,
+    "sensor_read": 10,
+    "upload": 30,
+    "drain": DRAIN_MAX_SECONDS + 30,
+    "sms_drain": DRAIN_MAX_SECONDS + 60,
+}
 
 ## FUNCTIONS
 
 
 
 def init_sms_board():
-    print("Initializing the Cell board with a power pulse")
     # Initialize the modem
-    power_pin.switch_to_output()
-    power_pin.value = False
-    time.sleep(LTE_SHIELD_POWER_PULSE_PERIOD)
-    # power_pin.switch_to_input()
-
-    uart = busio.UART(board.TX, board.RX, baudrate=115200)
-    # uart = board.UART()
-    global fona 
-    fona = FONA(uart, reset_pin)
+    with wake_guard.phase("sms_init"):
+        uart = busio.UART(board.TX, board.RX, baudrate=115200)
+        # uart = board.UART()
+        with span("sms_init"):
+            ## a modem that stayed on needs no power pulse, and a pulse this
+            ## long could switch it off
+            if modem_responds(uart):
+                print("Cell board is already on")
+            else:
+                print("Initializing the Cell board with a power pulse")
+                power_pin.switch_to_output()
+                power_pin.value = False
+                time.sleep(LTE_SHIELD_POWER_PULSE_PERIOD)
+        # power_pin.switch_to_input()
+
+        global fona 
+        ## settings and identity the modem had before the last deep sleep.
+        ## FONA only resets the modem if it doesn't come up by itself
+        fona = FONA(uart, reset_pin, state=(wake_state.modem_type, wake_state.modem_settings))
+    wake_state.modem_ready_ms = min(fona.ready_ms, 0xFFFF)
+    print("Modem ready after {} ms{}".format(fona.ready_ms, ", with a reset" if fona.was_reset else ""))
     # Initialize cellular data network
     global network
     net = network.CELLULAR(fona, ("ting", '', ''))
-    while not net.is_attached:
-        print("Attaching to network...")
-        time.sleep(0.5)
+    with wake_guard.phase("net_attach"), span("net_attach"):
+        while not net.is_attached:
+            ## gives up once the attach budget is spent
+            wake_guard.check()
+            print("Attaching to network...")
+            time.sleep(0.5)
     print("Attached!")
+    wake_state.network = NETWORK_CELLULAR
+    if not wake_state.imei:
+        ## identity is static, only ask the modem once per power cycle. A
+        ## garbled reply isn't kept so the next wake asks again
+        imei = fona.iemi
+        if len(imei) == 15 and imei.isdigit():
+            wake_state.imei = imei.encode()
+        print("Modem IMEI: {}".format(imei))
+    else:
+        print("Modem IMEI: {}".format(wake_state.imei.decode()))
     time.sleep(0.5)
 ## END OF FUNCTION init_sms_board
 
 def deep_sleep(secs):
-    fade_status(0, 0, 128, 3, 1)
+    wake_guard.stop()
+    if uploader is not None:
+        uploader.close()
+    if store is not None:
+        wake_state.queued = len(store)
+        store.close()
+    ## the profile goes out in the same commit as the rest of the wake
+    wake_profile.save(journal=journal)
+    try:
+        journal.commit()
+    except OSError as e:
+        ## read-only filesystem, nothing this wake wrote can be kept
+        print("Couldn't commit the journal: {}".format(e))
+        journal.discard()
+    if fona is not None:
+        wake_state.modem_type, wake_state.modem_settings = fona.state
+    wake_state.save(alarm.sleep_memory)
+    ## never stay awake for an animation, except one cycle of an error
+    ## warning so it's seen at all
+    status_led.finish(WARNING, LED_WARNING_SECONDS)
+    status_led.cancel()
     # go to sleep for an hour and see if it's time to wake up from quiet mode next time
     time_to_wake = time.monotonic() + secs
     # set the time alarm, notice that monotonic_time here is a named argument and must be set in the function call
@@ -88,192 +221,421 @@ def deep_sleep(secs):
     alarm.exit_and_deep_sleep_until_alarms(time_alarm)
 ## END OF FUNCTION deep_sleep
 
+def sync_time(pool=None, fona=None):
+    ## Get the time from the first source that answers (NTP, then HTTP on
+    ## WiFi, the network clock on cellular) and teach the drift model
+    syncer = TimeSync(NTP_TIMEOUT, HTTP_TIME_TIMEOUT)
+    with wake_guard.phase("time_sync"), span("time_sync"):
+        unixtime = syncer.sync(pool, fona)
+    if unixtime is None:
+        print("Setting time failed")
+        log_error(ERR_TIME, "time_sync", "no time source")
+        return False
+    rtc_now = time.time()
+    r.datetime = time.localtime(unixtime)
+    drift.synced(rtc_now, unixtime)
+    wake_state.sync_source = syncer.source
+    wake_state.sync_ms = min(syncer.duration_ms, 0xFFFF)
+    print(f"Got new System Time: {r.datetime}")
+    return True
+## END OF FUNCTION sync_time
+
+def load_state_from_flash():
+    ## Cold boot or power loss, sleep memory is gone so rebuild the
+    ## cross-wake state from the files that back it up
+    print("No saved sleep state, rebuilding it from flash")
+    state = SleepState()
+    files = os.listdir()
+    state.quiet = 'quiet.txt' in files
+    if 'battery.txt' in files:
+        try:
+            with open('battery.txt', "r") as bf:
+                state.low_water = float(bf.read().splitlines()[0])
+        except (IndexError, ValueError):
+            print("battery.txt is unreadable, starting a new low water mark")
+    return state
+## END OF FUNCTION load_state_from_flash
+
+def write_low_water(new_voltage):
+    ## battery.txt only backs up the sleep state in case of power loss
+    wake_state.low_water = new_voltage
+    journal.replace('battery.txt', '{}\n'.format(new_voltage).encode())
+## END OF FUNCTION write_low_water
+
+def log_error(code, phase, e="", detail=0):
+    ## error records go out with the rest of the wake's writes
+    print("writing to error log")
+    if not detail and isinstance(e, OSError) and e.args and isinstance(e.args[0], int):
+        detail = e.args[0]
+    error_log.log(code, phase, detail, e)
+## END OF FUNCTION log_error
+
+def add_error_summary(data):
+    ## lets the server watch fleet health without pulling errors.bin. The
+    ## counts only go out again once something new has been logged
+    global error_summary_logged
+    if UPLOAD_ERROR_SUMMARY and error_log.logged != wake_state.errors_reported:
+        summary = error_log.summary()
+        if summary:
+            data["errors"] = summary
+            error_summary_logged = error_log.logged
+    return data
+## END OF FUNCTION add_error_summary
+
+def error_summary_delivered():
+    ## the relay accepted a request carrying the counts
+    if error_summary_logged is not None:
+        wake_state.errors_reported = error_summary_logged
+## END OF FUNCTION error_summary_delivered
+
 def handle_quiet_mode(new_voltage):
-    # return if no file
-    if 'quiet.txt' not in os.listdir(): return
-    print("QUIET MODE DETECTED - quiet.txt exists, checking voltage against battery.txt")
+    ## Returns the seconds to sleep for if quiet mode goes on, None otherwise.
+    ## The caller sleeps so its quiet_mode span is closed first
+    global status_animations
+    # return if quiet.txt wasn't there at the last cold boot
+    if not wake_state.quiet: return
+    print("QUIET MODE DETECTED - quiet.txt exists, checking voltage against the low water mark")
     # Okay, we've got a quiet.txt. Sleep unless the battery is charging
     # See quiet.txt.example for more info
-    if 'battery.txt' in os.listdir():
-        f = open('battery.txt',"r")
-        ## get and parse it's data
-        last_voltage = f.read().splitlines()[0]
-        f.close()
+    if wake_state.low_water:
+        last_voltage = wake_state.low_water
         print('QUIET MODE DATA - new voltage:{}, last_voltage:{}'.format(new_voltage, last_voltage))
-        if(new_voltage > float(last_voltage) + VOLT_DIFF_FOR_CHARGE):
+        if(new_voltage > last_voltage + VOLT_DIFF_FOR_CHARGE):
+            ## someone just plugged the unit in, always show it
+            status_animations = True
             fade_up_status(128, 128, 128, 4, 1)
             print("QUIET MODE ENDED - battery is charging. Unit must be plugged in")
             print("Clearing battery.txt and quiet.txt")
             # Higher voltage even with some offset! We're plugged in
             # and charging. Clear the quiet and return. 
-            os.remove('battery.txt')
-            os.remove('quiet.txt')
+            wake_state.quiet = False
+            wake_state.low_water = 0.0
+            for quiet_file in ('battery.txt', 'quiet.txt'):
+                journal.remove(quiet_file)
             return
         else:
-            # Lower voltage, update the battery.txt file
-            if(new_voltage < float(last_voltage)):
-                # overwrite file with new lower voltages, don't write higher voltages
+            # Lower voltage, update the low water mark
+            if(new_voltage < last_voltage):
+                # overwrite with new lower voltages, don't write higher voltages
                 # we're keeping a "low water mark" here
                 print("QUIET MODE: overwriting battery.txt low water mark")
-                with open('battery.txt', "w") as bf:
-                    bf.write('{}\n'.format(new_voltage))
+                write_low_water(new_voltage)
             flash_status(80, 0, 128, 2, 1)
             print("QUIET MODE: Sleeping for "+ str(QUIET_MODE_SLEEP_LENGTH / 60) + " min")
-            deep_sleep(QUIET_MODE_SLEEP_LENGTH)
+            return QUIET_MODE_SLEEP_LENGTH
     else:
         print("QUIET MODE: writing new battery.txt")
-        with open('battery.txt', "w") as bf:
-            bf.write('{}\n'.format(new_voltage))
-            flash_status(80, 0, 128, 2, 1)
-            print("QUIET MODE: Sleeping for "+ str(QUIET_MODE_SLEEP_LENGTH / 60) + " min")
-            deep_sleep(QUIET_MODE_SLEEP_LENGTH)
+        write_low_water(new_voltage)
+        flash_status(80, 0, 128, 2, 1)
+        print("QUIET MODE: Sleeping for "+ str(QUIET_MODE_SLEEP_LENGTH / 60) + " min")
+        return QUIET_MODE_SLEEP_LENGTH
             
 ## END OF FUNCTION handle_quiet_mode
 
 
-def transmit_queue(requests):
+def open_store():
+    ## Open the reading ring once per wake, the filesystem must be writable
+    global store
+    if store is None:
+        store = ReadingStore(QUEUE_PATH, QUEUE_CAPACITY, journal)
+        ## legacy queue files can only show up after a firmware update (a cold boot)
+        if not fast_wake and 'queue' in os.listdir():
+            moved = migrate_legacy_queue(store)
+            print("Moved {} legacy /queue/ files into {}".format(moved, QUEUE_PATH))
+    return store
+## END OF FUNCTION open_store
+
+def transmit_queue(uploader):
     print("Entered function: transmit_queue")
-    if 'queue' not in os.listdir(): return
-    qfiles = os.listdir('/queue/')
-    for qfile in qfiles:
-        if not qfile.startswith('1'):
-            print('Removing extraneous file in queue /queue/{}'.format(qfile))
-            os.remove('/queue/{}'.format(qfile))
-        if not qfile.endswith('.txt'):
-            print('Removing extraneous file in queue /queue/{}'.format(qfile))
-            os.remove('/queue/{}'.format(qfile))
-        ## File looks legit, open it
-        print("opening queued file /queue/{}".format(qfile))
-        f = open('/queue/{}'.format(qfile),"r")
-        ## get and parse it's data
-        qdata = f.read().splitlines()[0].split(',')
-        f.close()
+    if wake_state.queued == 0:
+        ## nothing was queued at the end of the last wake, don't open the store
+        return True
+    store = open_store()
+    budget = DrainBudget(DRAIN_MAX_SECONDS, DRAIN_MAX_READINGS)
+    try:
+        with wake_guard.phase("drain"), span("drain"):
+            return drain_queue(uploader, store, budget)
+    except UploadError as e:
+        print("Sending queued heatseek data failed: {}".format(e))
+        log_error(ERR_DRAIN, "drain", e)
+        return False
+    finally:
+        print("Drained {} queued readings, {} left for later".format(budget.sent, len(store)))
+## END OF FUNCTION - transmit_queue(uploader)
+
+def batch_upload_supported():
+    ## the relay's answer is kept across wakes, so a relay without batch
+    ## support doesn't cost a rejected request on every wake. One that
+    ## failed this wake isn't tried again before the next
+    if batch_rejected_at:
+        return False
+    return not wake_state.batch_rejected or time.time() - wake_state.batch_rejected >= BATCH_REPROBE_SECONDS
+## END OF FUNCTION - batch_upload_supported()
+
+def drain_queue(uploader, store, budget):
+    batch_size = UPLOAD_BATCH_SIZE
+    while len(store) > 0:
+        status_led.update()
+        ## gives up once the drain budget is spent
+        wake_guard.check()
+        if budget.exhausted:
+            print("Drain budget used up, resuming on the next wake")
+            return False
+        if batch_size > 1 and batch_upload_supported():
+            batch_size = transmit_batch(uploader, store, batch_size, budget)
+            if batch_size == 0:
+                return False
+            continue
+        queued = store.peek(1)
+        if not queued:
+            ## only unreadable slots left, drop them
+            store.commit(len(store))
+            return True
+        qtime, qtemp, qhumidity = queued[0]
         ## make our heatseek data object with that queued data
         heatseek_data = {
             "hub":"featherhub",
             "cell": secrets["cell_id"],
-            "time": qdata[0],
-            "temp": qdata[1],
-            "humidity": qdata[2],
+            "time": qtime,
+            "temp": qtemp,
+            "humidity": qhumidity,
             "sp": secrets["reading_interval"],
             "cell_version": CODE_VERSION,
         }
         ## try sending it, we already know we have a connection or we 
         ## wouldn't get to the transmit_queue function
-        send_success = False
-        print("Sending queued data file /queue/{}".format(qfile))
-        response = requests.post(HEATSEEK_URL, data=heatseek_data)
-        if response.status_code == 200:
+        print("Sending queued reading from {}".format(qtime))
+        if uploader.post_form(HEATSEEK_PATH, heatseek_data) == 200:
             print("SUCCESS sending queued to Heat Seek at {}".format(time.time()))
-            send_success = True
-            os.remove('/queue/{}'.format(qfile))
+            store.commit(1)
+            budget.spend(1)
+            if batch_rejected_at:
+                ## the relay takes single readings, so it was the batch
+                ## format it didn't take and not a relay that's down
+                wake_state.batch_rejected = batch_rejected_at
         else:
             print("Sending queued heatseek data failed")
             return False
-## END OF FUNCTION - transmit_queue(requests)
-
-def transmit_sms_queue():
-    print("Entered function: transmit_sms_queue")
-    if 'queue' not in os.listdir(): return
-    qfiles = os.listdir('/queue/')
+    return True
+## END OF FUNCTION - drain_queue(uploader, store, budget)
+
+def transmit_batch(uploader, store, batch_size, budget):
+    ## Send up to batch_size queued readings in one request. Returns the
+    ## batch size to use next, or 0 when draining should stop
+    global batch_rejected_at
+    count = budget.allowance(batch_size)
+    if count == 0:
+        return 0
+    ## detailed records so merged readings go up with their min, max and count
+    queued = store.peek(count, True)
+    if not queued:
+        ## only unreadable slots left, drop them
+        store.commit(len(store))
+        return batch_size
+    heatseek_meta = add_error_summary({
+        "hub":"featherhub",
+        "cell": secrets["cell_id"],
+        "sp": secrets["reading_interval"],
+        "cell_version": CODE_VERSION,
+    })
+    print("Sending batch of {} queued readings".format(len(queued)))
+    status, body = uploader.post_json(HEATSEEK_PATH, build_batch(heatseek_meta, queued))
+    acked = parse_ack(status, body, len(queued))
+    if acked is None:
+        print("Relay didn't take the batch (status {}), falling back to one post per reading".format(status))
+        ## only kept across wakes once a single reading post goes through
+        batch_rejected_at = time.time()
+        return batch_size
+    wake_state.batch_rejected = 0
+    if acked < 0:
+        print("Batch of {} was too large, halving it".format(len(queued)))
+        return max(1, len(queued) // 2)
+    store.commit(acked)
+    budget.spend(acked)
+    if acked:
+        error_summary_delivered()
+    print("Relay accepted {} of {} batched readings".format(acked, len(queued)))
+    if acked < len(queued):
+        return 0
+    return batch_size
+## END OF FUNCTION - transmit_batch(uploader, store, batch_size, budget)
+
+def pack_sms(queued):
+    ## Turn queued readings into one SMS body, returns (message, readings used)
+    if SMS_COMPACT:
+        ## pack as many readings as fit in one message
+        return sms_codec.encode(secrets["cell_id"], secrets["reading_interval"], queued)
+    queued = queued[0:SMS_QUEUE_LENGTH]
     heatseek_json = '{{"c":"{}","i":"{}","r":['.format(secrets["cell_id"], secrets["reading_interval"])
     heatseek_json_ar = []
-    ## Get the files in batches of 2
-    for qfile in qfiles[0:SMS_QUEUE_LENGTH]:
-        if not qfile.startswith('1'):
-            print('Removing extraneous file in queue /queue/{}'.format(qfile))
-            os.remove('/queue/{}'.format(qfile))
-        if not qfile.endswith('.txt'):
-            print('Removing extraneous file in queue /queue/{}'.format(qfile))
-            os.remove('/queue/{}'.format(qfile))
-        ## File looks legit, open it
-        print("opening queued file /queue/{}".format(qfile))
-        f = open('/queue/{}'.format(qfile),"r")
-        ## get and parse it's data
-        qdata = f.read().splitlines()[0].split(',')
-        f.close()
-        ## make our heatseek data object with that queued data
-        
-        heatseek_json_ar.append('{{"ti":"{}","te":"{}","h":"{}"}}'.format((int(qdata[0]) - 1667875724), round((float(qdata[1])),1), round(float(qdata[2]),1)))
+    for qtime, qtemp, qhumidity in queued:
+        heatseek_json_ar.append('{{"ti":"{}","te":"{}","h":"{}"}}'.format((qtime - sms_codec.EPOCH), round(qtemp,1), round(qhumidity,1)))
     heatseek_json += (",".join(heatseek_json_ar))
     heatseek_json += ']}'
-    send_success = False
-    send_success = fona.send_sms(SMS_RELAY_NUMBER, str(heatseek_json))
-    if send_success:
-        print("SUCCESS sending queued to Heat Seek at {}".format(time.time()))
-        for qfile in qfiles[0:SMS_QUEUE_LENGTH]:
-            os.remove('/queue/{}'.format(qfile))
-        qfiles = os.listdir('/queue/')
-        if len(qfiles) > 0:
-            transmit_sms_queue()
-        # TODO: call this again recursively if we still have files
-        return True
-    else:
-        print("Sending queued heatseek data failed")
+    return heatseek_json, len(queued)
+## END OF FUNCTION - pack_sms(queued)
+
+def sms_readings_per_message():
+    ## Queued readings that make one SMS worth sending. A compact message is
+    ## sent once the queue is sure to fill it, the tail waits for the next one
+    if not SMS_COMPACT:
+        return SMS_QUEUE_LENGTH
+    return sms_codec.capacity(secrets["cell_id"], secrets["reading_interval"], current_reading().time)
+## END OF FUNCTION - sms_readings_per_message()
+
+def transmit_sms_queue(min_readings):
+    print("Entered function: transmit_sms_queue")
+    store = open_store()
+    if len(store) == 0: return
+    budget = DrainBudget(DRAIN_MAX_SECONDS, DRAIN_MAX_READINGS)
+    ## JSON messages drain the whole queue, compact ones keep a partial tail
+    drain = SmsDrain(fona, SMS_RELAY_NUMBER, store, pack_sms, budget, SMS_PEEK_LENGTH,
+                     min_readings if SMS_COMPACT else 1)
+    with wake_guard.phase("sms_drain"), span("sms_drain"):
+        drained = drain.run()
+    if not drained:
+        ## a used up budget isn't an error, the rest goes on the next wake
+        if drain.failed:
+            log_error(ERR_SMS, "sms_drain", "sms send failed")
         return False
-## END OF FUNCTION - transmit_sms_queue(requests)
+    print("SUCCESS sending queued to Heat Seek at {}".format(time.time()))
+    return True
+## END OF FUNCTION - transmit_sms_queue()
 
 def clear_queued_files():
-    if 'queue' not in os.listdir(): return
-    qfiles = os.listdir('/queue/')
-    for qfile in qfiles:
-        os.remove('/queue/{}'.format(qfile))
+    open_store().clear()
 
-def write_queue_file():
-    if 'queue' not in os.listdir():
-        os.mkdir('queue')
-    with open("/queue/{}.txt".format(time.time()), "a") as qp:
-        fade_status(128, 128, 0, 2, 2)
-        print("Couldn't send or batching SMS msgs, writing a queue file")
-        print('{},{},{}'.format(time.time(), ((sensor.temperature * 1.8) + 32), sensor.relative_humidity))
-        qp.write('{},{},{}\n'.format(time.time(), ((sensor.temperature * 1.8) + 32), sensor.relative_humidity))
-        qp.flush()
-        qp.close()
+def wifi_upload_due():
+    ## Decide whether this wake brings the radio up or only queues the reading
+    if WIFI_BATCH_READINGS <= 1:
+        return True
+    if not fast_wake:
+        print("Cold boot, connecting to WiFi")
+        return True
+    now = time.time()
+    if now < 1665240748 or drift.needs_sync(now):
+        print("Time needs a sync, connecting to WiFi")
+        return True
+    if wake_state.queued == QUEUE_UNKNOWN or wake_state.queued + 1 >= WIFI_BATCH_READINGS:
+        print("Batch of {} readings is full, connecting to WiFi".format(WIFI_BATCH_READINGS))
+        return True
+    if WIFI_BATCH_MINUTES and now - wake_state.last_upload >= WIFI_BATCH_MINUTES * 60:
+        print("Last upload was over {} minutes ago, connecting to WiFi".format(WIFI_BATCH_MINUTES))
+        return True
+    if URGENT_TEMP_BELOW and current_reading().temp_f < float(URGENT_TEMP_BELOW):
+        print("Reading is below {}F, connecting to WiFi".format(URGENT_TEMP_BELOW))
+        return True
+    print("Batching, {} of {} readings queued, WiFi stays off".format(wake_state.queued + 1, WIFI_BATCH_READINGS))
+    return False
+## END OF FUNCTION wifi_upload_due
+
+def current_reading():
+    ## Take this wake's one reading the first time it's needed, once the
+    ## clock is known to be good, and hand the same values to everyone
+    global reading
+    if reading is None:
+        with wake_guard.phase("sensor_read"), span("sensor_read"):
+            reading = sensor_reading.acquire(sensor, SENSOR_SAMPLES)
+        print("Reading: {:.2f}F {:.2f}% from {} samples in {}ms, spread {:.2f}F {:.2f}%".format(
+            reading.temp_f, reading.humidity, reading.samples, reading.acquire_ms,
+            reading.temp_spread, reading.humidity_spread))
+    return reading
+## END OF FUNCTION current_reading
+
+def wake_overrun(phase):
+    ## A phase ran out of time: keep the reading, note which phase it was and
+    ## go straight back to sleep
+    print("Wake overran in phase {}, going back to sleep".format(phase))
+    log_error(ERR_OVERRUN, phase, "wake overrun")
+    ## a sensor that just hung would only hang again
+    if not reading_saved and phase != "sensor_read" and time.time() >= 1665240748:
+        try:
+            write_queue_file()
+        except Exception as e:
+            print("Couldn't save the reading: {}".format(e))
+    deep_sleep(reading_interval)
+## END OF FUNCTION wake_overrun
 
+def write_queue_file():
+    global reading_saved
+    reading = current_reading()
+    store = open_store()
+    fade_status(128, 128, 0, 2, 2)
+    print("Couldn't send or batching msgs, queueing the reading")
+    print('{},{},{}'.format(reading.time, reading.temp_f, reading.humidity))
+    with span("store_write"):
+        store.append(reading.time, reading.temp_f, reading.humidity)
+    wake_state.queued = len(store)
+    reading_saved = True
+
+## The LED helpers queue a pattern on status_led and return straight away,
+## status_led.update() moves it along between steps
 def flash_status(red=128, green=128, blue=128, flash_length=0.5, repeat=1):
-    for x in range(0, repeat):
-        pixels.fill((red, green, blue))
-        time.sleep(flash_length)
-        pixels.fill((0, 0, 0))
-        time.sleep(flash_length)
+    if not status_animations: return
+    status_led.play(FLASH, (red, green, blue), (0, 0, 0), flash_length, repeat)
 
 def flash_warning(red=128, green=0, blue=0, red2=128, green2=128, blue2=0,flash_length=0.5, repeat=4):
-    for x in range(0, repeat):
-        pixels.fill((red, green, blue))
-        time.sleep(flash_length)
-        pixels.fill((red2, green2, blue2))
-        time.sleep(flash_length)
-    pixels.fill((0, 0, 0))
+    ## errors always show, and turn the other animations back on for this wake
+    global status_animations
+    status_animations = True
+    status_led.play(WARNING, (red, green, blue), (red2, green2, blue2), flash_length, repeat)
 
 
 def fade_status(red=0, green=0, blue=128, fade_length=2, repeat=1):
-    for x in range(0, repeat):
-        for y in range(100, 1, -1):
-            pixels.fill((int(pow(red, y/100)), int(pow(green, y/100)), int(pow(blue, y/100))))
-            time.sleep(fade_length / 100)
-    pixels.fill((0, 0, 0))    
+    if not status_animations: return
+    status_led.play(FADE_DOWN, (red, green, blue), (0, 0, 0), fade_length, repeat)
 
 
 def fade_up_status(red=128, green=128, blue=128, fade_length=2, repeat=1):
-    for x in range(0, repeat):
-        for y in range(1, 100):
-            pixels.fill((int(pow(red, y/100)), int(pow(green, y/100)), int(pow(blue, y/100))))
-            time.sleep(fade_length / 100)
-    pixels.fill((0, 0, 0))  
+    if not status_animations: return
+    status_led.play(FADE_UP, (red, green, blue), (0, 0, 0), fade_length, repeat)
 
 ## MAIN CODE BLOCK
+store = None
+uploader = None
+fona = None
+reading = None
+reading_saved = False
+error_summary_logged = None
+batch_rejected_at = 0
 reading_interval = int(secrets["reading_interval"])
+## Every wake gets a deadline, from here on a hang ends in deep sleep
+wake_guard = WakeSupervisor(WAKE_MAX_SECONDS, WAKE_PHASE_SECONDS, wake_overrun, microcontroller.watchdog)
+## Waking from deep sleep takes the fast path: no startup blink or status
+## animations, just read, store, maybe transmit and go back to sleep.
+## Cold boots and errors still get the full animations.
+fast_wake = alarm.wake_alarm is not None
+status_animations = not fast_wake
+## Finish the last wake's writes if it was reset halfway through them
+journal = Journal(JOURNAL_PATH)
+recover_error = None
+try:
+    journal.recover()
+except OSError as e:
+    print("Couldn't replay the journal: {}".format(e))
+    recover_error = e
+error_log = ErrorLog(ERROR_LOG_PATH, ERROR_LOG_CAPACITY, journal)
+if recover_error is not None:
+    log_error(ERR_STORAGE, None, recover_error)
+## Cross-wake state lives in sleep memory, flash is only read on cold boot
+wake_state = SleepState.load(alarm.sleep_memory) if fast_wake else None
+if wake_state is None:
+    wake_state = load_state_from_flash()
 led = digitalio.DigitalInOut(board.LED)
 led.direction = digitalio.Direction.OUTPUT
 
 
-print("Starting up, blink slow then fast for 6 sec")
-for x in range(8):
-    led.value = not led.value
-    time.sleep(0.5)
-for x in range(8):
-    led.value = not led.value
-    time.sleep(0.25)
+if fast_wake:
+    print("Fast wake from deep sleep, skipping the startup blink")
+else:
+    print("Starting up, blink slow then fast for 6 sec")
+    with span("blink"):
+        for x in range(8):
+            led.value = not led.value
+            time.sleep(0.5)
+        for x in range(8):
+            led.value = not led.value
+            time.sleep(0.25)
 
 
 try:
@@ -281,25 +643,35 @@ try:
     ## Set up the realtime clock
     r = rtc.RTC()
     print(f"Time at start: {r.datetime}")
+    ## The RTC runs fast in deep sleep, take out the drift we've learned so far
+    drift = RtcDrift(wake_state, TIME_MAX_ERROR)
+    rtc_now = time.time()
+    corrected_time = drift.correct(rtc_now)
+    if corrected_time != rtc_now:
+        r.datetime = time.localtime(corrected_time)
+        print("Corrected RTC drift by {}s".format(corrected_time - rtc_now))
 
     if (secrets['sms_mode'] == "true"):
         init_sms_board()
-        try:
-            r.datetime = time.localtime(fona.get_timestamp())
-        except:
-            flash_warning()
-        print(f"Time after getting fona time: {r.datetime}")
+        if drift.needs_sync(time.time()):
+            if not sync_time(fona=fona):
+                flash_warning()
+            print(f"Time after getting fona time: {r.datetime}")
 
     ## Check on the battery
     print("LC709203F simple test")
     print("Make sure LiPoly battery is plugged into the board!")
 
-    battery_sensor = LC709203F(board.I2C())
+    with span("startup"):
+        battery_sensor = LC709203F(board.I2C())
 
-    print("IC version:", hex(battery_sensor.ic_version))
-    print("Battery: Mode: %s / %0.3f Volts / %0.1f %%" % (battery_sensor.power_mode, battery_sensor.cell_voltage, battery_sensor.cell_percent))
+        if not fast_wake:
+            print("IC version:", hex(battery_sensor.ic_version))
+        print("Battery: Mode: %s / %0.3f Volts / %0.1f %%" % (battery_sensor.power_mode, battery_sensor.cell_voltage, battery_sensor.cell_percent))
 except Exception as e:
+    wake_guard.handle(e)
     flash_warning()
+    log_error(ERR_STARTUP, "startup", e)
     print("\nERROR: Problem during startup.")
     print('Error message: {}'.format(e))
     print("Check your connections.")
@@ -307,8 +679,9 @@ except Exception as e:
     deep_sleep(reading_interval)
 
 try:
-    i2c = board.I2C()  # uses board.SCL and board.SDA
-    sensor = adafruit_ahtx0.AHTx0(i2c)
+    with span("sensor_init"):
+        i2c = board.I2C()  # uses board.SCL and board.SDA
+        sensor = adafruit_ahtx0.AHTx0(i2c)
     # If the sensor is connected, go to read only mode so we can write temperatures
     print("\nSENSOR DETECTED, attempting to writing to temperatures.txt, CIRCUITPY is read-only by computer")
     flash_status(0,128,0,1,1)
@@ -317,7 +690,9 @@ except ValueError:
     print("\nNO SENSOR, not writing to temperatures.txt CIRCUITPY is writeable by computer")
     flash_status(0,0,128,1,1)
 except Exception as e:
+    wake_guard.handle(e)
     flash_warning()
+    log_error(ERR_SENSOR, "sensor_init", e)
     print("\nERROR: Problem during sensor startup.")
     print('Error message: {}'.format(e))
     print("Check your connections.")
@@ -325,76 +700,62 @@ except Exception as e:
     deep_sleep(reading_interval)
 
 net_connected = False
-if (secrets['sms_mode'] != "true"):
+if (secrets['sms_mode'] != "true") and wifi_upload_due():
     try: 
         ## #########
-        ## Internal "try" statement attempts to connect to both the tenant wifi
-        ## and the heatseek wifi, so that in almost all cases we get a valid datetime
-        ## on first boot and can use that to keep time during transit
-        try:
-            print("Connecting to %s"%secrets["tenant_wifi_ssid"])
-            wifi.radio.connect(secrets["tenant_wifi_ssid"], secrets["tenant_wifi_password"])
-            print("Connected to %s!"%secrets["tenant_wifi_ssid"])
-            print("My IP address is", wifi.radio.ipv4_address)
-
-            ## Set up http request objects
-            pool = socketpool.SocketPool(wifi.radio)
-            requests = adafruit_requests.Session(pool, ssl.create_default_context())
-            net_connected = True
-            flash_status(0,128,0,0.5,2)
-        except: 
-            print("Connecting to fallback network %s"%secrets["heatseek_wifi_ssid"])
-            wifi.radio.connect(secrets["heatseek_wifi_ssid"], secrets["heatseek_wifi_password"])
-            print("Connected to %s!"%secrets["heatseek_wifi_ssid"])
-            print("My IP address is", wifi.radio.ipv4_address)
-            ## Set up http request objects
-            pool = socketpool.SocketPool(wifi.radio)
-            requests = adafruit_requests.Session(pool, ssl.create_default_context())
-            net_connected = True
-            flash_status(0,128,0,0.5,2)
+        ## The WiFi manager tries the network that worked last time first, then
+        ## both the tenant wifi and the heatseek wifi, so that in almost all cases
+        ## we get a valid datetime on first boot and can use that to keep time
+        ## during transit
+        wifi_manager = WifiManager(wifi.radio, [
+            (NETWORK_TENANT, secrets["tenant_wifi_ssid"], secrets["tenant_wifi_password"]),
+            (NETWORK_HEATSEEK, secrets["heatseek_wifi_ssid"], secrets["heatseek_wifi_password"]),
+        ], wake_state, WIFI_FAST_TIMEOUT, WIFI_TIMEOUT)
+        status_led.update()
+        with wake_guard.phase("wifi_connect"), span("wifi_connect"):
+            wifi_manager.connect()
+        status_led.update()
+        print("My IP address is", wifi.radio.ipv4_address)
+
+        ## Set up http request objects
+        pool = socketpool.SocketPool(wifi.radio)
+        uploader = UploadClient(pool, HEATSEEK_HOST)
+        net_connected = True
+        flash_status(0,128,0,0.5,2)
             
         ## Was this a cold boot or a wake from sleep?
-        if not alarm.wake_alarm:
+        if not fast_wake:
             print("Cold boot.")
             fade_up_status(0,128,0,3,1)
         else:
             print("Waking up from sleep, RTC value after deep sleep was ")
             print(f"System Time: {r.datetime}")
         
-        ## Always get a fresh time because this RTC will rapidly fall out
-        ## of sync in deep sleep (it runs very fast)
-        print("Fetching updated time and setting realtime clock")
-        response = requests.get("http://worldtimeapi.org/api/timezone/America/New_York")
-        if response.status_code == 200:
-            r.datetime = time.localtime(response.json()['unixtime'])
-            print(f"Got new System Time From WorldTimeApi.org: {r.datetime}")
-            # ensure the time matches the RTC's time
-            print(f"setting RTC")
-            time.struct_time(r.datetime)
+        ## This RTC rapidly falls out of sync in deep sleep (it runs very
+        ## fast), only fetch a fresh time once the drift model can't keep up
+        if drift.needs_sync(time.time()):
+            print("Fetching updated time and setting realtime clock")
+            sync_time(pool=pool)
         else:
-            print("Setting time failed")
+            print("Skipping time sync, predicted RTC error is {:.1f}s".format(drift.predicted_error(time.time())))
 
-    except ConnectionError:
+    except ConnectionError as e:
         print("Could not connect to network.")
         flash_warning()
         net_connected = False
-    except ValueError:
+        log_error(ERR_WIFI, "wifi_connect", e)
+    except ValueError as e:
         print("Time response was invalid (no connection or bad data)")
         flash_warning()
         net_connected = False
+        log_error(ERR_TIME, "time_sync", e)
     except Exception as e:  
+        wake_guard.handle(e)
         print("An error occurred in the network connection and time setting block")
         print('\nError message: {}'.format(e))
         flash_warning()
         net_connected = False
-        try:
-            with open("/errors.txt", "a") as fp:
-                print("writing to error log")
-                fp.write('{},{}\n'.format(time.time(), e))
-                fp.flush()
-                fp.close()
-        except:
-            print("couldn't write to error log")
+        log_error(ERR_NETWORK, "wifi_connect", e)
 
 ## Check if the time is valid 
 ##   (greater than oct 10 2022 timestamp 1665240748), sleep if not
@@ -402,69 +763,88 @@ if(time.time() < 1665240748):
     print('Time is invalid. Sleeping for ' + str(QUIET_MODE_SLEEP_LENGTH / 60) + ' minutes')
     deep_sleep(QUIET_MODE_SLEEP_LENGTH)
 
-## We have a valid time, write out temperature.txt and try to transmit
+## We have a valid time, archive the reading and try to transmit
 try:
-    with open("/temperature.txt", "a") as fp:
-        # do the C-to-F conversion here if you would like
-        print("writing to file")
-        print('{},{},{},{},{}'.format(time.time(), ((sensor.temperature * 1.8) + 32), sensor.relative_humidity, battery_sensor.power_mode, battery_sensor.cell_voltage))
-        fp.write('{},{},{},{},{}\n'.format(time.time(), ((sensor.temperature * 1.8) + 32), sensor.relative_humidity, battery_sensor.power_mode, battery_sensor.cell_voltage))
-        fp.flush()
-        fp.close()
-
-    handle_quiet_mode(battery_sensor.cell_voltage)
-
-    heatseek_data = {
+    reading = current_reading()
+    print("writing to archive")
+    print('{},{},{},{},{}'.format(reading.time, reading.temp_f, reading.humidity, battery_sensor.power_mode, battery_sensor.cell_voltage))
+    try:
+        with span("archive_write"):
+            Archive(ARCHIVE_PATH, ARCHIVE_SEGMENT_BYTES, ARCHIVE_MAX_BYTES, journal).append(
+                reading.time, reading.temp_f, reading.humidity, battery_sensor.power_mode, battery_sensor.cell_voltage)
+    except OSError as e:
+        ## the archive is only a local copy, still send the reading
+        print("Couldn't write the archive: {}".format(e))
+        log_error(ERR_STORAGE, "archive_write", e)
+
+    status_led.update()
+    with span("quiet_mode"):
+        quiet_sleep = handle_quiet_mode(battery_sensor.cell_voltage)
+    if quiet_sleep:
+        deep_sleep(quiet_sleep)
+
+    heatseek_data = add_error_summary({
         "hub":"featherhub",
         "cell": secrets["cell_id"],
-        "time": time.time(),
-        "temp": ((sensor.temperature * 1.8) + 32),
-        "humidity": sensor.relative_humidity,
+        "time": reading.time,
+        "temp": reading.temp_f,
+        "humidity": reading.humidity,
         "sp": secrets["reading_interval"],
         "cell_version": CODE_VERSION,
-    }
+    })
 
     send_success = False
 
     if (secrets['sms_mode'] == "true"):
         write_queue_file()
-        if 'queue' in os.listdir(): 
-            qfiles = os.listdir('/queue/')
-            if len(qfiles) >= SMS_QUEUE_LENGTH: 
-                send_success = transmit_sms_queue()
+        sms_threshold = sms_readings_per_message()
+        if len(open_store()) >= sms_threshold:
+            send_success = transmit_sms_queue(sms_threshold)
+    elif(net_connected and WIFI_BATCH_READINGS > 1):
+        ## the live reading goes out with the rest of the batch
+        write_queue_file()
+        if transmit_queue(uploader) and len(open_store()) == 0:
+            print("SUCCESS sending batch to Heat Seek at {}".format(time.time()))
+            wake_state.last_upload = time.time()
+            flash_status(128,128,128, 0.5, 3)
     elif(net_connected): 
         try:
-            response = requests.post(HEATSEEK_URL, data=heatseek_data)
-            if response.status_code == 200:
+            with wake_guard.phase("upload"), span("upload"):
+                upload_status = uploader.post_form(HEATSEEK_PATH, heatseek_data)
+            if upload_status == 200:
                 print("SUCCESS sending to Heat Seek at {}".format(time.time()))
                 send_success = True
+                reading_saved = True
+                error_summary_delivered()
                 flash_status(128,128,128, 0.5, 3)
-                transmit_queue(requests)
+                if transmit_queue(uploader):
+                    wake_state.last_upload = time.time()
             else:
                 print("Sending heatseek data failed")
+                log_error(ERR_UPLOAD, "upload", "http status", upload_status)
         except Exception as e:
             ## Something went wrong with the transmit, even though we had a connection
+            wake_guard.handle(e)
             print("Exception when sending to heatseek")
             print('\nError message: {}'.format(e))
-            
+            log_error(ERR_UPLOAD, "upload", e)
             send_success = False
 
         if(send_success == False):
             write_queue_file()
+    else:
+        ## WiFi stayed off for batching or couldn't connect, keep the reading
+        ## for the next upload
+        write_queue_file()
 
     # Create an alarm that will trigger at the next reading interval seconds from now.
     print('Deep sleep for reading interval ({}) until the next send'.format( reading_interval))
     deep_sleep(reading_interval)
 except Exception as e:  # Typically when the filesystem isn't writeable...
+    wake_guard.handle(e)
     flash_warning()
-    try:
-        with open("/errors.txt", "a") as fp:
-            print("writing to error log")
-            fp.write('{},{}\n'.format(time.time(), e))
-            fp.flush()
-            fp.close()
-    except:
-        print("couldn't write to error log")
+    ## an OSError this far out comes from the queue or the filesystem
+    log_error(ERR_STORAGE if isinstance(e, OSError) else ERR_OTHER, None, e)
     print("\nEXCEPTION: Final Try/Exception block triggered")
     print('\nError message: {}'.format(e))
     print("\nnot writing temp to file, or sending to Heat Seek")
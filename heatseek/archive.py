@@ -0,0 +1,281 @@
+"""
+`archive`
+================================================================================
+
+Compact on-device history of every reading, replacing the ever-growing
+``temperature.txt``.
+
+The archive is a directory of segment files named by sequence number
+(``00000001.bin``, ``00000002.bin``, ...). Each segment is a run of
+fixed-size blocks and each block can be decoded on its own. A block starts
+with `BLOCK_MAGIC` and holds length-prefixed records. The first record in a
+block has absolute values. Every later record holds the change from the one
+before it: the time as the change in the gap between readings, then the
+temperature, humidity and voltage deltas. Values are stored as fixed-point
+integers in LEB128 varints, zigzag encoded where they can be negative. A
+steady hourly series costs about six bytes per reading, against about fifty
+for a CSV line.
+
+Appending reads only the last, partly filled block and writes only the new
+record's bytes. A record cut short by a reset is skipped when reading, and
+the next append starts a fresh block after it. When the newest segment is
+full a new one is started, and the oldest segments are deleted to keep the
+archive under its size cap.
+
+Given a `Journal`, appends and deletes go through it. A segment created
+through the journal only shows up in the directory once the journal is
+committed, so a wake should append at most once.
+
+`read` is plain Python so ``tools/archive_to_csv.py`` can use it on a host.
+
+"""
+import os
+
+try:
+    from typing import Iterator, List, Optional, Tuple
+    from heatseek.journal import Journal
+except ImportError:
+    pass
+
+BLOCK_MAGIC = 0xA1
+BLOCK_SIZE = 256
+SEGMENT_SUFFIX = ".bin"
+
+# (time, temperature F, humidity %, power mode, voltage)
+Record = Tuple[int, float, float, int, float]
+
+
+def _zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def _put_varint(out: bytearray, value: int) -> None:
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_varint(data, pos: int) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _fixed(record: Record) -> tuple:
+    # integer time, hundredths of a degree and a percent, power mode, mV
+    ts, temp_f, humidity, power_mode, voltage = record
+    return (
+        int(ts),
+        int(round(temp_f * 100)),
+        int(round(humidity * 100)),
+        int(power_mode),
+        int(round(voltage * 1000)),
+    )
+
+
+def _encode(values: tuple, prev: tuple, prev_gap: int) -> bytes:
+    out = bytearray()
+    if prev is None:
+        _put_varint(out, values[0])
+        _put_varint(out, _zigzag(values[1]))
+        _put_varint(out, values[2])
+        _put_varint(out, values[3])
+        _put_varint(out, values[4])
+    else:
+        _put_varint(out, _zigzag(values[0] - prev[0] - prev_gap))
+        _put_varint(out, _zigzag(values[1] - prev[1]))
+        _put_varint(out, _zigzag(values[2] - prev[2]))
+        _put_varint(out, values[3])
+        _put_varint(out, _zigzag(values[4] - prev[4]))
+    return bytes(out)
+
+
+def _decode(payload, prev: tuple, prev_gap: int) -> tuple:
+    pos = 0
+    fields = []
+    for _ in range(5):
+        value, pos = _get_varint(payload, pos)
+        fields.append(value)
+    if prev is None:
+        return (fields[0], _unzigzag(fields[1]), fields[2], fields[3], fields[4])
+    return (
+        prev[0] + prev_gap + _unzigzag(fields[0]),
+        prev[1] + _unzigzag(fields[1]),
+        prev[2] + _unzigzag(fields[2]),
+        fields[3],
+        prev[4] + _unzigzag(fields[4]),
+    )
+
+
+def _scan_block(block) -> Tuple[List[tuple], int, int]:
+    """Returns the fixed-point records in ``block``, the offset just past the
+    last good one and the last time gap."""
+    records = []
+    if not block or block[0] != BLOCK_MAGIC:
+        return records, 0, 0
+    pos = 1
+    prev = None
+    gap = 0
+    while pos < len(block):
+        length = block[pos]
+        if length == 0 or pos + 1 + length > len(block):
+            break
+        try:
+            values = _decode(block[pos + 1 : pos + 1 + length], prev, gap)
+        except IndexError:
+            break
+        if prev is not None:
+            gap = values[0] - prev[0]
+        records.append(values)
+        prev = values
+        pos += 1 + length
+    return records, pos, gap
+
+
+def _segments(directory: str) -> List[int]:
+    numbers = []
+    for name in os.listdir(directory):
+        if name.endswith(SEGMENT_SUFFIX):
+            try:
+                numbers.append(int(name[: -len(SEGMENT_SUFFIX)]))
+            except ValueError:
+                pass
+    numbers.sort()
+    return numbers
+
+
+def _segment_path(directory: str, number: int) -> str:
+    return "{}/{:08d}{}".format(directory, number, SEGMENT_SUFFIX)
+
+
+class Archive:
+    """Appends readings to the rotating archive in ``directory``.
+
+    :param str directory: Archive directory, created if missing.
+    :param int segment_size: Bytes per segment file, a multiple of `BLOCK_SIZE`.
+    :param int max_bytes: Size cap for all segments together.
+    :param Journal journal: Journal to write through, None to write directly.
+    """
+
+    def __init__(
+        self,
+        directory: str = "/archive",
+        segment_size: int = 16384,
+        max_bytes: int = 262144,
+        journal: Optional[Journal] = None,
+    ) -> None:
+        self._directory = directory
+        self._journal = journal
+        self._blocks_per_segment = max(segment_size // BLOCK_SIZE, 1)
+        self._max_segments = max(max_bytes // (self._blocks_per_segment * BLOCK_SIZE), 2)
+        try:
+            os.mkdir(directory)
+        except OSError:
+            pass  # already there
+
+    # pylint: disable=too-many-arguments
+    def append(self, ts: int, temp_f: float, humidity: float, power_mode: int, voltage: float) -> None:
+        """Adds one reading.
+
+        :param int ts: Unix time.
+        :param float temp_f: Temperature in degrees F.
+        :param float humidity: Relative humidity in %.
+        :param int power_mode: Battery monitor power mode.
+        :param float voltage: Battery voltage.
+        """
+        values = _fixed((ts, temp_f, humidity, power_mode, voltage))
+        segments = _segments(self._directory)
+        number = segments[-1] if segments else 1
+        path = _segment_path(self._directory, number)
+        size = self._size(path)
+        used = size % BLOCK_SIZE
+        record = None
+        if used:
+            records, end, gap = _scan_block(self._read(path, size - used, used))
+            if records and end == used:
+                record = _encode(values, records[-1], gap)
+                if used + 1 + len(record) > BLOCK_SIZE:
+                    record = None
+            if record is None:
+                # close the block with zeros, over any torn record as well,
+                # and start a new one with this reading
+                self._write(path, size - used + end, bytes(BLOCK_SIZE - end))
+                size += BLOCK_SIZE - used
+        if record is None:
+            if size >= self._blocks_per_segment * BLOCK_SIZE:
+                number += 1
+                path = _segment_path(self._directory, number)
+                size = 0
+                segments.append(number)
+                self._prune(segments)
+            record = _encode(values, None, 0)
+            record = bytes((BLOCK_MAGIC, len(record))) + record
+        else:
+            record = bytes((len(record),)) + record
+        self._write(path, size, record)
+
+    def _prune(self, segments: List[int]) -> None:
+        while len(segments) > self._max_segments:
+            path = _segment_path(self._directory, segments.pop(0))
+            if self._journal is not None:
+                self._journal.remove(path)
+            else:
+                os.remove(path)
+
+    ### File helpers ###
+
+    def _size(self, path: str) -> int:
+        if self._journal is not None:
+            return self._journal.size(path) or 0
+        try:
+            return os.stat(path)[6]
+        except OSError:
+            return 0
+
+    def _read(self, path: str, offset: int, length: int) -> bytes:
+        if self._journal is not None:
+            return self._journal.read(path, offset, length)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def _write(self, path: str, offset: int, data: bytes) -> None:
+        if self._journal is not None:
+            self._journal.write(path, offset, data)
+            return
+        with open(path, "r+b" if self._size(path) else "wb") as f:
+            f.seek(offset)
+            f.write(data)
+
+
+def read_segment(data: bytes) -> Iterator[Record]:
+    """Yields the readings in one segment file's contents.
+
+    :param bytes data: Segment file contents.
+    """
+    for start in range(0, len(data), BLOCK_SIZE):
+        records, _, _ = _scan_block(data[start : start + BLOCK_SIZE])
+        for ts, temp, humidity, power_mode, millivolts in records:
+            yield (ts, temp / 100, humidity / 100, power_mode, millivolts / 1000)
+
+
+def read(directory: str) -> Iterator[Record]:
+    """Yields every reading in the archive, oldest first.
+
+    :param str directory: Archive directory.
+    """
+    for number in _segments(directory):
+        with open(_segment_path(directory, number), "rb") as f:
+            data = f.read()
+        yield from read_segment(data)
@@ -0,0 +1,72 @@
+"""
+`batch_upload`
+================================================================================
+
+Packs several queued readings into one JSON request to the relay.
+
+The relay acknowledges a batch with ``{"accepted": <n>}``, meaning the first
+``n`` readings of the batch were stored. A relay that does not understand the
+batch format may answer with any error status, or with a success that has no
+``accepted`` count; in both cases the caller falls back to one form post per
+reading.
+
+"""
+
+try:
+    from typing import List, Optional
+except ImportError:
+    pass
+
+# The relay took the format but the body was too large, try a smaller batch
+BATCH_TOO_LARGE_STATUS = 413
+
+
+def build_batch(meta: dict, readings: List[tuple]) -> dict:
+    """Returns the JSON document for a batch of readings.
+
+    A queued record that stands for several merged readings also carries their
+    count, the minimum and maximum temperature and humidity and the seconds
+    it spans. The mean goes in ``temp`` and ``humidity`` as before.
+
+    :param dict meta: Fields shared by every reading (hub, cell, sp, cell_version).
+    :param list readings: (time, temperature, humidity) tuples, or the detailed
+        tuples from ``ReadingStore.peek(count, detail=True)``, oldest first.
+    """
+    batch = dict(meta)
+    batch["readings"] = [_reading(queued) for queued in readings]
+    return batch
+
+
+def _reading(queued: tuple) -> dict:
+    reading = {"time": queued[0], "temp": queued[1], "humidity": queued[2]}
+    if len(queued) > 3 and queued[3] > 1:
+        count, temp_min, temp_max, hum_min, hum_max, span = queued[3:9]
+        reading["count"] = count
+        reading["temp_min"] = temp_min
+        reading["temp_max"] = temp_max
+        reading["humidity_min"] = hum_min
+        reading["humidity_max"] = hum_max
+        reading["span"] = span
+    return reading
+
+
+def parse_ack(status_code: int, body: Optional[dict], sent: int) -> Optional[int]:
+    """Returns how many readings of the batch the relay stored.
+
+    ``None`` means the relay did not take the batch, for any status other than
+    2xx or 413, and the caller should fall back to per-reading posts. ``-1``
+    means the batch was too large.
+
+    :param int status_code: HTTP status of the response.
+    :param dict body: Decoded JSON response body, if any.
+    :param int sent: Number of readings in the batch.
+    """
+    if status_code == BATCH_TOO_LARGE_STATUS:
+        return -1
+    if not 200 <= status_code < 300:
+        return None
+    try:
+        accepted = int(body["accepted"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return max(0, min(accepted, sent))
@@ -0,0 +1,62 @@
+"""
+`drain_budget`
+================================================================================
+
+Per-wake limit on how long and how much the queue drains run for, so a unit
+coming back from a long outage spreads its backlog over several wakes instead
+of staying awake until it is empty.
+
+The resume point between wakes is the reading ring's head pointer, which
+`ReadingStore.commit` persists after every acknowledged upload.
+
+"""
+import time
+
+try:
+    from typing import Optional
+except ImportError:
+    pass
+
+
+class DrainBudget:
+    """Time and reading allowance for one drain.
+
+    :param float max_seconds: Seconds the drain may run for, None for no limit.
+    :param int max_readings: Readings the drain may send, None for no limit.
+    """
+
+    def __init__(
+        self, max_seconds: Optional[float] = None, max_readings: Optional[int] = None
+    ) -> None:
+        self._deadline = None
+        if max_seconds is not None:
+            self._deadline = time.monotonic() + max_seconds
+        self._readings_left = max_readings
+        self.sent = 0
+
+    @property
+    def exhausted(self) -> bool:
+        """True once the time or reading allowance is used up."""
+        if self._readings_left is not None and self._readings_left <= 0:
+            return True
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
+    def allowance(self, wanted: int) -> int:
+        """Returns how many of ``wanted`` readings may still be sent.
+
+        :param int wanted: Readings the caller would like to send next.
+        """
+        if self.exhausted:
+            return 0
+        if self._readings_left is None:
+            return wanted
+        return min(wanted, self._readings_left)
+
+    def spend(self, readings: int) -> None:
+        """Records that ``readings`` readings were sent.
+
+        :param int readings: Number of readings sent.
+        """
+        self.sent += readings
+        if self._readings_left is not None:
+            self._readings_left -= readings
@@ -0,0 +1,238 @@
+"""
+`error_log`
+================================================================================
+
+Fixed-size error log with per-code counters, replacing the free-form
+``errors.txt`` that was appended to forever.
+
+File layout::
+
+    [header + counters + crc][record 0][record 1]...[record capacity-1]
+
+The header holds the sequence number the next record gets and one lifetime
+counter per error code, so a flapping network shows up as a count and not
+as thousands of lines. The most recent ``capacity`` errors are kept as
+records in a ring. Each record holds its sequence number, the time, the
+error code, the wake phase it happened in (an index into
+`heatseek.wake_profile.PHASES`), a number such as an errno or HTTP status,
+and the start of the message.
+
+`ErrorLog.summary` condenses the counters into a short string that can
+ride along with an upload. `read` is plain Python for use on a host.
+
+"""
+import struct
+import time
+from binascii import crc32
+
+try:
+    from typing import List, Optional, Tuple
+    from heatseek.journal import Journal
+except ImportError:
+    pass
+
+from heatseek.wake_profile import PHASES
+
+ERRORLOG_MAGIC = b"HSE1"
+ERRORLOG_VERSION = 1
+
+# Error codes, append only: the counters are stored by position
+ERR_OTHER = 0
+ERR_STARTUP = 1
+ERR_SENSOR = 2
+ERR_WIFI = 3
+ERR_NETWORK = 4
+ERR_TIME = 5
+ERR_UPLOAD = 6
+ERR_DRAIN = 7
+ERR_SMS = 8
+ERR_OVERRUN = 9
+ERR_STORAGE = 10
+CODE_NAMES = (
+    "other",
+    "startup",
+    "sensor",
+    "wifi",
+    "network",
+    "time",
+    "upload",
+    "drain",
+    "sms",
+    "overrun",
+    "storage",
+)
+CODE_SLOTS = 16
+
+DEFAULT_CAPACITY = 64
+MESSAGE_LENGTH = 12
+
+# magic, version, code slots, capacity, next sequence number
+_HEADER_FORMAT = "<4sBBHI"
+_COUNTERS_FORMAT = "<{}I".format(CODE_SLOTS)
+_HEADER_BODY_SIZE = struct.calcsize(_HEADER_FORMAT) + struct.calcsize(_COUNTERS_FORMAT)
+HEADER_SIZE = _HEADER_BODY_SIZE + 4  # + crc32
+
+# seq, unix time, code, phase, detail, message
+_RECORD_FORMAT = "<IIBBH{}s".format(MESSAGE_LENGTH)
+RECORD_SIZE = struct.calcsize(_RECORD_FORMAT)
+
+# (seq, time, code name, phase name, detail, message)
+Entry = Tuple[int, int, str, str, int, str]
+
+
+def _crc(data: bytes) -> int:
+    return crc32(data) & 0xFFFFFFFF
+
+
+def _parse_header(data: bytes) -> Optional[Tuple[int, int, list]]:
+    if len(data) < HEADER_SIZE:
+        return None
+    if struct.unpack_from("<I", data, _HEADER_BODY_SIZE)[0] != _crc(data[:_HEADER_BODY_SIZE]):
+        return None
+    magic, version, slots, capacity, next_seq = struct.unpack_from(_HEADER_FORMAT, data)
+    if magic != ERRORLOG_MAGIC or version != ERRORLOG_VERSION or slots != CODE_SLOTS:
+        return None
+    if not capacity:
+        return None
+    counters = list(struct.unpack_from(_COUNTERS_FORMAT, data, struct.calcsize(_HEADER_FORMAT)))
+    return capacity, next_seq, counters
+
+
+def _name(names: tuple, index: int) -> str:
+    return names[index] if 0 <= index < len(names) else str(index)
+
+
+class ErrorLog:
+    """Ring of recent errors plus lifetime counters per code.
+
+    :param str path: Location of the log file.
+    :param int capacity: Records kept. Only used when the file is created.
+    :param Journal journal: Journal to write through, None to write directly.
+    """
+
+    def __init__(
+        self, path: str = "/errors.bin", capacity: int = DEFAULT_CAPACITY, journal: Optional[Journal] = None
+    ) -> None:
+        self._path = path
+        self._journal = journal
+        self._capacity = capacity
+        self._next = 0
+        self._counters = None
+
+    @property
+    def counters(self) -> List[int]:
+        """Lifetime count per error code, indexed by code."""
+        self._load()
+        return list(self._counters)
+
+    @property
+    def logged(self) -> int:
+        """Errors logged over the life of the file, it only ever grows."""
+        self._load()
+        return self._next
+
+    def log(self, code: int, phase: Optional[str] = None, detail: int = 0, message: str = "") -> None:
+        """Records an error.
+
+        :param int code: One of the ``ERR_`` codes.
+        :param str phase: Name from `heatseek.wake_profile.PHASES`, None if none.
+        :param int detail: Errno, HTTP status or similar, 0 if none.
+        :param str message: Description, only the start is kept.
+        """
+        self._load()
+        self._counters[code] = min(self._counters[code] + 1, 0xFFFFFFFF)
+        phase_id = PHASES.index(phase) + 1 if phase in PHASES else 0
+        record = struct.pack(
+            _RECORD_FORMAT,
+            self._next,
+            int(time.time()),
+            code,
+            phase_id,
+            detail & 0xFFFF,
+            str(message).encode()[:MESSAGE_LENGTH],
+        )
+        self._write(HEADER_SIZE + (self._next % self._capacity) * RECORD_SIZE, record)
+        self._next += 1
+        self._write(0, self._header())
+
+    def summary(self) -> str:
+        """Non-zero counters as ``name:count`` pairs, e.g. ``wifi:3,upload:1``."""
+        self._load()
+        return ",".join(
+            "{}:{}".format(_name(CODE_NAMES, code), count)
+            for code, count in enumerate(self._counters)
+            if count
+        )
+
+    def _load(self) -> None:
+        if self._counters is not None:
+            return
+        header = _parse_header(self._read(0, HEADER_SIZE))
+        if header is not None:
+            self._capacity, self._next, self._counters = header
+            return
+        # missing or unreadable, start a new log of the whole size at once
+        self._next = 0
+        self._counters = [0] * CODE_SLOTS
+        self._write(0, self._header() + bytes(self._capacity * RECORD_SIZE))
+
+    def _header(self) -> bytes:
+        body = struct.pack(
+            _HEADER_FORMAT, ERRORLOG_MAGIC, ERRORLOG_VERSION, CODE_SLOTS, self._capacity, self._next
+        ) + struct.pack(_COUNTERS_FORMAT, *self._counters)
+        return body + struct.pack("<I", _crc(body))
+
+    ### File helpers ###
+
+    def _read(self, offset: int, length: int) -> bytes:
+        if self._journal is not None:
+            return self._journal.read(self._path, offset, length)
+        try:
+            with open(self._path, "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+        except OSError:
+            return b""
+
+    def _write(self, offset: int, data: bytes) -> None:
+        if self._journal is not None:
+            self._journal.write(self._path, offset, data)
+            return
+        try:
+            f = open(self._path, "r+b")
+        except OSError:
+            f = open(self._path, "w+b")
+        with f:
+            f.seek(offset)
+            f.write(data)
+
+
+def read(data: bytes) -> Tuple[List[int], List[Entry]]:
+    """Returns the counters and the kept records, oldest first, from the
+    contents of a log file.
+
+    :param bytes data: Log file contents.
+    """
+    header = _parse_header(data)
+    if header is None:
+        raise ValueError("not an error log")
+    capacity, next_seq, counters = header
+    entries = []
+    for seq in range(max(0, next_seq - capacity), next_seq):
+        offset = HEADER_SIZE + (seq % capacity) * RECORD_SIZE
+        if len(data) < offset + RECORD_SIZE:
+            continue
+        rec_seq, timestamp, code, phase, detail, message = struct.unpack_from(
+            _RECORD_FORMAT, data, offset
+        )
+        if rec_seq != seq:
+            continue
+        entries.append((
+            seq,
+            timestamp,
+            _name(CODE_NAMES, code),
+            _name(("-",) + PHASES, phase),
+            detail,
+            message.rstrip(b"\x00").decode("utf-8", "replace"),
+        ))
+    return counters, entries
@@ -0,0 +1,277 @@
+"""
+`journal`
+================================================================================
+
+Write-ahead journal that turns all of a wake's file changes into one
+sequential flash write.
+
+Components hand their writes to a `Journal` instead of the filesystem. A
+write is a physical ``(path, offset, bytes)`` change. Whole-file replaces
+and removes are supported too. Everything is held in RAM, and reads through
+the journal see the pending changes. A write to the same range as an
+earlier one replaces it, as long as nothing queued for that file since
+overlaps the range, so alternating header slots cost one entry each.
+
+`Journal.commit`, called just before deep sleep, writes the whole batch to
+the journal file in one go, followed by its CRC. Only then are the changes
+applied to their files, after which the journal file is deleted. A reset
+while the journal file is being written leaves a bad CRC, and nothing has
+been touched yet. A reset while the changes are being applied leaves a good
+journal behind. `Journal.recover` replays that journal on the next boot,
+which is safe because every entry can be applied more than once with the
+same result.
+
+"""
+import os
+import struct
+from binascii import crc32
+
+try:
+    from typing import List, Optional
+except ImportError:
+    pass
+
+JOURNAL_MAGIC = b"HSJ1"
+
+WRITE = 0
+REPLACE = 1
+REMOVE = 2
+
+# magic, entry count, body length
+_HEADER_FORMAT = "<4sHI"
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+# kind, path length, offset, data length
+_ENTRY_FORMAT = "<BBII"
+_ENTRY_SIZE = struct.calcsize(_ENTRY_FORMAT)
+
+
+def _crc(data: bytes) -> int:
+    return crc32(data) & 0xFFFFFFFF
+
+
+def _file_size(path: str) -> Optional[int]:
+    try:
+        return os.stat(path)[6]
+    except OSError:
+        return None
+
+
+class Journal:
+    """Pending file changes for one wake.
+
+    :param str path: Location of the journal file.
+    """
+
+    def __init__(self, path: str = "/journal.bin") -> None:
+        self._path = path
+        # [kind, path, offset, data]
+        self._entries = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    ### Changes ###
+
+    def write(self, path: str, offset: int, data: bytes) -> None:
+        """Queues writing ``data`` at ``offset`` in ``path``, creating the file
+        if needed.
+
+        :param str path: File to change.
+        :param int offset: Byte offset, at most the file's current size.
+        :param bytes data: New contents of that range.
+        """
+        data = bytes(data)
+        end = offset + len(data)
+        for entry in reversed(self._entries):
+            if entry[1] != path:
+                continue
+            if entry[0] != WRITE:
+                break
+            if entry[2] == offset and len(entry[3]) == len(data):
+                # a newer copy of the same range, e.g. a header slot
+                entry[3] = data
+                return
+            if entry[2] < end and offset < entry[2] + len(entry[3]):
+                # overlaps, this write has to be applied after it
+                break
+        self._entries.append([WRITE, path, offset, data])
+
+    def append(self, path: str, data: bytes) -> None:
+        """Queues adding ``data`` to the end of ``path``.
+
+        :param str path: File to change.
+        :param bytes data: Bytes to add.
+        """
+        self.write(path, self.size(path) or 0, data)
+
+    def replace(self, path: str, data: bytes) -> None:
+        """Queues replacing the whole of ``path`` with ``data``.
+
+        :param str path: File to write.
+        :param bytes data: New contents.
+        """
+        self._entries.append([REPLACE, path, 0, bytes(data)])
+
+    def remove(self, path: str) -> None:
+        """Queues deleting ``path``.
+
+        :param str path: File to delete.
+        """
+        self._entries.append([REMOVE, path, 0, b""])
+
+    ### Reads that see the pending changes ###
+
+    def size(self, path: str) -> Optional[int]:
+        """Returns the size ``path`` will have, or None if it won't exist.
+
+        :param str path: File to look at.
+        """
+        size = _file_size(path)
+        for kind, entry_path, offset, data in self._entries:
+            if entry_path != path:
+                continue
+            if kind == WRITE:
+                size = max(size or 0, offset + len(data))
+            elif kind == REPLACE:
+                size = len(data)
+            else:
+                size = None
+        return size
+
+    def read(self, path: str, offset: int, length: int) -> bytes:
+        """Returns up to ``length`` bytes at ``offset`` as they will be.
+
+        :param str path: File to read.
+        :param int offset: Byte offset.
+        :param int length: Bytes wanted.
+        """
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                base = f.read(length)
+        except OSError:
+            base = b""
+        return self.overlay(path, offset, base, length)
+
+    def overlay(self, path: str, offset: int, data: bytes, length: int) -> bytes:
+        """Returns ``data``, read from ``path`` at ``offset``, with the pending
+        changes to that range applied.
+
+        :param str path: File ``data`` came from.
+        :param int offset: Where ``data`` starts.
+        :param bytes data: Bytes read from the file.
+        :param int length: Bytes that were asked for.
+        """
+        buf = None
+        end = offset + length
+        for kind, entry_path, entry_offset, entry_data in self._entries:
+            if entry_path != path:
+                continue
+            if buf is None:
+                buf = bytearray(data)
+            if kind == REMOVE:
+                buf = bytearray()
+                continue
+            if kind == REPLACE:
+                buf = bytearray(entry_data[offset:end])
+                continue
+            start = max(offset, entry_offset)
+            stop = min(end, entry_offset + len(entry_data))
+            if start >= stop:
+                continue
+            if len(buf) < stop - offset:
+                buf.extend(bytes(stop - offset - len(buf)))
+            buf[start - offset : stop - offset] = entry_data[
+                start - entry_offset : stop - entry_offset
+            ]
+        return data if buf is None else bytes(buf)
+
+    ### Commit and recovery ###
+
+    def commit(self) -> None:
+        """Writes the journal, applies it and deletes it."""
+        if not self._entries:
+            return
+        body = bytearray()
+        for kind, path, offset, data in self._entries:
+            name = path.encode()
+            body += struct.pack(_ENTRY_FORMAT, kind, len(name), offset, len(data))
+            body += name
+            body += data
+        block = struct.pack(_HEADER_FORMAT, JOURNAL_MAGIC, len(self._entries), len(body))
+        block += body
+        with open(self._path, "wb") as f:
+            f.write(block + struct.pack("<I", _crc(block)))
+        self._apply(self._entries)
+        self._entries = []
+        os.remove(self._path)
+
+    def discard(self) -> None:
+        """Drops every pending change."""
+        self._entries = []
+
+    def recover(self) -> int:
+        """Replays a journal left by a reset during the last commit and returns
+        the number of changes applied.
+        """
+        try:
+            with open(self._path, "rb") as f:
+                block = f.read()
+        except OSError:
+            return 0
+        entries = self._parse(block)
+        if entries:
+            print("Replaying {} journaled changes".format(len(entries)))
+            self._apply(entries)
+        else:
+            print("Dropping a torn journal")
+        os.remove(self._path)
+        return len(entries)
+
+    @staticmethod
+    def _parse(block: bytes) -> List[list]:
+        if len(block) < _HEADER_SIZE + 4:
+            return []
+        magic, count, length = struct.unpack_from(_HEADER_FORMAT, block)
+        end = _HEADER_SIZE + length
+        if magic != JOURNAL_MAGIC or len(block) < end + 4:
+            return []
+        if struct.unpack_from("<I", block, end)[0] != _crc(block[:end]):
+            return []
+        entries = []
+        pos = _HEADER_SIZE
+        for _ in range(count):
+            kind, name_length, offset, data_length = struct.unpack_from(_ENTRY_FORMAT, block, pos)
+            pos += _ENTRY_SIZE
+            path = block[pos : pos + name_length].decode()
+            pos += name_length
+            entries.append([kind, path, offset, block[pos : pos + data_length]])
+            pos += data_length
+        return entries
+
+    @staticmethod
+    def _apply(entries: List[list]) -> None:
+        f = None
+        open_path = None
+        try:
+            for kind, path, offset, data in entries:
+                if f is not None and (kind != WRITE or path != open_path):
+                    f.close()
+                    f = None
+                if kind == REMOVE:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                elif kind == REPLACE:
+                    with open(path, "wb") as replaced:
+                        replaced.write(data)
+                else:
+                    if f is None:
+                        open_path = path
+                        f = open(path, "r+b" if _file_size(path) is not None else "w+b")
+                    f.seek(offset)
+                    f.write(data)
+        finally:
+            if f is not None:
+                f.close()
@@ -0,0 +1,376 @@
+"""
+`reading_store`
+================================================================================
+
+Append-only ring buffer of queued readings, kept in a single fixed-size
+binary file so a long offline period never grows the FAT directory.
+
+File layout::
+
+    [header slot A][header slot B][record 0][record 1]...[record capacity-1]
+
+Both header slots hold the head/tail sequence numbers and a generation
+counter. Writes alternate between the slots so a torn header write always
+leaves the previous one intact. Every record carries its own sequence number
+and CRC, so a record written just before power was lost is recovered on the
+next open and a half-written one is ignored.
+
+A record is an aggregate: its start time, the seconds it covers, how many
+readings went into it, and the mean, minimum and maximum temperature and
+humidity. A fresh reading is an aggregate of one. Once the ring is
+`MERGE_AT` full, the next append first halves the oldest quarter of the ring
+by merging neighbouring records, which frees an eighth of the slots. The
+oldest data gets coarser and coarser while the newest stays at full
+resolution, so a unit that is offline for months keeps logging instead of
+dropping readings.
+
+Given a `Journal`, every write after the file is created goes through it and
+reaches flash when the journal is committed.
+
+"""
+import os
+import struct
+from binascii import crc32
+
+try:
+    from typing import List, Optional, Tuple
+    from heatseek.journal import Journal
+except ImportError:
+    pass
+
+STORE_MAGIC = b"HSQ1"
+STORE_VERSION = 1
+
+# magic, version, record size, capacity, generation, head, tail
+_HEADER_FORMAT = "<4sHHIIII"
+_HEADER_SLOT_SIZE = 32
+_HEADER_SIZE = 2 * _HEADER_SLOT_SIZE
+
+# seq, unix time, seconds covered, readings merged, temperature mean, min
+# and max (1/100 F), humidity mean, min and max (1/100 %)
+_RECORD_FORMAT = "<IIIHhhhHHH"
+_RECORD_BODY_SIZE = struct.calcsize(_RECORD_FORMAT)
+RECORD_SIZE = _RECORD_BODY_SIZE + 4  # + crc32
+
+DEFAULT_CAPACITY = 2048
+# Fill level, as a fraction of capacity, where merging starts
+MERGE_AT = 0.875
+
+
+def _crc(data: bytes) -> int:
+    return crc32(data) & 0xFFFFFFFF
+
+
+def _merge(older: tuple, newer: tuple) -> tuple:
+    # both are (time, seconds, count, temp, temp min, temp max, hum, hum min, hum max)
+    count = older[2] + newer[2]
+    end = max(older[0] + older[1], newer[0] + newer[1])
+    return (
+        older[0],
+        end - older[0],
+        min(count, 0xFFFF),
+        (older[3] * older[2] + newer[3] * newer[2]) // count,
+        min(older[4], newer[4]),
+        max(older[5], newer[5]),
+        (older[6] * older[2] + newer[6] * newer[2]) // count,
+        min(older[7], newer[7]),
+        max(older[8], newer[8]),
+    )
+
+
+def _file_exists(path: str) -> bool:
+    try:
+        os.stat(path)
+    except OSError:
+        return False
+    return True
+
+
+class ReadingStore:
+    """Fixed-size, append-only ring of (time, temperature, humidity) readings.
+
+    :param str path: Location of the ring file.
+    :param int capacity: Number of reading slots. Only used when the file is
+                         created, an existing file keeps its own capacity.
+    :param Journal journal: Journal to write through, None to write directly.
+    """
+
+    def __init__(
+        self, path: str, capacity: int = DEFAULT_CAPACITY, journal: Optional[Journal] = None
+    ) -> None:
+        self._path = path
+        self._journal = journal
+        self._generation = 0
+        self._head = 0  # sequence number of the oldest queued reading
+        self._tail = 0  # sequence number the next reading will get
+        self._peeked = []
+        if _file_exists(path):
+            self._file = open(path, "r+b")
+            if not self._load_header():
+                # both header slots are unreadable, start over in place
+                self._format(capacity)
+        else:
+            self._file = open(path, "w+b")
+            self._format(capacity)
+        self._recover()
+
+    def __len__(self) -> int:
+        return self._tail - self._head
+
+    @property
+    def capacity(self) -> int:
+        """Number of records the ring holds. Merging keeps it from filling up,
+        the oldest record is only dropped if merging can't free a slot."""
+        return self._capacity
+
+    def append(self, timestamp: int, temperature: float, humidity: float) -> None:
+        """Adds a reading at the tail, merging the oldest ones first if the
+        ring is getting full.
+
+        :param int timestamp: Unix time of the reading.
+        :param float temperature: Temperature in degrees Fahrenheit.
+        :param float humidity: Relative humidity in percent.
+        """
+        if len(self) >= self._capacity * MERGE_AT:
+            self._merge_oldest()
+        temp = int(round(temperature * 100))
+        hum = int(round(humidity * 100))
+        self._write_record(self._tail, (int(timestamp), 0, 1, temp, temp, temp, hum, hum, hum))
+        self._tail += 1
+        if len(self) > self._capacity:
+            self._head = self._tail - self._capacity
+        self._write_header()
+
+    def peek(self, count: int, detail: bool = False) -> List[tuple]:
+        """Returns up to ``count`` of the oldest records without removing them.
+
+        Each is a (time, temperature, humidity) tuple with the means of a
+        merged record. With ``detail`` they are (time, temperature, humidity,
+        count, temperature min, temperature max, humidity min, humidity max,
+        seconds covered) instead.
+
+        Slots that fail their CRC are skipped. Pass the number of records
+        that were handled to `commit` to remove them.
+
+        :param int count: Maximum number of records to return.
+        :param bool detail: Also return the aggregate fields.
+        """
+        readings = []
+        self._peeked = []
+        for seq, record in self._read_records(self._head, min(count, len(self))):
+            time, seconds, merged, temp, temp_min, temp_max, hum, hum_min, hum_max = record
+            if detail:
+                readings.append((
+                    time, temp / 100, hum / 100, merged, temp_min / 100, temp_max / 100,
+                    hum_min / 100, hum_max / 100, seconds,
+                ))
+            else:
+                readings.append((time, temp / 100, hum / 100))
+            self._peeked.append(seq)
+        return readings
+
+    def commit(self, count: int) -> None:
+        """Removes the first ``count`` readings returned by the last `peek`.
+
+        :param int count: Number of readings that were handled.
+        """
+        if count <= 0:
+            return
+        if count <= len(self._peeked):
+            self._head = self._peeked[count - 1] + 1
+            self._peeked = self._peeked[count:]
+        else:
+            self._head = min(self._head + count, self._tail)
+            self._peeked = []
+        self._write_header()
+
+    def clear(self) -> None:
+        """Drops every queued reading."""
+        self._head = self._tail
+        self._peeked = []
+        self._write_header()
+
+    def close(self) -> None:
+        """Flushes and closes the ring file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    ### File helpers ###
+
+    def _record_offset(self, seq: int) -> int:
+        return _HEADER_SIZE + (seq % self._capacity) * RECORD_SIZE
+
+    def _read_records(self, seq: int, count: int) -> List[Tuple[int, tuple]]:
+        # (seq, record) for the good records among count slots from seq,
+        # reading contiguous runs in one go and splitting at the wrap
+        records = []
+        while count > 0:
+            slot = seq % self._capacity
+            run = min(count, self._capacity - slot)
+            data = self._read_at(self._record_offset(seq), run * RECORD_SIZE)
+            for i in range(run):
+                record = self._decode(data, i * RECORD_SIZE, seq + i)
+                if record is not None:
+                    records.append((seq + i, record))
+            seq += run
+            count -= run
+        return records
+
+    def _write_record(self, seq: int, record: tuple) -> None:
+        body = struct.pack(_RECORD_FORMAT, seq, *record)
+        self._write_at(self._record_offset(seq), body + struct.pack("<I", _crc(body)))
+
+    def _merge_oldest(self) -> None:
+        """Halves the oldest quarter of the ring by merging neighbours, writes
+        the result to the back of that window and moves the head past the
+        freed slots."""
+        window = min(max(self._capacity // 4, 2), len(self))
+        merged = [record for _, record in self._read_records(self._head, window)]
+        target = window // 2
+        while len(merged) > max(target, 1):
+            # the neighbours holding the fewest readings go first, so what was
+            # merged before is only merged again once the rest has caught up
+            best = 0
+            for i in range(1, len(merged) - 1):
+                if merged[i][2] + merged[i + 1][2] < merged[best][2] + merged[best + 1][2]:
+                    best = i
+            merged[best : best + 2] = [_merge(merged[best], merged[best + 1])]
+        start = self._head + window - len(merged)
+        for i, record in enumerate(merged):
+            self._write_record(start + i, record)
+        print("Queue nearly full, merged the {} oldest records into {}".format(window, len(merged)))
+        self._head = start
+        self._peeked = []
+
+    def _read_at(self, offset: int, length: int) -> bytes:
+        self._file.seek(offset)
+        data = self._file.read(length)
+        if self._journal is not None:
+            data = self._journal.overlay(self._path, offset, data, length)
+        return data
+
+    def _write_at(self, offset: int, data: bytes) -> None:
+        if self._journal is not None:
+            self._journal.write(self._path, offset, data)
+            return
+        self._file.seek(offset)
+        self._file.write(data)
+        self._file.flush()
+
+    @staticmethod
+    def _decode(data: bytes, offset: int, seq: int) -> Optional[tuple]:
+        end = offset + _RECORD_BODY_SIZE
+        if len(data) < end + 4:
+            return None
+        body = data[offset:end]
+        if struct.unpack_from("<I", data, end)[0] != _crc(body):
+            return None
+        fields = struct.unpack(_RECORD_FORMAT, body)
+        if fields[0] != seq or not fields[3]:
+            return None
+        return fields[1:]
+
+    def _format(self, capacity: int) -> None:
+        self._capacity = capacity
+        self._generation = 0
+        self._head = self._tail = 0
+        # preallocate the whole ring once so appends never grow the file,
+        # straight to flash so the journal doesn't have to hold it
+        self._file.seek(_HEADER_SIZE)
+        self._file.write(bytes(capacity * RECORD_SIZE))
+        self._file.flush()
+        self._write_header()
+        self._write_header()
+
+    def _load_header(self) -> bool:
+        data = self._read_at(0, _HEADER_SIZE)
+        best = None
+        for slot in range(2):
+            header = self._parse_header(data, slot * _HEADER_SLOT_SIZE)
+            if header is not None and (best is None or header[1] > best[1]):
+                best = header
+        if best is None:
+            return False
+        self._capacity, self._generation, self._head, self._tail = best
+        return True
+
+    @staticmethod
+    def _parse_header(data: bytes, offset: int) -> Optional[Tuple[int, int, int, int]]:
+        size = struct.calcsize(_HEADER_FORMAT)
+        if len(data) < offset + size + 4:
+            return None
+        body = data[offset : offset + size]
+        if struct.unpack_from("<I", data, offset + size)[0] != _crc(body):
+            return None
+        magic, version, record_size, capacity, generation, head, tail = struct.unpack(
+            _HEADER_FORMAT, body
+        )
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            return None
+        if record_size != RECORD_SIZE or not capacity or head > tail:
+            return None
+        return capacity, generation, head, tail
+
+    def _write_header(self) -> None:
+        self._generation += 1
+        body = struct.pack(
+            _HEADER_FORMAT,
+            STORE_MAGIC,
+            STORE_VERSION,
+            RECORD_SIZE,
+            self._capacity,
+            self._generation,
+            self._head,
+            self._tail,
+        )
+        header = body + struct.pack("<I", _crc(body))
+        header += bytes(_HEADER_SLOT_SIZE - len(header))
+        self._write_at((self._generation % 2) * _HEADER_SLOT_SIZE, header)
+
+    def _recover(self) -> None:
+        """Picks up readings that were written after the last header update."""
+        recovered = False
+        for _ in range(self._capacity):
+            data = self._read_at(self._record_offset(self._tail), RECORD_SIZE)
+            if self._decode(data, 0, self._tail) is None:
+                break
+            self._tail += 1
+            recovered = True
+        if len(self) > self._capacity:
+            self._head = self._tail - self._capacity
+        if recovered:
+            print("Recovered queued readings written before power loss")
+            self._write_header()
+
+
+def migrate_legacy_queue(store: ReadingStore, path: str = "/queue") -> int:
+    """Moves readings from the old one-file-per-reading queue into the store.
+
+    :param ReadingStore store: Store to append the readings to.
+    :param str path: Legacy queue directory.
+    """
+    try:
+        qfiles = sorted(os.listdir(path))
+    except OSError:
+        return 0
+    moved = 0
+    for qfile in qfiles:
+        qpath = "{}/{}".format(path, qfile)
+        if qfile.startswith("1") and qfile.endswith(".txt"):
+            try:
+                with open(qpath, "r") as f:
+                    qdata = f.read().splitlines()[0].split(",")
+                store.append(int(float(qdata[0])), float(qdata[1]), float(qdata[2]))
+                moved += 1
+            except (IndexError, ValueError):
+                print("Dropping unreadable queue file {}".format(qpath))
+        if store._journal is not None:  # pylint: disable=protected-access
+            # removed together with the appends, the now empty directory
+            # goes on the next cold boot
+            store._journal.remove(qpath)  # pylint: disable=protected-access
+        else:
+            os.remove(qpath)
+    if store._journal is None or not qfiles:  # pylint: disable=protected-access
+        os.rmdir(path)
+    return moved
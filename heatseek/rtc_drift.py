@@ -0,0 +1,111 @@
+"""
+`rtc_drift`
+================================================================================
+
+Learns how fast the RTC runs in deep sleep and corrects for it, so the time
+only has to be fetched over the network when the predicted error gets too
+large.
+
+The RTC is modelled as gaining ``rate`` seconds per true second. Each wake
+the RTC is set forward or back by the amount the model predicts it gained
+since it was last touched. Each real sync compares the uncorrected RTC with
+the true time and folds the measured rate into a running estimate. The
+estimate's spread grows the predicted error linearly with time since the
+last sync.
+
+All model state lives in the `SleepState` so it survives deep sleep.
+
+"""
+
+try:
+    from heatseek.sleep_state import SleepState
+except ImportError:
+    pass
+
+# Below this spread the 1 s resolution of a sync dominates anyway
+MIN_SPREAD = 0.0001
+# Syncs closer together than this are too noisy to learn a rate from
+MIN_LEARN_SECONDS = 600
+# Weight of a new measurement in the running rate estimate
+LEARN_WEIGHT = 0.3
+
+
+class RtcDrift:
+    """Drift estimator backed by a `SleepState`.
+
+    :param SleepState state: State to read and update.
+    :param float max_error: Predicted error in seconds that forces a resync.
+    :param int max_age: Seconds after which a resync is forced regardless.
+    """
+
+    def __init__(self, state: SleepState, max_error: float = 30, max_age: int = 86400) -> None:
+        self._state = state
+        self._max_error = max_error
+        self._max_age = max_age
+
+    def correct(self, rtc_now: int) -> int:
+        """Returns the corrected time for an RTC reading and records it as the
+        new anchor. The caller sets the RTC to the returned value.
+
+        :param int rtc_now: Current RTC time.
+        """
+        state = self._state
+        if not state.last_sync or not state.drift_samples or not state.anchor:
+            return rtc_now
+        estimate = state.anchor + state.anchor_frac
+        estimate += (rtc_now - state.anchor) / (1 + state.drift_rate)
+        corrected = int(round(estimate))
+        state.corrected += corrected - rtc_now
+        state.anchor = corrected
+        state.anchor_frac = estimate - corrected
+        return corrected
+
+    def predicted_error(self, now: int) -> float:
+        """Seconds the clock is expected to be off by, at most.
+
+        :param int now: Current (corrected) time.
+        """
+        state = self._state
+        if not state.last_sync or not state.drift_samples:
+            return float("inf")
+        return abs(now - state.last_sync) * max(state.drift_spread, MIN_SPREAD)
+
+    def needs_sync(self, now: int) -> bool:
+        """True when the time should be fetched from the network this wake.
+
+        :param int now: Current (corrected) time.
+        """
+        if not self._state.last_sync or now - self._state.last_sync >= self._max_age:
+            return True
+        return self.predicted_error(now) > self._max_error
+
+    def synced(self, rtc_now: int, true_now: int) -> None:
+        """Learns from a sync. Call with the RTC value read just before it was
+        set to ``true_now``.
+
+        :param int rtc_now: RTC time before the sync.
+        :param int true_now: Time from the network.
+        """
+        state = self._state
+        elapsed = true_now - state.last_sync
+        if state.last_sync and state.anchor and elapsed >= MIN_LEARN_SECONDS:
+            # what the RTC would read now without this model's corrections
+            raw_gain = (rtc_now - state.corrected) - true_now
+            measured = raw_gain / elapsed
+            if state.drift_samples:
+                miss = abs(measured - state.drift_rate)
+                state.drift_spread += LEARN_WEIGHT * (miss - state.drift_spread)
+                state.drift_rate += LEARN_WEIGHT * (measured - state.drift_rate)
+            else:
+                state.drift_rate = measured
+                state.drift_spread = max(abs(measured) / 2, MIN_SPREAD)
+            state.drift_samples = min(state.drift_samples + 1, 0xFFFF)
+            print(
+                "RTC drift: measured {:.5f}, estimate {:.5f} +/- {:.5f}".format(
+                    measured, state.drift_rate, state.drift_spread
+                )
+            )
+        state.last_sync = true_now
+        state.anchor = true_now
+        state.anchor_frac = 0.0
+        state.corrected = 0.0
@@ -0,0 +1,100 @@
+"""
+`sensor_reading`
+================================================================================
+
+Takes one reading per wake from the AHTx0 and hands the same values to every
+consumer.
+
+Every access to ``AHTx0.temperature`` or ``AHTx0.relative_humidity`` starts a
+new measurement of about 80ms on the I2C bus. `acquire` takes a short burst
+of measurements instead, one per sample, drops the outliers and averages the
+rest. The result is an immutable `Reading` that also records how far the
+samples disagreed and how long the burst took.
+
+"""
+import time
+from collections import namedtuple
+
+try:
+    from typing import List
+except ImportError:
+    pass
+
+try:
+    from adafruit_ahtx0 import __version__ as AHTX0_VERSION
+except ImportError:
+    AHTX0_VERSION = None
+
+# adafruit_ahtx0 releases checked to keep the temperature from the last
+# measurement in the private ``AHTx0._temp``. lib/ ships 1.0.8, any other
+# version reads the public ``temperature`` and takes a second measurement
+AHTX0_SHARED_MEASUREMENT = ("1.0.8",)
+
+Reading = namedtuple(
+    "Reading",
+    (
+        "time",  # unix time the burst started
+        "temp_f",  # filtered temperature, degrees F
+        "humidity",  # filtered relative humidity, %
+        "temp_spread",  # max - min over the samples, degrees F
+        "humidity_spread",  # max - min over the samples, %
+        "samples",  # measurements that made it into the reading
+        "acquire_ms",  # how long the burst took
+    ),
+)
+
+
+def trimmed_mean(values: List[float]) -> float:
+    """Mean of ``values`` without the lowest and highest quarter. Three
+    values give their median.
+
+    :param list values: Samples, at least one.
+    """
+    values = sorted(values)
+    trim = (len(values) + 1) // 4
+    kept = values[trim : len(values) - trim]
+    return sum(kept) / len(kept)
+
+
+def _measure(sensor) -> tuple:
+    humidity = sensor.relative_humidity
+    if AHTX0_VERSION in AHTX0_SHARED_MEASUREMENT:
+        # the humidity read filled in both values from one measurement,
+        # don't start a second one for the temperature
+        temp_c = sensor._temp  # pylint: disable=protected-access
+    else:
+        temp_c = sensor.temperature
+    return (temp_c * 1.8) + 32, humidity
+
+
+def acquire(sensor, samples: int = 3) -> Reading:
+    """Returns one filtered `Reading` from a burst of ``samples`` measurements.
+    Samples that fail are left out, the error is raised if they all fail.
+
+    :param sensor: ``adafruit_ahtx0.AHTx0``.
+    :param int samples: Measurements to take.
+    """
+    start_time = time.time()
+    start = time.monotonic_ns()
+    temps = []
+    humidities = []
+    error = None
+    for _ in range(max(samples, 1)):
+        try:
+            temp_f, humidity = _measure(sensor)
+        except (OSError, RuntimeError) as e:
+            error = e
+            continue
+        temps.append(temp_f)
+        humidities.append(humidity)
+    if not temps:
+        raise error
+    return Reading(
+        start_time,
+        trimmed_mean(temps),
+        trimmed_mean(humidities),
+        max(temps) - min(temps),
+        max(humidities) - min(humidities),
+        len(temps),
+        (time.monotonic_ns() - start) // 1000000,
+    )
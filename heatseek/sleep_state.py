@@ -0,0 +1,106 @@
+"""
+`sleep_state`
+================================================================================
+
+Cross-wake state kept in ``alarm.sleep_memory`` instead of small flash files.
+
+The block is a struct with a magic, a version and a CRC. A block that does
+not check out, which is what a cold boot or power loss leaves behind, is
+ignored and the caller rebuilds the state from flash. To change the layout,
+append fields to `_FIELDS` and bump `STATE_VERSION`.
+
+"""
+import struct
+from binascii import crc32
+
+try:
+    from typing import Optional
+except ImportError:
+    pass
+
+STATE_MAGIC = b"HS"
+STATE_VERSION = 9
+
+# Queue length when it is not known yet and the store has to be opened
+QUEUE_UNKNOWN = 0xFFFFFFFF
+
+# Network that last worked
+NETWORK_NONE = 0
+NETWORK_TENANT = 1
+NETWORK_HEATSEEK = 2
+NETWORK_CELLULAR = 3
+
+# (attribute, struct code, default)
+_FIELDS = (
+    ("quiet", "B", 0),  # quiet.txt was present
+    ("low_water", "f", 0.0),  # quiet mode battery low water mark, 0 when unset
+    ("queued", "I", QUEUE_UNKNOWN),  # readings in the reading store
+    ("network", "B", NETWORK_NONE),  # network that last worked
+    ("last_sync", "I", 0),  # unix time of the last good time sync
+    ("imei", "15s", b""),  # modem identity, empty when unknown
+    ("drift_rate", "f", 0.0),  # RTC seconds gained per true second
+    ("drift_spread", "f", 0.0),  # uncertainty of drift_rate
+    ("drift_samples", "H", 0),  # syncs the drift rate was learned from
+    ("anchor", "I", 0),  # RTC value when it was last set or corrected
+    ("anchor_frac", "f", 0.0),  # true time minus anchor at that moment
+    ("corrected", "f", 0.0),  # seconds of correction applied since last_sync
+    ("sync_source", "B", 0),  # time_sync source of the last good sync
+    ("sync_ms", "H", 0),  # how long the last sync took
+    ("wifi_bssid", "6s", b""),  # access point of the last good WiFi network
+    ("wifi_channel", "B", 0),  # its channel, 0 when unknown
+    ("wifi_source", "B", 0),  # wifi_manager source of the last connection
+    ("wifi_connect_ms", "H", 0),  # how long the last connection took
+    ("last_upload", "I", 0),  # unix time the queue was last emptied over WiFi
+    ("modem_type", "B", 0),  # FONA version of the modem, 0 when unknown
+    ("modem_settings", "I", 0),  # bit mask of the FONA MODEM_SETTINGS in effect
+    ("modem_ready_ms", "H", 0),  # how long the last modem bring-up took
+    ("errors_reported", "I", 0),  # errors logged when the relay last got the error counts
+    ("batch_rejected", "I", 0),  # unix time the relay last rejected a batch, 0 if it takes them
+)
+_FORMAT = "<2sB" + "".join(code for _, code, _ in _FIELDS)
+_SIZE = struct.calcsize(_FORMAT)
+
+
+class SleepState:
+    """Values that survive deep sleep.
+
+    Attributes are the names in `_FIELDS`.
+    """
+
+    def __init__(self) -> None:
+        for name, _, default in _FIELDS:
+            setattr(self, name, default)
+
+    @classmethod
+    def load(cls, memory) -> Optional["SleepState"]:
+        """Returns the state saved in ``memory``, or None if there is none.
+
+        :param memory: ``alarm.sleep_memory`` or another byte buffer.
+        """
+        if len(memory) < _SIZE + 4:
+            return None
+        data = bytes(memory[0 : _SIZE + 4])
+        if struct.unpack_from("<I", data, _SIZE)[0] != crc32(data[:_SIZE]) & 0xFFFFFFFF:
+            return None
+        values = struct.unpack(_FORMAT, data[:_SIZE])
+        if values[0] != STATE_MAGIC or values[1] != STATE_VERSION:
+            return None
+        state = cls()
+        for (name, _, _), value in zip(_FIELDS, values[2:]):
+            if isinstance(value, bytes):
+                value = value.rstrip(b"\x00")
+            setattr(state, name, value)
+        return state
+
+    def save(self, memory) -> None:
+        """Writes the state to ``memory``.
+
+        :param memory: ``alarm.sleep_memory`` or another byte buffer.
+        """
+        data = struct.pack(
+            _FORMAT,
+            STATE_MAGIC,
+            STATE_VERSION,
+            *[getattr(self, name) for name, _, _ in _FIELDS]
+        )
+        memory[0 : _SIZE + 4] = data + struct.pack("<I", crc32(data) & 0xFFFFFFFF)
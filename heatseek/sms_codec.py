@@ -0,0 +1,173 @@
+"""
+`sms_codec`
+================================================================================
+
+Compact text encoding that packs as many readings as fit into one SMS.
+
+A message looks like ``#1 <cell_id> <interval> <payload>``. ``1`` is the codec
+version. The payload is a run of variable-length integers written in a
+base-64 alphabet that is entirely in the GSM 7-bit default character set.
+Each character carries 5 data bits, and a value of 32 or more means another
+character follows. Signed values are zigzag encoded.
+
+The first reading is stored as the seconds since `EPOCH` and as absolute
+temperature and humidity in tenths. Each later reading is stored as deltas:
+its time offset from the expected ``interval``, then its temperature and
+humidity changes. A steady hourly series therefore costs about three
+characters per reading.
+
+`decode` is plain Python so the relay can use this module as is.
+
+"""
+
+try:
+    from typing import List, Tuple
+except ImportError:
+    pass
+
+CODEC_VERSION = 1
+SMS_LENGTH = 160
+# Reading times are sent as offsets from this timestamp (Nov 8 2022)
+EPOCH = 1667875724
+
+ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+_VALUES = {char: value for value, char in enumerate(ALPHABET)}
+_PREFIX = "#{}".format(CODEC_VERSION)
+
+
+class CodecError(ValueError):
+    """Raised when a message can not be decoded."""
+
+
+def _zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def _varint(value: int) -> str:
+    if value < 0:
+        raise ValueError("varint must not be negative")
+    chars = []
+    while True:
+        group = value & 0x1F
+        value >>= 5
+        if value:
+            chars.append(ALPHABET[group | 0x20])
+        else:
+            chars.append(ALPHABET[group])
+            return "".join(chars)
+
+
+def _tenths(value: float) -> int:
+    return int(round(value * 10))
+
+
+def encode(
+    cell_id: str,
+    interval: int,
+    readings: List[Tuple[int, float, float]],
+    limit: int = SMS_LENGTH,
+) -> Tuple[str, int]:
+    """Packs readings into one message, oldest first, until ``limit`` is reached.
+
+    Returns the message and the number of readings it carries.
+
+    :param str cell_id: Sensor cell id, must not contain spaces.
+    :param int interval: Nominal seconds between readings.
+    :param list readings: (time, temperature F, humidity %) tuples, oldest first.
+    :param int limit: Maximum message length in characters.
+    """
+    interval = int(interval)
+    parts = ["{} {} {} ".format(_PREFIX, cell_id, interval)]
+    length = len(parts[0])
+    count = 0
+    last = None
+    for qtime, qtemp, qhumidity in readings:
+        qtime = int(qtime)
+        temp = _tenths(qtemp)
+        humidity = _tenths(qhumidity)
+        if last is None:
+            chunk = (
+                _varint(max(0, qtime - EPOCH))
+                + _varint(_zigzag(temp))
+                + _varint(max(0, humidity))
+            )
+        else:
+            chunk = (
+                _varint(_zigzag(qtime - last[0] - interval))
+                + _varint(_zigzag(temp - last[1]))
+                + _varint(_zigzag(humidity - last[2]))
+            )
+        if length + len(chunk) > limit:
+            break
+        parts.append(chunk)
+        length += len(chunk)
+        count += 1
+        last = (max(qtime, EPOCH), temp, humidity)
+    return "".join(parts), count
+
+
+def capacity(cell_id: str, interval: int, start: int, limit: int = SMS_LENGTH) -> int:
+    """Returns the most readings starting at ``start`` that can fit in one
+    message, those of a series that never changes. Any other readings cost
+    at least as much, so a queue this long always fills a message.
+
+    :param str cell_id: Sensor cell id, must not contain spaces.
+    :param int interval: Nominal seconds between readings.
+    :param int start: Time of the first reading.
+    :param int limit: Maximum message length in characters.
+    """
+    interval = int(interval)
+    steady = [(start + i * interval, 0.0, 0.0) for i in range(limit)]
+    return encode(cell_id, interval, steady, limit)[1]
+
+
+def decode(message: str) -> Tuple[str, int, List[Tuple[int, float, float]]]:
+    """Unpacks a message made by `encode`.
+
+    Returns (cell_id, interval, readings) with readings as
+    (unix time, temperature F, humidity %) tuples.
+
+    :param str message: Message text as received.
+    """
+    fields = message.strip().split(" ")
+    if len(fields) != 4 or fields[0] != _PREFIX:
+        raise CodecError("not a version {} reading message".format(CODEC_VERSION))
+    cell_id = fields[1]
+    try:
+        interval = int(fields[2])
+    except ValueError as e:
+        raise CodecError("bad interval") from e
+
+    values = []
+    value = shift = 0
+    for char in fields[3]:
+        try:
+            digit = _VALUES[char]
+        except KeyError as e:
+            raise CodecError("bad payload character {!r}".format(char)) from e
+        value |= (digit & 0x1F) << shift
+        if digit & 0x20:
+            shift += 5
+        else:
+            values.append(value)
+            value = shift = 0
+    if shift or len(values) % 3:
+        raise CodecError("truncated payload")
+
+    readings = []
+    qtime = temp = humidity = 0
+    for i in range(0, len(values), 3):
+        if i == 0:
+            qtime = EPOCH + values[0]
+            temp = _unzigzag(values[1])
+            humidity = values[2]
+        else:
+            qtime += interval + _unzigzag(values[i])
+            temp += _unzigzag(values[i + 1])
+            humidity += _unzigzag(values[i + 2])
+        readings.append((qtime, temp / 10, humidity / 10))
+    return cell_id, interval, readings
@@ -0,0 +1,115 @@
+"""
+`sms_drain`
+================================================================================
+
+Iterative SMS drain: sends queued readings message after message in one
+modem session instead of recursing once per message.
+
+"""
+import time
+
+try:
+    from typing import Callable, List, Tuple
+    from adafruit_fona.adafruit_fona import FONA
+    from heatseek.drain_budget import DrainBudget
+    from heatseek.reading_store import ReadingStore
+except ImportError:
+    pass
+
+
+class SmsDrain:
+    """One SMS drain session.
+
+    :param FONA fona: Modem to send through.
+    :param int number: Relay phone number.
+    :param ReadingStore store: Queued readings.
+    :param pack: Callable turning a list of readings into (message, readings used).
+    :param DrainBudget budget: Time and reading allowance for the session.
+    :param int peek_length: Most readings offered to ``pack`` per message.
+    :param int min_readings: Fewest queued readings worth a message, fewer are
+        kept for the next session.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        fona: FONA,
+        number: int,
+        store: ReadingStore,
+        pack: Callable[[List[Tuple[int, float, float]]], Tuple[str, int]],
+        budget: DrainBudget,
+        peek_length: int,
+        min_readings: int = 1,
+    ) -> None:
+        self._fona = fona
+        self._number = number
+        self._store = store
+        self._pack = pack
+        self._budget = budget
+        self._peek_length = peek_length
+        self._min_readings = max(1, min_readings)
+        self.messages = 0
+        self.readings = 0
+        self.elapsed = 0.0
+        # set when the modem or a send failed, not when the budget ran out
+        self.failed = False
+
+    def run(self) -> bool:
+        """Sends until fewer than ``min_readings`` are queued, a send fails or
+        the budget runs out.
+
+        Readings are removed from the store only after the modem confirms the
+        message with ``+CMGS``. Returns True unless a send failed or the
+        budget ran out, `failed` tells the two apart.
+        """
+        start = time.monotonic()
+        try:
+            # text mode is selected once for the whole session
+            if not self._fona.sms_text_mode():
+                print("Could not put the modem in SMS text mode")
+                self.failed = True
+                return False
+            while len(self._store) >= self._min_readings:
+                count = self._budget.allowance(self._peek_length)
+                if count == 0:
+                    print("Drain budget used up, resuming on the next wake")
+                    return False
+                queued = self._store.peek(count)
+                if not queued:
+                    # only unreadable slots left, drop them
+                    self._store.commit(len(self._store))
+                    break
+                message, sent = self._pack(queued)
+                if sent == 0:
+                    print("No reading fits in one SMS")
+                    self.failed = True
+                    return False
+                print("Sending {} readings in {} characters".format(sent, len(message)))
+                if not self._fona.send_sms(self._number, message):
+                    print("Sending queued heatseek data failed")
+                    self.failed = True
+                    return False
+                self._store.commit(sent)
+                self._budget.spend(sent)
+                self.messages += 1
+                self.readings += sent
+            if len(self._store) > 0:
+                print("Keeping {} readings for the next message".format(len(self._store)))
+            return True
+        finally:
+            self.elapsed = time.monotonic() - start
+            self.report()
+
+    def report(self) -> None:
+        """Prints the session's throughput."""
+        if self.elapsed <= 0:
+            return
+        print(
+            "SMS drain: {} messages, {} readings in {:.1f}s ({:.2f} msg/s, {:.2f} readings/s)".format(
+                self.messages,
+                self.readings,
+                self.elapsed,
+                self.messages / self.elapsed,
+                self.readings / self.elapsed,
+            )
+        )
@@ -0,0 +1,152 @@
+"""
+`status_led`
+================================================================================
+
+Status LED patterns that play without blocking the wake.
+
+`StatusLed.play` queues a pattern and returns at once. Each call to
+`StatusLed.update` works out from ``time.monotonic`` which frame should be
+showing and writes it only when it changed, so the main block can call it
+between steps and never sleeps for the LED. `StatusLed.cancel` blanks the
+LED and drops everything queued, so going to sleep never waits for an
+animation. The exception is `StatusLed.finish`, which plays one cycle of a
+pattern that must be seen, such as an error warning, before the sleep.
+
+Fades scale each channel through `GAMMA`, a table worked out ahead of time,
+instead of calling ``pow`` for every channel on every step.
+
+"""
+import time
+
+try:
+    from typing import Tuple
+except ImportError:
+    pass
+
+# round(255 * (level / 100) ** 2.2) for level 0..100
+GAMMA = bytes((
+    0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2,
+    2, 3, 3, 4, 5, 5, 6, 7, 7, 8, 9, 10,
+    11, 12, 13, 14, 15, 17, 18, 19, 21, 22, 24, 25,
+    27, 29, 30, 32, 34, 36, 38, 40, 42, 44, 46, 48,
+    51, 53, 55, 58, 60, 63, 66, 68, 71, 74, 77, 80,
+    83, 86, 89, 92, 96, 99, 102, 106, 109, 113, 116, 120,
+    124, 128, 131, 135, 139, 143, 148, 152, 156, 160, 165, 169,
+    174, 178, 183, 188, 192, 197, 202, 207, 212, 217, 223, 228,
+    233, 238, 244, 249, 255,
+))
+
+FLASH = 0
+WARNING = 1
+FADE_DOWN = 2
+FADE_UP = 3
+
+# Patterns waiting to play, later ones are dropped
+MAX_QUEUED = 4
+
+
+def scale(color: Tuple[int, int, int], level: int) -> Tuple[int, int, int]:
+    """Returns ``color`` at ``level`` percent perceived brightness.
+
+    :param tuple color: (red, green, blue).
+    :param int level: 0 to 100.
+    """
+    g = GAMMA[level]
+    return ((color[0] * g + 127) // 255, (color[1] * g + 127) // 255, (color[2] * g + 127) // 255)
+
+
+class StatusLed:
+    """Pattern player for a one-pixel ``neopixel.NeoPixel``.
+
+    :param pixels: The status pixel.
+    """
+
+    def __init__(self, pixels) -> None:
+        self._pixels = pixels
+        self._queue = []
+        self._start = None
+        self._shown = None
+
+    @property
+    def busy(self) -> bool:
+        """True while a pattern is playing or queued."""
+        return bool(self._queue)
+
+    # pylint: disable=too-many-arguments
+    def play(self, kind: int, color, color2=(0, 0, 0), length: float = 0.5, repeat: int = 1) -> None:
+        """Queues a pattern.
+
+        :param int kind: `FLASH`, `WARNING`, `FADE_DOWN` or `FADE_UP`.
+        :param tuple color: Main (red, green, blue).
+        :param tuple color2: Second colour of a `WARNING`, off for a `FLASH`.
+        :param float length: Seconds per flash half or per fade.
+        :param int repeat: Times to play it.
+        """
+        if len(self._queue) >= MAX_QUEUED:
+            return
+        self._queue.append((kind, color, color2, length, repeat))
+        self.update()
+
+    def cancel(self) -> None:
+        """Stops at once and turns the LED off."""
+        self._queue = []
+        self._start = None
+        self._show((0, 0, 0))
+
+    def update(self) -> None:
+        """Shows the frame that is due now."""
+        now = time.monotonic()
+        while self._queue:
+            if self._start is None:
+                self._start = now
+            frame = self._frame(self._queue[0], now - self._start)
+            if frame is not None:
+                self._show(frame)
+                return
+            # this pattern is over, the next one starts now
+            self._queue.pop(0)
+            self._start = None
+        self._show((0, 0, 0))
+
+    def finish(self, kind: int, limit: float) -> None:
+        """Plays one cycle of the first queued pattern of ``kind`` and waits
+        for it, for at most ``limit`` seconds. Returns at once if none is
+        queued.
+
+        :param int kind: `FLASH`, `WARNING`, `FADE_DOWN` or `FADE_UP`.
+        :param float limit: Longest to wait, in seconds.
+        """
+        for pattern in self._queue:
+            if pattern[0] == kind:
+                break
+        else:
+            return
+        self._queue = [pattern[:4] + (1,)]
+        self._start = None
+        deadline = time.monotonic() + limit
+        while self._queue and time.monotonic() < deadline:
+            self.update()
+            time.sleep(0.02)
+
+    @staticmethod
+    def _frame(pattern, elapsed: float):
+        kind, color, color2, length, repeat = pattern
+        if length <= 0:
+            return None
+        if kind in (FLASH, WARNING):
+            step = int(elapsed / length)
+            if step >= 2 * repeat:
+                return None
+            if step % 2 == 0:
+                return color
+            return color2
+        step = int(elapsed * 100 / length)
+        if step >= 100 * repeat:
+            return None
+        level = step % 100
+        return scale(color, level if kind == FADE_UP else 100 - level)
+
+    def _show(self, color) -> None:
+        if color != self._shown:
+            self._pixels.fill(color)
+            self._shown = color
@@ -0,0 +1,168 @@
+"""
+`time_sync`
+================================================================================
+
+Gets the current Unix time from the cheapest source that answers in time:
+
+1. a single-packet SNTP query over the ``socketpool.SocketPool`` (the bundled
+   ``adafruit_ntp`` 2.2.5 only talks to ESP32SPI co-processors, so the query
+   is done here),
+2. an HTTP GET to worldtimeapi.org that stops reading as soon as the
+   ``"unixtime":`` value has streamed past,
+3. the cellular modem's network clock.
+
+Every step runs under its own deadline, which covers the whole step and not
+each socket call: every call only gets the time that is left. A DNS lookup
+can't be given a timeout, so the deadline is checked before it, and the
+wake supervisor's watchdog resets the board if one hangs. `TimeSync` records which
+source won and how long the whole sync took.
+
+"""
+import struct
+import time
+
+try:
+    from typing import Optional, Tuple
+    from adafruit_fona.adafruit_fona import FONA
+except ImportError:
+    pass
+
+SOURCE_NONE = 0
+SOURCE_NTP = 1
+SOURCE_HTTP = 2
+SOURCE_CELL = 3
+SOURCE_NAMES = ("none", "ntp", "http", "cell")
+
+NTP_SERVER = "pool.ntp.org"
+NTP_PORT = 123
+# seconds between the NTP epoch (1900) and the Unix epoch (1970)
+NTP_TO_UNIX = 2208988800
+
+HTTP_TIME_HOST = "worldtimeapi.org"
+HTTP_TIME_PATH = "/api/timezone/Etc/UTC"
+_UNIXTIME_KEY = b'"unixtime":'
+
+
+def _time_left(deadline: float) -> float:
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise OSError("deadline passed")
+    return left
+
+
+def ntp_time(pool, timeout: float, server: str = NTP_SERVER) -> int:
+    """Returns the Unix time from one SNTP request.
+
+    :param pool: ``socketpool.SocketPool``.
+    :param float timeout: Seconds the whole query may take.
+    :param str server: NTP server host name.
+    """
+    deadline = time.monotonic() + timeout
+    _time_left(deadline)
+    addr = pool.getaddrinfo(server, NTP_PORT)[0][-1]
+    packet = bytearray(48)
+    packet[0] = 0x1B  # LI 0, version 3, client mode
+    with pool.socket(pool.AF_INET, pool.SOCK_DGRAM) as sock:
+        sock.settimeout(_time_left(deadline))
+        sock.sendto(packet, addr)
+        size, _ = sock.recvfrom_into(packet)
+    if size < 48:
+        raise ValueError("short NTP reply")
+    seconds = struct.unpack_from("!I", packet, 40)[0]
+    if not seconds:
+        raise ValueError("NTP server sent no time")
+    return seconds - NTP_TO_UNIX
+
+
+def http_time(pool, timeout: float, host: str = HTTP_TIME_HOST, path: str = HTTP_TIME_PATH) -> int:
+    """Returns the Unix time from a worldtimeapi-style JSON reply, reading only
+    up to the ``"unixtime":`` value.
+
+    :param pool: ``socketpool.SocketPool``.
+    :param float timeout: Seconds the whole request may take.
+    :param str host: Host name.
+    :param str path: Request path.
+    """
+    deadline = time.monotonic() + timeout
+    _time_left(deadline)
+    addr = pool.getaddrinfo(host, 80)[0][-1]
+    chunk = bytearray(128)
+    with pool.socket(pool.AF_INET, pool.SOCK_STREAM) as sock:
+        sock.settimeout(_time_left(deadline))
+        sock.connect(addr)
+        sock.settimeout(_time_left(deadline))
+        sock.send(
+            b"GET " + path.encode() + b" HTTP/1.0\r\nHost: " + host.encode() + b"\r\n\r\n"
+        )
+        window = b""
+        while True:
+            # a server that trickles the reply only gets the time that is left
+            sock.settimeout(_time_left(deadline))
+            count = sock.recv_into(chunk, len(chunk))
+            if not count:
+                break
+            # keep enough of the previous chunk to match a key split across reads
+            window = window[-(len(_UNIXTIME_KEY) + 12) :] + bytes(chunk[:count])
+            start = window.find(_UNIXTIME_KEY)
+            if start == -1:
+                continue
+            digits = window[start + len(_UNIXTIME_KEY) :].strip()
+            end = 0
+            while end < len(digits) and 48 <= digits[end] <= 57:
+                end += 1
+            if end and end < len(digits):
+                return int(digits[:end])
+    raise ValueError("no unixtime in the time reply")
+
+
+def cell_time(fona: FONA) -> int:
+    """Returns the Unix time from the cellular network clock.
+
+    :param FONA fona: Attached modem.
+    """
+    return fona.get_timestamp()
+
+
+class TimeSync:
+    """Tries each available time source in turn.
+
+    :param float ntp_timeout: Deadline for the NTP query, in seconds.
+    :param float http_timeout: Deadline for the HTTP fallback, in seconds.
+        The WiFi sources share one deadline of both timeouts added up, so the
+        fallback only gets what the NTP query left.
+    """
+
+    def __init__(self, ntp_timeout: float = 2, http_timeout: float = 5) -> None:
+        self._ntp_timeout = ntp_timeout
+        self._http_timeout = http_timeout
+        self.source = SOURCE_NONE
+        self.duration_ms = 0
+
+    def sync(self, pool=None, fona: Optional[FONA] = None) -> Optional[int]:
+        """Returns the Unix time, or None if every source failed.
+
+        :param pool: ``socketpool.SocketPool`` when on WiFi.
+        :param FONA fona: Modem when on cellular.
+        """
+        start = time.monotonic_ns()
+        deadline = time.monotonic() + self._ntp_timeout + self._http_timeout
+        steps = []
+        if pool is not None:
+            steps.append((SOURCE_NTP, lambda left: ntp_time(pool, min(self._ntp_timeout, left))))
+            steps.append((SOURCE_HTTP, lambda left: http_time(pool, min(self._http_timeout, left))))
+        if fona is not None:
+            # the modem enforces its own reply timeouts
+            steps.append((SOURCE_CELL, lambda left: cell_time(fona)))
+        self.source = SOURCE_NONE
+        unixtime = None
+        for source, step in steps:
+            try:
+                unixtime = step(deadline - time.monotonic())
+            except (OSError, ValueError, IndexError) as e:
+                print("Time from {} failed: {}".format(SOURCE_NAMES[source], e))
+                continue
+            self.source = source
+            break
+        self.duration_ms = (time.monotonic_ns() - start) // 1000000
+        print("Time sync: source {} in {}ms".format(SOURCE_NAMES[self.source], self.duration_ms))
+        return unixtime
@@ -0,0 +1,224 @@
+"""
+`upload_client`
+================================================================================
+
+Minimal HTTP/1.1 client that keeps one connection to the relay open for the
+whole wake.
+
+Only the status line and the framing headers of a response are parsed.
+Bodies are thrown away through a small scratch buffer unless the caller asks
+for them, so a drain of queued readings costs one TCP handshake instead of
+one per reading.
+
+"""
+import json
+
+try:
+    from typing import Optional, Tuple
+except ImportError:
+    pass
+
+_SCRATCH_SIZE = 256
+_MAX_HEADER_LINE = 512
+
+
+class UploadError(Exception):
+    """Raised when a request could not be completed on a fresh connection."""
+
+
+class UploadClient:
+    """Persistent HTTP connection to a single host.
+
+    :param pool: ``socketpool.SocketPool`` for the connected interface.
+    :param str host: Host name to connect to.
+    :param int port: TCP port.
+    :param int timeout: Socket timeout, in seconds.
+    """
+
+    def __init__(self, pool, host: str, port: int = 80, timeout: int = 10) -> None:
+        self._pool = pool
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._addr = None
+        self._sock = None
+        self._scratch = bytearray(_SCRATCH_SIZE)
+        self._pending = b""
+        self.requests_sent = 0
+        self.connects = 0
+
+    def post_form(self, path: str, fields: dict) -> int:
+        """Posts ``fields`` form encoded and returns the HTTP status.
+
+        :param str path: Request path.
+        :param dict fields: Form fields.
+        """
+        body = "&".join("{}={}".format(k, v) for k, v in fields.items())
+        status, _ = self._request(
+            path, body.encode(), b"application/x-www-form-urlencoded", False
+        )
+        return status
+
+    def post_json(self, path: str, document: dict) -> Tuple[int, Optional[dict]]:
+        """Posts ``document`` as JSON and returns (status, decoded JSON reply).
+
+        The reply is ``None`` when it is empty or not JSON.
+
+        :param str path: Request path.
+        :param dict document: Object to send.
+        """
+        status, body = self._request(
+            path, json.dumps(document).encode(), b"application/json", True
+        )
+        try:
+            return status, json.loads(body)
+        except ValueError:
+            return status, None
+
+    def close(self) -> None:
+        """Closes the connection, if open."""
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+        self._pending = b""
+
+    ### Connection helpers ###
+
+    def _connect(self) -> None:
+        if self._addr is None:
+            self._addr = self._pool.getaddrinfo(self._host, self._port)[0][-1]
+        self._sock = self._pool.socket(self._pool.AF_INET, self._pool.SOCK_STREAM)
+        self._sock.settimeout(self._timeout)
+        self._sock.connect(self._addr)
+        self._pending = b""
+        self.connects += 1
+
+    def _request(
+        self, path: str, body: bytes, content_type: bytes, want_body: bool
+    ) -> Tuple[int, bytes]:
+        # A kept-alive connection may have been dropped by the server while
+        # idle, so one failure before any reply byte arrives gets a fresh one.
+        for attempt in range(2):
+            fresh = self._sock is None
+            if fresh:
+                try:
+                    self._connect()
+                except OSError as e:
+                    self.close()
+                    raise UploadError("connect failed: {}".format(e))
+            try:
+                self._send_all(
+                    b"POST "
+                    + path.encode()
+                    + b" HTTP/1.1\r\nHost: "
+                    + self._host.encode()
+                    + b"\r\nConnection: keep-alive\r\nContent-Type: "
+                    + content_type
+                    + b"\r\nContent-Length: "
+                    + str(len(body)).encode()
+                    + b"\r\n\r\n"
+                )
+                self._send_all(body)
+                status_line = self._read_line()
+            except OSError as e:
+                self.close()
+                if fresh or attempt:
+                    raise UploadError("request failed: {}".format(e))
+                continue
+            except ValueError as e:
+                # a garbled status line isn't a dropped connection, don't retry
+                self.close()
+                raise UploadError("bad response: {}".format(e))
+            self.requests_sent += 1
+            try:
+                return self._read_response(status_line, want_body)
+            except (OSError, ValueError) as e:
+                self.close()
+                raise UploadError("bad response: {}".format(e))
+        raise UploadError("request failed")
+
+    def _send_all(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            sent = self._sock.send(view)
+            if not sent:
+                raise OSError("connection closed")
+            view = view[sent:]
+
+    def _read_response(self, status_line: bytes, want_body: bool) -> Tuple[int, bytes]:
+        # "HTTP/1.1 200 OK"
+        fields = status_line.split(b" ", 2)
+        if len(fields) < 2:
+            raise ValueError("bad status line {!r}".format(status_line[:32]))
+        status = int(fields[1])
+        length = 0
+        chunked = False
+        keep_alive = not status_line.startswith(b"HTTP/1.0")
+        while True:
+            line = self._read_line()
+            if not line:
+                break
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            value = value.strip().lower()
+            if name == b"content-length":
+                length = int(value)
+            elif name == b"transfer-encoding":
+                chunked = value == b"chunked"
+            elif name == b"connection":
+                keep_alive = value != b"close"
+
+        body = b""
+        if chunked:
+            while True:
+                size = int(self._read_line().split(b";")[0], 16)
+                if size == 0:
+                    # trailers end with an empty line
+                    while self._read_line():
+                        pass
+                    break
+                body += self._read_body(size, want_body)
+                self._read_line()
+        elif length:
+            body = self._read_body(length, want_body)
+
+        if not keep_alive:
+            self.close()
+        return status, body
+
+    def _recv(self) -> int:
+        count = self._sock.recv_into(self._scratch, _SCRATCH_SIZE)
+        if not count:
+            raise OSError("connection closed")
+        return count
+
+    def _read_line(self) -> bytes:
+        while b"\r\n" not in self._pending:
+            if len(self._pending) > _MAX_HEADER_LINE:
+                raise ValueError("header line too long")
+            count = self._recv()
+            self._pending += bytes(memoryview(self._scratch)[:count])
+        line, self._pending = self._pending.split(b"\r\n", 1)
+        return line
+
+    def _read_body(self, length: int, keep: bool) -> bytes:
+        body = []
+        if self._pending:
+            taken = self._pending[:length]
+            self._pending = self._pending[length:]
+            length -= len(taken)
+            if keep:
+                body.append(taken)
+        while length > 0:
+            count = self._recv()
+            used = min(count, length)
+            if keep:
+                body.append(bytes(memoryview(self._scratch)[:used]))
+            if count > used:
+                # bytes past this body belong to the next framing line
+                self._pending = bytes(memoryview(self._scratch)[used:count])
+            length -= used
+        return b"".join(body)
@@ -0,0 +1,178 @@
+"""
+`wake_profile`
+================================================================================
+
+Lightweight per-phase timing of a wake cycle.
+
+``with span("wifi_connect"):`` measures a block with ``time.monotonic_ns()``.
+`save` appends this wake's spans to a fixed-size binary ring file right
+before deep sleep, through the wake's `heatseek.journal.Journal` so they go
+out with the rest of its writes. ``tools/profile_summary.py`` turns that
+file into per-phase percentiles on the host.
+
+File layout::
+
+    header: magic, capacity, next slot, wake counter
+    records: wake (u16), phase id (u8), pad, duration in microseconds (u32)
+
+"""
+import struct
+import time
+
+try:
+    from typing import Optional
+    from heatseek.journal import Journal
+except ImportError:
+    pass
+
+# Phase ids are their position in this tuple plus one, 0 marks an empty slot.
+# Only ever append to it so old logs keep decoding. A phase that is no longer
+# recorded keeps its slot.
+PHASES = (
+    "awake",
+    "blink",
+    "startup",
+    "sensor_init",
+    "wifi_connect",
+    "time_sync",
+    "upload",
+    "drain",
+    "sms_init",
+    "modem_reset",
+    "modem_ready",
+    "net_attach",
+    "sms_drain",
+    "sms_send",
+    "quiet_mode",
+    "store_write",
+    "sleep_fade",  # retired, the fade before deep sleep was removed
+    "sensor_read",
+    "archive_write",
+)
+
+PROFILE_MAGIC = b"HSP1"
+_HEADER_FORMAT = "<4sHHI"
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+_RECORD_FORMAT = "<HBxI"
+RECORD_SIZE = struct.calcsize(_RECORD_FORMAT)
+DEFAULT_CAPACITY = 512
+
+_WAKE_START = time.monotonic_ns()
+_spans = []
+
+
+def record(name: str, duration_ns: int) -> None:
+    """Records a phase duration measured elsewhere.
+
+    :param str name: Phase name, one of `PHASES`.
+    :param int duration_ns: Duration in nanoseconds.
+    """
+    _spans.append((PHASES.index(name) + 1, duration_ns // 1000))
+
+
+class span:  # pylint: disable=invalid-name
+    """Context manager that records how long its block took.
+
+    :param str name: Phase name, one of `PHASES`.
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._start = 0
+
+    def __enter__(self) -> "span":
+        self._start = time.monotonic_ns()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback) -> None:
+        record(self._name, time.monotonic_ns() - self._start)
+
+
+def spans() -> list:
+    """Returns this wake's (phase name, microseconds) pairs so far."""
+    return [(PHASES[phase - 1], micros) for phase, micros in _spans]
+
+
+def save(
+    path: str = "/profile.bin", capacity: int = DEFAULT_CAPACITY, journal: Optional[Journal] = None
+) -> None:
+    """Appends this wake's spans, plus the total awake time, to the ring file.
+
+    :param str path: Location of the profile log.
+    :param int capacity: Number of record slots, used when creating the file.
+    :param Journal journal: Journal to write through, None to write directly.
+    """
+    record("awake", time.monotonic_ns() - _WAKE_START)
+    header = _read(path, _HEADER_SIZE, journal)
+    if len(header) == _HEADER_SIZE and header[:4] == PROFILE_MAGIC:
+        _, capacity, slot, wake = struct.unpack(_HEADER_FORMAT, header)
+    else:
+        # missing or not a profile log, start a new one of the whole size at once
+        slot = wake = 0
+        _write(
+            path,
+            0,
+            struct.pack(_HEADER_FORMAT, PROFILE_MAGIC, capacity, 0, 0) + bytes(capacity * RECORD_SIZE),
+            journal,
+        )
+    wake += 1
+    # one write per run of slots, two when the ring wraps
+    start = slot
+    records = bytearray()
+    for phase, micros in _spans[-capacity:]:
+        records += struct.pack(_RECORD_FORMAT, wake & 0xFFFF, phase, min(micros, 0xFFFFFFFF))
+        slot = (slot + 1) % capacity
+        if slot == 0:
+            _write(path, _HEADER_SIZE + start * RECORD_SIZE, records, journal)
+            start = 0
+            records = bytearray()
+    if records:
+        _write(path, _HEADER_SIZE + start * RECORD_SIZE, records, journal)
+    _write(path, 0, struct.pack(_HEADER_FORMAT, PROFILE_MAGIC, capacity, slot, wake), journal)
+    _spans.clear()
+
+
+def _read(path: str, length: int, journal: Optional[Journal]) -> bytes:
+    if journal is not None:
+        return journal.read(path, 0, length)
+    try:
+        with open(path, "rb") as f:
+            return f.read(length)
+    except OSError:
+        return b""
+
+
+def _write(path: str, offset: int, data: bytes, journal: Optional[Journal]) -> None:
+    if journal is not None:
+        journal.write(path, offset, data)
+        return
+    try:
+        f = open(path, "r+b")
+    except OSError:
+        f = open(path, "w+b")
+    with f:
+        f.seek(offset)
+        f.write(data)
+
+
+def read(path: str) -> list:
+    """Returns every (wake, phase name, microseconds) record in a log file,
+    oldest first.
+
+    :param str path: Location of the profile log.
+    """
+    with open(path, "rb") as f:
+        magic, capacity, slot, _ = struct.unpack(_HEADER_FORMAT, f.read(_HEADER_SIZE))
+        if magic != PROFILE_MAGIC:
+            raise ValueError("not a profile log")
+        data = f.read(capacity * RECORD_SIZE)
+    records = []
+    for i in range(capacity):
+        offset = ((slot + i) % capacity) * RECORD_SIZE
+        if offset + RECORD_SIZE > len(data):
+            continue
+        wake, phase, micros = struct.unpack_from(_RECORD_FORMAT, data, offset)
+        if phase == 0 or phase > len(PHASES):
+            continue
+        records.append((wake, PHASES[phase - 1], micros))
+    return records
@@ -0,0 +1,159 @@
+"""
+`wake_supervisor`
+================================================================================
+
+Deadlines for a wake cycle, so that a hung connect, modem command or network
+attach can't keep the board awake until the battery is flat.
+
+The wake as a whole gets a budget, and each supervised phase gets its own
+budget inside it. The budgets are enforced in Python: polling loops call
+`WakeSupervisor.check`, a phase that starts after the deadline ends the wake
+at once, and the calls inside a phase carry their own timeouts.
+
+``microcontroller.watchdog`` is the backstop for a call that never returns.
+A ``WatchDogMode.RAISE`` timeout is only delivered when the VM runs again, so
+it can't reach a socket connect or UART read stuck inside the firmware. The
+watchdog runs in ``WatchDogMode.RESET`` instead, re-armed `RESET_MARGIN`
+seconds past whichever deadline comes first each time a phase starts or
+ends. A wake that is still stuck by then resets the board, and the next
+boot is a cold one.
+
+When a phase overruns, its ``with`` block hands the phase name to the
+``on_expire`` callback. code.py uses that to save the reading, log the
+phase and go to deep sleep. A `WakeTimeout` raised between phases reaches
+code.py's own error handlers instead, and they pass it to
+`WakeSupervisor.handle` to end the wake the same way.
+
+"""
+import time
+
+try:
+    from typing import Callable, Dict, Optional
+except ImportError:
+    pass
+
+try:
+    from watchdog import WatchDogMode
+except ImportError:
+    # not running on a board, only the polled deadlines work
+    WatchDogMode = None
+
+
+# Seconds the on_expire callback gets to save the reading and go to sleep
+EXPIRE_GRACE = 10
+# Seconds past the current deadline before the watchdog resets the board
+RESET_MARGIN = 15
+
+
+class WakeTimeout(Exception):
+    """A phase or the whole wake ran past its deadline."""
+
+
+class WakeSupervisor:
+    """Awake-time budgets for one wake.
+
+    :param float total_seconds: Budget for the whole wake.
+    :param dict phase_seconds: Budget per phase name. Phases not listed only get
+        the total.
+    :param on_expire: Called with the name of the phase that overran.
+    :param watchdog: ``microcontroller.watchdog``, None to rely on `check` only.
+    """
+
+    def __init__(
+        self,
+        total_seconds: float,
+        phase_seconds: Dict[str, float],
+        on_expire: Callable[[str], None],
+        watchdog=None,
+    ) -> None:
+        self._deadline = time.monotonic() + total_seconds
+        self._phase_seconds = phase_seconds
+        self._on_expire = on_expire
+        self._watchdog = watchdog if WatchDogMode is not None else None
+        self._phase_deadline = None
+        self.phase_name = None
+        self._arm()
+
+    @property
+    def remaining(self) -> float:
+        """Seconds left before the current deadline."""
+        deadline = self._deadline
+        if self._phase_deadline is not None:
+            deadline = min(deadline, self._phase_deadline)
+        return deadline - time.monotonic()
+
+    def check(self) -> None:
+        """Raises `WakeTimeout` if the current deadline has passed."""
+        if self.remaining <= 0:
+            raise WakeTimeout(self.phase_name or "wake")
+
+    def phase(self, name: str) -> "_Phase":
+        """Context manager that supervises one phase.
+
+        :param str name: Phase name, looked up in ``phase_seconds``.
+        """
+        return _Phase(self, name)
+
+    def handle(self, error: Exception) -> None:
+        """Hands a `WakeTimeout` caught outside any phase to ``on_expire``, as
+        phase ``"awake"``. Other errors are left to the caller.
+
+        :param Exception error: The exception that was caught.
+        """
+        if isinstance(error, WakeTimeout):
+            self._expire(self.phase_name or "awake")
+
+    def stop(self) -> None:
+        """Disarms the watchdog, call before going to sleep."""
+        if self._watchdog is not None:
+            self._watchdog.mode = None
+            self._watchdog = None
+
+    def _enter(self, name: str) -> None:
+        self.phase_name = name
+        budget = self._phase_seconds.get(name)
+        self._phase_deadline = None if budget is None else time.monotonic() + budget
+        self._arm()
+
+    def _leave(self) -> None:
+        self.phase_name = None
+        self._phase_deadline = None
+        self._arm()
+
+    def _expire(self, name: str) -> None:
+        print("Wake phase {} ran out of time".format(name))
+        # room for the callback to save the reading and go to sleep
+        self._deadline = time.monotonic() + EXPIRE_GRACE
+        self._leave()
+        self._on_expire(name)
+
+    def _arm(self) -> None:
+        if self._watchdog is None:
+            return
+        # the deadline itself is enforced in Python, the reset only comes
+        # once the wake is stuck well past it
+        self._watchdog.timeout = max(self.remaining, 0) + RESET_MARGIN
+        if self._watchdog.mode is None:
+            self._watchdog.mode = WatchDogMode.RESET
+        self._watchdog.feed()
+
+
+class _Phase:
+    def __init__(self, supervisor: WakeSupervisor, name: str) -> None:
+        self._supervisor = supervisor
+        self._name = name
+
+    def __enter__(self) -> "_Phase":
+        # pylint: disable=protected-access
+        self._supervisor._enter(self._name)
+        if self._supervisor.remaining <= 0:
+            self._supervisor._expire(self._name)
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback) -> Optional[bool]:
+        # pylint: disable=protected-access
+        if exception_type is not None and issubclass(exception_type, WakeTimeout):
+            self._supervisor._expire(self._name)
+        else:
+            self._supervisor._leave()
+        return None
@@ -0,0 +1,98 @@
+"""
+`wifi_manager`
+================================================================================
+
+WiFi connection manager that tries the network that worked last time first.
+
+The SSID, BSSID and channel of the last good association are kept in the
+`SleepState`. The next wake hands them straight to ``wifi.radio.connect`` with
+a tight timeout, which skips the full channel scan. If that fails, every
+candidate is tried in priority order with a normal scan and timeout.
+
+"""
+import time
+
+try:
+    from typing import List, Tuple
+    from heatseek.sleep_state import SleepState
+except ImportError:
+    pass
+
+# How the last connection was made
+SOURCE_NONE = 0
+SOURCE_CACHED = 1  # last good network with its cached BSSID and channel
+SOURCE_SCAN = 2  # priority order with a full scan
+
+
+def _pad_bssid(bssid: bytes) -> bytes:
+    # SleepState.load strips trailing NULs, which can be part of a BSSID
+    return bssid + bytes(6 - len(bssid))
+
+
+class WifiManager:
+    """Connects ``radio`` to one of ``candidates``.
+
+    :param radio: ``wifi.radio``.
+    :param list candidates: (network id, ssid, password) tuples in priority order.
+    :param SleepState state: Where the last good network is remembered.
+    :param float fast_timeout: Connect timeout when using the cached network, in seconds.
+    :param float timeout: Connect timeout for a scanned attempt, in seconds.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        radio,
+        candidates: List[Tuple[int, str, str]],
+        state: SleepState,
+        fast_timeout: float = 3,
+        timeout: float = 10,
+    ) -> None:
+        self._radio = radio
+        self._candidates = candidates
+        self._state = state
+        self._fast_timeout = fast_timeout
+        self._timeout = timeout
+
+    def connect(self) -> int:
+        """Connects and returns the id of the network that worked.
+
+        Raises ``ConnectionError`` when no candidate could be joined.
+        """
+        state = self._state
+        for network, ssid, password in self._candidates:
+            if network == state.network and state.wifi_channel:
+                print("Connecting to last good network %s on channel %d" % (ssid, state.wifi_channel))
+                if self._attempt(network, ssid, password, SOURCE_CACHED,
+                                 channel=state.wifi_channel,
+                                 bssid=_pad_bssid(state.wifi_bssid),
+                                 timeout=self._fast_timeout):
+                    return network
+        for network, ssid, password in self._candidates:
+            print("Connecting to %s" % ssid)
+            if self._attempt(network, ssid, password, SOURCE_SCAN, timeout=self._timeout):
+                return network
+        state.wifi_channel = 0
+        state.wifi_source = SOURCE_NONE
+        raise ConnectionError("no WiFi network could be joined")
+
+    # pylint: disable=too-many-arguments
+    def _attempt(self, network: int, ssid: str, password: str, source: int, **kwargs) -> bool:
+        start = time.monotonic_ns()
+        try:
+            self._radio.connect(ssid, password, **kwargs)
+        except ConnectionError as e:
+            print("Could not join %s: %s" % (ssid, e))
+            return False
+        elapsed_ms = (time.monotonic_ns() - start) // 1000000
+        state = self._state
+        state.network = network
+        state.wifi_source = source
+        state.wifi_connect_ms = min(elapsed_ms, 0xFFFF)
+        ap_info = self._radio.ap_info
+        if ap_info is not None:
+            state.wifi_bssid = bytes(ap_info.bssid)
+            state.wifi_channel = ap_info.channel
+        print("Connected to %s in %dms (%s)" % (
+            ssid, elapsed_ms, "cached" if source == SOURCE_CACHED else "scan"))
+        return True
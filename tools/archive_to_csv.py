@@ -0,0 +1,42 @@
+"""Expand the on-device reading archive back to CSV.
+
+Copy the ``archive`` directory from the CIRCUITPY drive, then run::
+
+    python3 tools/archive_to_csv.py archive > temperature.csv
+
+Rows come out oldest first in the old ``temperature.txt`` column order: time,
+temperature (F), humidity, power mode, battery voltage. A summary of how much
+flash each reading took goes to stderr.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# pylint: disable=wrong-import-position
+from heatseek.archive import read
+
+
+def main(directory):
+    """Writes every archived reading in ``directory`` to stdout."""
+    count = 0
+    for ts, temp, humidity, power_mode, voltage in read(directory):
+        print("{},{:.2f},{:.2f},{},{:.3f}".format(ts, temp, humidity, power_mode, voltage))
+        count += 1
+    size = sum(
+        os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+    )
+    if count:
+        print(
+            "{} readings in {} bytes, {:.1f} bytes each".format(count, size, size / count),
+            file=sys.stderr,
+        )
+    else:
+        print("no readings in {}".format(directory), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("usage: archive_to_csv.py <archive directory>")
+        sys.exit(1)
+    main(sys.argv[1])
@@ -0,0 +1,171 @@
+"""Host-side checks and benchmark for adafruit_fona.at_reply.
+
+Run from the repository root::
+
+    python3 tools/at_reply_bench.py
+
+Every recorded SIM800, SIM5320 and SARA-R410 reply below is parsed, both as
+bytes and as a memoryview like the ones the driver's receive buffer hands
+out, and the run fails if a field does not come back as expected. It then
+times the parser against the old decode-and-split ``_parse_reply`` and
+prints the peak memory each call allocates. The old parser is faster per
+call on CPython, the new one is there to allocate less.
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# pylint: disable=wrong-import-position
+from adafruit_fona.at_reply import bytes_field, int_field
+
+# Expected value for a field that isn't there at all
+MISSING = "missing"
+
+# (module, reply as read by _read_line, prefix, field number, expected)
+# An int expected value is read with int_field and bytes with bytes_field.
+# None means int_field finds no number, MISSING that both return None.
+RECORDED = (
+    ("SIM800", b"+CREG: 0,1", b"+CREG: ", 1, 1),
+    ("SIM800", b"+CREG: 0,5", b"+CREG: ", 1, 5),
+    ("SIM800", b"+CSQ: 17,0", b"+CSQ: ", 0, 17),
+    ("SIM800", b"+CSQ: 99,99", b"+CSQ: ", 0, 99),
+    ("SIM800", b"+CGATT: 1", b"+CGATT: ", 0, 1),
+    ("SIM800", b"+CGATT: 0", b"+CGATT: ", 0, 0),
+    ("SIM800", b"+CNMI: 2,1,0,0,0", b"+CNMI:", 1, 1),
+    ("SIM800", b'+CMTI: "SM",3', b"+CMTI: ", 1, 3),
+    ("SIM800", b'+CMTI: "SM",3', b"+CMTI: ", 0, b"SM"),
+    ("SIM800", b'+CPMS: "SM",3,30,"SM",3,30,"SM",3,30', b'"SM",', 0, 3),
+    ("SIM800", b'+CPMS: "SM_P",0,50,"SM_P",0,50,"SM_P",0,50', b'"SM_P",', 0, 0),
+    (
+        "SIM800",
+        b'+CMGR: "REC UNREAD","+15551234567","","22/11/06,22:32:30-20",145,4,0,0,'
+        b'"+12063130004",145,5',
+        b"+CMGR:",
+        1,
+        b"+15551234567",
+    ),
+    (
+        "SIM800",
+        b'+CMGR: "REC UNREAD","+15551234567","","22/11/06,22:32:30-20",145,4,0,0,'
+        b'"+12063130004",145,5',
+        b"+CMGR:",
+        10,
+        5,
+    ),
+    (
+        "SIM800",
+        b'+CMGR: "REC UNREAD","+15551234567","","22/11/06,22:32:30-20",145,4,0,0,'
+        b'"+12063130004",145,5',
+        b"+CMGR:",
+        3,
+        b"22/11/06,22:32:30-20",
+    ),
+    ("SIM800", b"+CIPRXGET: 4,0,120", b"+CIPRXGET: 4,0,", 0, 120),
+    ("SIM800", b"+CIPRXGET: 4,0,0", b"+CIPRXGET: 4,0,", 0, 0),
+    ("SIM800", b'+CDNSGIP: 1,"relay.heatseek.org","52.20.10.3"', b"+CDNSGIP:", 2, b"52.20.10.3"),
+    ("SIM800", b'C: 0,0,"TCP","52.20.10.3","80","CONNECTED"', b"C:", 5, b"CONNECTED"),
+    ("SIM800", b'C: 1,,"","","","INITIAL"', b"C:", 5, b"INITIAL"),
+    ("SIM800", b'C: 1,,"","","","INITIAL"', b"C:", 1, b""),
+    ("SIM800", b'+CIPSTATUS: 0,0,"TCP","52.20.10.3","80","CONNECTED"', b"+CIPSTATUS:", 3, b"52.20.10.3"),
+    # echo still on: the prefix is not at the start of the reply
+    ("SIM800", b"AT+CSQ\n+CSQ: 21,0\nOK", b"+CSQ: ", 0, 21),
+    ("SIM800", b"AT+CREG?\n+CREG: 0,1\nOK", b"+CREG: ", 1, 1),
+    ("SIM800", b"+CREG: 0,1\nOK", b"+CREG: ", 2, MISSING),
+    ("SIM5320", b"+CGPS: 1,1", b"+CGPS: ", 0, 1),
+    ("SIM5320", b"+CGPS: 0,1", b"+CGPS: ", 0, 0),
+    ("SIM5320", b'+CIPOPEN: 0,"TCP","52.20.10.3",80,-1', b"+CIPOPEN:", 2, b"52.20.10.3"),
+    ("SIM5320", b'+CIPOPEN: 0,"TCP","52.20.10.3",80,-1', b"+CIPOPEN: ", 4, -1),
+    ("SIM5320", b"+CIPOPEN: 1", b"+CIPOPEN: ", 1, MISSING),
+    ("SIM5320", b"+CIPSEND: 0,36,36", b"+CIPSEND:", 1, 36),
+    ("SIM5320", b"+CIPCLOSE: 1,0,0,0,0,0,0,0,0,0", b"+CIPCLOSE:", 0, 1),
+    ("SIM5320", b"+CIPCLOSE: 1,0,0,0,0,0,0,0,0,0", b"+CIPCLOSE:", 3, 0),
+    ("SIM5320", b"+IPADDR: 10.170.3.21", b"+IPADDR:", 0, b"10.170.3.21"),
+    ("SIM5320", b"+CPSI: WCDMA,Online,310-410,0x1A2B,123456,WCDMA IMT 2000", b"+CPSI: ", 0, b"WCDMA"),
+    ("SIM5320", b"+CIPTIMEOUT: 30000,20000,40000", b"+CIPTIMEOUT:", 2, 40000),
+    ("SIM5320", b'+CDNSGIP: 1,"relay.heatseek.org","52.20.10.3"', b"+CDNSGIP: ", 2, b"52.20.10.3"),
+    ("SARA-R410", b'+CEREG: 2,5,"1A2B","01A2D301",7', b"+CEREG: ", 1, 5),
+    ("SARA-R410", b'+CEREG: 2,5,"1A2B","01A2D301",7', b"+CEREG: ", 3, b"01A2D301"),
+    ("SARA-R410", b"+CREG: 0,0", b"+CREG: ", 1, 0),
+    ("SARA-R410", b"+CSQ: 99,99", b"+CSQ: ", 0, 99),
+    ("SARA-R410", b'+CCLK: "22/11/06,22:32:30-20"', b"+CCLK: ", 0, b"22/11/06,22:32:30-20"),
+    ("SARA-R410", b"+CGATT: 1", b"+CGATT: ", 0, 1),
+    ("SARA-R410", b"+CME ERROR: 3", b"+CME ERROR: ", 0, 3),
+    ("SARA-R410", b"ERROR", b"+CSQ: ", 0, MISSING),
+    ("SARA-R410", b"+CSQ: ,99", b"+CSQ: ", 0, None),
+    ("SARA-R410", b"+CSQ: ,99", b"+CSQ: ", 0, b""),
+    ("SARA-R410", b"+CSQ: x1,99", b"+CSQ: ", 0, None),
+)
+
+
+def old_parse_reply(buf, reply, divider=",", idx=0):
+    """The decode-and-split parser this module replaced, kept for comparison,
+    including its habit of slicing from ``len(reply)`` instead of from where
+    the prefix was found."""
+    parsed_reply = buf.find(reply)
+    if parsed_reply == -1:
+        return None
+    parsed_reply = buf[len(reply) :]
+    parsed_reply = parsed_reply.decode("utf-8")
+    parsed_reply = parsed_reply.split(divider)
+    parsed_reply = parsed_reply[idx]
+    try:
+        return int(parsed_reply)
+    except ValueError:
+        return parsed_reply
+
+
+def check_recorded():
+    """Parses every recorded reply and checks the field, returns the count."""
+    for module, reply, prefix, idx, expected in RECORDED:
+        for buf in (reply, memoryview(reply)):
+            if expected is MISSING:
+                got = (int_field(buf, prefix, idx), bytes_field(buf, prefix, idx))
+                assert got == (None, None), (module, reply, idx, got)
+            elif expected is None or isinstance(expected, int):
+                got = int_field(buf, prefix, idx)
+                assert got == expected, (module, reply, idx, got)
+            else:
+                got = bytes(bytes_field(buf, prefix, idx))
+                assert got == expected, (module, reply, idx, got)
+    return len(RECORDED)
+
+
+def measure(parse, reply, prefix, idx, rounds):
+    """Microseconds per call and the most memory a call holds at once."""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        parse(reply, prefix, idx=idx)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    for _ in range(100):
+        parse(reply, prefix, idx=idx)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / rounds * 1e6, peak
+
+
+def main():
+    """Checks the recorded replies and prints the benchmark table."""
+    print("{} recorded replies parsed correctly".format(check_recorded()))
+    cases = (
+        ("+CREG idx 1", b"+CREG: 0,1", b"+CREG: ", 1),
+        ("+CSQ", b"+CSQ: 17,0", b"+CSQ: ", 0),
+        ("+CIPRXGET", b"+CIPRXGET: 4,0,120", b"+CIPRXGET: 4,0,", 0),
+        ("+CIPSEND", b"+CIPSEND: 0,36,36", b"+CIPSEND:", 1),
+    )
+    rounds = 20000
+    print("{:<12} {:>10} {:>10} {:>12} {:>12}".format(
+        "reply", "old (us)", "new (us)", "old (peak B)", "new (peak B)"))
+    for name, reply, prefix, idx in cases:
+        old_us, old_bytes = measure(old_parse_reply, reply, prefix, idx, rounds)
+        new_us, new_bytes = measure(int_field, reply, prefix, idx, rounds)
+        print("{:<12} {:>10.2f} {:>10.2f} {:>12d} {:>12d}".format(
+            name, old_us, new_us, old_bytes, new_bytes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Print the error log copied off a device.
+
+Copy ``errors.bin`` from the CIRCUITPY drive, then run::
+
+    python3 tools/error_log_dump.py errors.bin
+
+Prints the lifetime count per error code, then the kept records oldest
+first: sequence number, UTC time, code, wake phase, detail and message.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# pylint: disable=wrong-import-position
+from heatseek.error_log import CODE_NAMES, read
+
+
+def main(path):
+    """Prints the counters and records of one error log."""
+    with open(path, "rb") as f:
+        counters, entries = read(f.read())
+    for code, count in enumerate(counters):
+        if count:
+            name = CODE_NAMES[code] if code < len(CODE_NAMES) else str(code)
+            print("{:<10} {:>8}".format(name, count))
+    print()
+    for seq, timestamp, code, phase, detail, message in entries:
+        print("{:>6} {} {:<8} {:<14} {:>5} {}".format(
+            seq,
+            time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(timestamp)),
+            code,
+            phase,
+            detail,
+            message,
+        ))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("usage: error_log_dump.py <errors.bin>")
+        sys.exit(1)
+    main(sys.argv[1])
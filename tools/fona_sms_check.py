@@ -0,0 +1,116 @@
+"""Host-side check of adafruit_fona's SMS send against a scripted modem.
+
+Run from the repository root::
+
+    python3 tools/fona_sms_check.py
+
+The modem's settings are restored from a saved `FONA.state`, as on a wake
+from deep sleep, so ``AT+CMGF=1`` is a cache hit and is not sent. A stray
+``OK`` from an earlier command is left waiting in the UART, and the run fails
+unless the message still goes out on the ``>`` prompt. It is then repeated
+with an empty cache, where ``AT+CMGF=1`` is sent first.
+"""
+import contextlib
+import io
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# CircuitPython modules the driver imports, only their names are used here
+for name, attrs in (
+    ("busio", {"UART": object}),
+    ("circuitpython_typing", {"ReadableBuffer": bytes}),
+    ("digitalio", {"DigitalInOut": object}),
+    ("micropython", {"const": lambda value: value}),
+    ("simpleio", {"map_range": lambda *args: 0}),
+):
+    sys.modules.setdefault(name, types.SimpleNamespace(**attrs))
+
+# pylint: disable=wrong-import-position
+from adafruit_fona.adafruit_fona import FONA, FONA_800_L, MODEM_SETTINGS
+
+RELAY = 15551234567
+
+
+class Pin:
+    """Reset pin that is never expected to be pulsed."""
+
+    value = True
+
+    def switch_to_output(self):
+        raise AssertionError("modem was reset")
+
+    def switch_to_input(self):
+        pass
+
+
+class Modem:
+    """Echo off, OK to every command, the SMS prompt and send reply for
+    ``AT+CMGS``."""
+
+    def __init__(self):
+        self.pending = bytearray()
+        self.written = []
+
+    def write(self, data):
+        self.written.append(bytes(data))
+        if data.endswith(b"\x1a"):
+            self.pending += b"\r\n+CMGS: 12\r\n\r\nOK\r\n"
+        elif data.startswith(b"AT+CMGS="):
+            self.pending += b"\r\n> "
+        elif data.endswith(b"\r\n"):
+            self.pending += b"\r\nOK\r\n"
+
+    @property
+    def in_waiting(self):
+        return len(self.pending)
+
+    def readinto(self, buf):
+        count = min(len(buf), len(self.pending))
+        buf[:count] = self.pending[:count]
+        del self.pending[:count]
+        return count
+
+    def read(self, count=1):
+        data = bytes(self.pending[:count])
+        del self.pending[:count]
+        return data
+
+    def reset_input_buffer(self):
+        self.pending = bytearray()
+
+    def sent(self, command):
+        return sum(1 for data in self.written if data.strip() == command)
+
+
+def send(state):
+    """Brings up a FONA with ``state`` and sends one SMS after a stray OK,
+    returns the result and the modem."""
+    modem = Modem()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fona = FONA(modem, Pin(), state=state)
+        fona._debug = False  # pylint: disable=protected-access
+        # left over from the AT+CCLK? before the drain
+        modem.pending += b"\r\nOK\r\n"
+        sent = fona.send_sms(RELAY, "#1 test")
+    return sent, modem
+
+
+def main():
+    """Runs the cache hit and cache miss sends."""
+    every_setting = (1 << len(MODEM_SETTINGS)) - 1
+    sent, modem = send((FONA_800_L, every_setting))
+    assert modem.sent(b"AT+CMGF=1") == 0, "text mode was not taken from the cache"
+    assert sent, "SMS failed with text mode cached"
+    print("cache hit: sent without AT+CMGF=1")
+
+    sent, modem = send((FONA_800_L, 0))
+    assert modem.sent(b"AT+CMGF=1") == 1, "text mode was not set"
+    assert sent, "SMS failed after setting text mode"
+    print("cache miss: sent after AT+CMGF=1")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Summarise the wake-cycle profile log copied off a device.
+
+Copy ``profile.bin`` from the CIRCUITPY drive, then run::
+
+    python3 tools/profile_summary.py profile.bin
+
+Prints, per phase, how many wakes it showed up in and the p50/p90/p99/max
+duration in milliseconds, with each phase's share of total awake time.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# pylint: disable=wrong-import-position
+from heatseek.wake_profile import PHASES, read
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0
+    rank = max(0, min(len(values) - 1, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+def main(path):
+    """Prints the summary table for one profile log."""
+    per_phase = {}
+    wakes = set()
+    for wake, phase, micros in read(path):
+        wakes.add(wake)
+        per_phase.setdefault(phase, []).append(micros / 1000)
+    if not per_phase:
+        print("no records in {}".format(path))
+        return
+
+    awake_total = sum(per_phase.get("awake", [])) or 1
+    print("{} wakes in {}".format(len(wakes), path))
+    print("{:<14} {:>6} {:>9} {:>9} {:>9} {:>9} {:>7}".format(
+        "phase", "count", "p50 ms", "p90 ms", "p99 ms", "max ms", "share"))
+    for phase in PHASES:
+        values = sorted(per_phase.get(phase, []))
+        if not values:
+            continue
+        print("{:<14} {:>6} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>6.1f}%".format(
+            phase,
+            len(values),
+            percentile(values, 50),
+            percentile(values, 90),
+            percentile(values, 99),
+            values[-1],
+            100 * sum(values) / awake_total,
+        ))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("usage: profile_summary.py <profile.bin>")
+        sys.exit(1)
+    main(sys.argv[1])
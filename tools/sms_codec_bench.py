@@ -0,0 +1,114 @@
+"""Host-side round-trip and density benchmark for heatseek.sms_codec.
+
+Run from the repository root::
+
+    python3 tools/sms_codec_bench.py
+
+Every generated series is encoded and decoded again, and the run fails if a
+reading does not come back to within the codec's 0.1 resolution. It then
+prints how many readings fit in one SMS, compared with the old JSON format.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# pylint: disable=wrong-import-position
+from heatseek.sms_codec import EPOCH, SMS_LENGTH, decode, encode
+
+CELL_ID = "feather_AAA"
+INTERVAL = 3601
+
+
+def json_readings_per_sms(readings):
+    """Readings per message with the old hand-built JSON format."""
+    head = '{{"c":"{}","i":"{}","r":['.format(CELL_ID, INTERVAL)
+    body = []
+    for qtime, qtemp, qhumidity in readings:
+        body.append(
+            '{{"ti":"{}","te":"{}","h":"{}"}}'.format(
+                qtime - EPOCH, round(qtemp, 1), round(qhumidity, 1)
+            )
+        )
+        if len(head + ",".join(body) + "]}") > SMS_LENGTH:
+            return len(body) - 1
+    return len(body)
+
+
+def series(rng, count, jitter, temp_step, humidity_step, gap_chance):
+    """Random walk of readings roughly INTERVAL seconds apart."""
+    qtime = int(time.time())
+    temp = rng.uniform(55, 80)
+    humidity = rng.uniform(20, 70)
+    readings = []
+    for _ in range(count):
+        readings.append((qtime, temp, humidity))
+        qtime += INTERVAL + rng.randint(-jitter, jitter)
+        if rng.random() < gap_chance:
+            qtime += INTERVAL * rng.randint(1, 24)
+        temp = min(110, max(-20, temp + rng.uniform(-temp_step, temp_step)))
+        humidity = min(100, max(0, humidity + rng.uniform(-humidity_step, humidity_step)))
+    return readings
+
+
+def check_round_trip(readings):
+    """Encodes the whole series message by message and checks every reading."""
+    pending = list(readings)
+    messages = 0
+    while pending:
+        message, count = encode(CELL_ID, INTERVAL, pending)
+        assert count > 0, "no reading fits in a message"
+        assert len(message) <= SMS_LENGTH, "message too long"
+        cell_id, interval, decoded = decode(message)
+        assert cell_id == CELL_ID and interval == INTERVAL
+        assert len(decoded) == count
+        for (qtime, qtemp, qhumidity), (dtime, dtemp, dhumidity) in zip(
+            pending, decoded
+        ):
+            assert qtime == dtime, (qtime, dtime)
+            assert abs(qtemp - dtemp) <= 0.05 + 1e-9, (qtemp, dtemp)
+            assert abs(qhumidity - dhumidity) <= 0.05 + 1e-9, (qhumidity, dhumidity)
+        pending = pending[count:]
+        messages += 1
+    return messages
+
+
+def main():
+    """Runs every profile and prints a density table."""
+    rng = random.Random(1)
+    profiles = (
+        # name, clock jitter (s), temp step (F), humidity step (%), gap chance
+        ("steady", 2, 0.3, 0.5, 0.0),
+        ("typical", 5, 1.5, 3.0, 0.01),
+        ("noisy", 30, 5.0, 10.0, 0.05),
+    )
+    print("{:<8} {:>10} {:>10} {:>9} {:>12}".format(
+        "profile", "codec/sms", "json/sms", "gain", "encode (us)"))
+    for name, jitter, temp_step, humidity_step, gap_chance in profiles:
+        readings = series(rng, 2000, jitter, temp_step, humidity_step, gap_chance)
+        messages = check_round_trip(readings)
+
+        start = time.perf_counter()
+        rounds = 0
+        pending = readings
+        while pending:
+            _, count = encode(CELL_ID, INTERVAL, pending)
+            pending = pending[count:]
+            rounds += 1
+        elapsed = time.perf_counter() - start
+
+        codec_density = len(readings) / messages
+        json_density = json_readings_per_sms(readings)
+        print("{:<8} {:>10.1f} {:>10d} {:>8.1f}x {:>12.1f}".format(
+            name,
+            codec_density,
+            json_density,
+            codec_density / json_density,
+            elapsed / rounds * 1e6,
+        ))
+
+
+if __name__ == "__main__":
+    main()